@@ -0,0 +1,144 @@
+#Steps of sens.tree.comb.py as functions, so they can be run one by one from the notebook or as the cached stages
+#of pipeline.py: read decoded sensor csv files and gpx track, align them in time, interpolate the location,
+#match trees around every located air measurement and create the air-tree outputs for a radius.
+
+import pandas as pd
+import numpy as np
+from tree_matcher import TreeMatcher
+from gpx_reader import read_gpx_track
+from table_io import read_table
+from alignment import NS_PER_SECOND, to_epoch_ns, utc_to_local_ns, asof_join, interpolate_inside
+
+#tree database columns added to every match (after objectid, lat, lon)
+TREE_ATTRIBUTES = ['borough', 'gla_tree_group', 'tree_name', 'taxon_name', 'age', 'age_group', 'spread_m', 'height_m',
+                   'diameter_at_breast_height_cm', 'gdb_geomattr_data', 'load_date', 'updated']
+
+
+#create pandas dataframe from decoded sensor measurements (csv or parquet, created by import_data.py) - every env
+#measurement gets the last meteo measurement at or before its time, at most 'tolerance' seconds older (0: same time only)
+def read_sensor(env_data_path, meteo_data_path, tolerance=0):
+    df_env = read_table(env_data_path)
+    df_meteo = read_table(meteo_data_path)
+
+    df_env['time'] = pd.to_datetime(df_env['time'], format='ISO8601') # converts to datetime format to match gpx data
+    df_meteo['time'] = pd.to_datetime(df_meteo['time'], format='ISO8601')
+
+    #add env and meteo data into combined pd dataframe
+    return asof_join(df_env, df_meteo, tolerance)
+
+
+#read gpx data (points of all tracks, see gpx_reader.py) - gpx times (UTC) are converted to the local time of the
+#sensor in 'timezone', with the offset of each point's date (daylight saving time). A fixed utc_offset (hours) can
+#be given instead.
+def read_gpx(gpx_file_path, timezone='Europe/London', utc_offset=None, engine='stream'):
+    track = read_gpx_track(gpx_file_path, engine)
+    utc_ns = to_epoch_ns(track.time)
+    if utc_offset is None:
+        local_ns = utc_to_local_ns(utc_ns, timezone)
+    else:
+        local_ns = utc_ns + int(round(utc_offset * 3600 * NS_PER_SECOND))
+    return pd.DataFrame({
+        'time': local_ns.view('datetime64[ns]'),
+        'latitude': track.latitude,
+        'longitude': track.longitude,
+        'elevation': track.elevation,
+    })
+
+
+#add dataframes from sensor and gpx into one file - every air measurement gets the last gpx point at or before its
+#time, at most 'tolerance' seconds older (0: same time only)
+def align(df_sens_comb, df_gpx, tolerance=0):
+    return asof_join(df_sens_comb, df_gpx, tolerance)
+
+
+#interpolate missing lon/lat/elevation data in gpx files - only up to 'limit' values between measured points
+def interpolate(df_sens_gpx, limit=10):
+    df_sens_gpx = df_sens_gpx.copy()
+    cols = ['latitude', 'longitude', 'elevation']
+    df_sens_gpx[cols] = interpolate_inside(df_sens_gpx[cols].to_numpy(dtype=float), limit)
+    return df_sens_gpx
+
+
+#keep the air measurements with a location and number them ('Index')
+def located(df_sens_gpx):
+    df_sens_gpx = df_sens_gpx.copy()
+    df_sens_gpx['latitude'] = df_sens_gpx['latitude'].replace('', np.nan)
+    df_sens_gpx = df_sens_gpx.dropna(axis=0, subset=['latitude'])
+
+    df_sens_gpx_index = np.arange(0,len(df_sens_gpx),1)
+    df_sens_gpx['Index'] = df_sens_gpx_index
+    return df_sens_gpx
+
+
+#specify the edges of sample area (air measurements plus approx. 100m on each edge)
+def sampling_area(df_sens_gpx):
+    max_lat = df_sens_gpx['latitude'].max() + 0.001
+    min_lat = df_sens_gpx['latitude'].min() - 0.001
+    max_lon = df_sens_gpx['longitude'].max() + 0.0015
+    min_lon = df_sens_gpx['longitude'].min() - 0.0015
+    return min_lat, max_lat, min_lon, max_lon
+
+
+#Match trees (df_trees, e.g. from TreeCache.load_bbox) to the located air measurements.
+#Adds 'Dist_to_closest_tree' to df_sens_gpx and returns it with the (air measurement, tree number, distance) pairs
+#for all trees within max_radius (m) - outputs for smaller radii are a subset of these (see air_tree_products).
+#Air measurements and trees are identified by their position in df_sens_gpx ('Index') and df_trees.
+#A matcher already built for df_trees (e.g. by live.py, which matches many small batches) can be passed in.
+def match_trees(df_sens_gpx, df_trees, max_radius, matcher=None):
+    #convert lat long to numpy array
+    loc_air_deg = df_sens_gpx[['latitude','longitude']].to_numpy()
+
+    # Trees are put into a spatial index (grid of cells as wide as the largest radius, see tree_matcher.py) so only
+    # trees near each air measurement are checked, instead of building the full air x tree distance matrix.
+    if matcher is None:
+        loc_trees_deg = df_trees[['lat','lon']].to_numpy()
+        matcher = TreeMatcher(loc_trees_deg[:,0], loc_trees_deg[:,1], cell_size=max_radius)
+
+    #add minimum distance to df_sens_gpx dataframe
+    df_sens_gpx = df_sens_gpx.reset_index(drop=True)
+    df_sens_gpx['Dist_to_closest_tree'] = matcher.nearest(loc_air_deg[:,0], loc_air_deg[:,1])
+
+    #pairs are ordered by air measurement then tree (row number in df_trees)
+    pairs = matcher.query(loc_air_deg[:,0], loc_air_deg[:,1], max_radius)
+    return df_sens_gpx, pairs
+
+
+#Create the air-tree outputs for a single radius d from the pairs found for the largest radius (match_trees).
+#Tree attributes are taken by position from df_trees, so trees sharing coordinates each keep their own row.
+def air_tree_products(df_sens_gpx, df_trees, pairs, d):
+    air_within_max, index_within_max, values_within_max = pairs
+
+    #get trees within d
+    within_d = values_within_max <= d
+    air = air_within_max[within_d]
+    tree = index_within_max[within_d]
+
+    df_air_tree = pd.DataFrame({
+        'Air measurement': air,
+        'Tree number_x': tree,
+        #unique identifier of each measurement and tree
+        'Air-tree ID': pd.Series(air).astype(str) + '_' + pd.Series(tree).astype(str),
+        'Distance_to_tree': values_within_max[within_d],
+    })
+    #categorical attributes (tree names are already canonical, see tree_species.py) are gathered as codes
+    trees = df_trees.iloc[tree]
+    for col in ['objectid', 'lat', 'lon']:
+        df_air_tree[col] = trees[col].array
+    df_air_tree['Tree_within_d_(default: 20m)'] = True
+    for col in TREE_ATTRIBUTES:
+        df_air_tree[col] = trees[col].array
+
+    #Add air measurement data to the measurement points used to establish trees within d and distance between trees
+    #and air measurements - each measurement ('Index' is its row number) gets one row per tree within d, or one row
+    #without tree. Pairs are ordered by measurement, so the pairs of a measurement follow each other.
+    n_air = len(df_sens_gpx)
+    n_pairs = np.bincount(air, minlength=n_air)
+    n_rows = np.maximum(n_pairs, 1)
+    rows = np.repeat(np.arange(n_air), n_rows)
+    nth = np.arange(len(rows)) - np.repeat(np.cumsum(n_rows) - n_rows, n_rows)
+    pair = np.where(n_pairs[rows] > 0, (np.cumsum(n_pairs) - n_pairs)[rows] + nth, -1)
+
+    sens_gpx_tree = pd.concat([df_sens_gpx.drop('Index', axis=1).iloc[rows].reset_index(drop=True),
+                               df_air_tree.reindex(pair).reset_index(drop=True)], axis=1)
+
+    return df_air_tree, sens_gpx_tree
@@ -0,0 +1,90 @@
+#Time alignment of the sensor and gps streams on sorted int64 epoch arrays (nanoseconds).
+#Streams are combined with as-of joins: every row of the left stream takes the values of the last row of the right
+#stream at or before its time, if that row is at most 'tolerance' seconds older (tolerance 0 only matches rows with
+#the same time). Gaps in the coordinates are interpolated linearly in one pass over all columns.
+
+import numpy as np
+import pandas as pd
+
+NS_PER_SECOND = 1_000_000_000
+
+
+#int64 nanoseconds of naive (wall clock) datetime values
+def to_epoch_ns(times):
+    return np.asarray(times, dtype='datetime64[ns]').astype(np.int64)
+
+
+#Convert UTC epochs to the local wall clock time of 'timezone' (e.g. gps times to the time of the sensor log).
+#The offset is looked up for every point, so sessions in summer time get +1h and winter sessions +0h.
+def utc_to_local_ns(utc_ns, timezone='Europe/London'):
+    utc_ns = np.asarray(utc_ns, dtype=np.int64)
+    local = pd.DatetimeIndex(utc_ns.view('datetime64[ns]'), tz='UTC').tz_convert(timezone)
+    return local.tz_localize(None).asi8
+
+
+#offset (hours) of 'timezone' from UTC at noon of the session date - for reporting and checks
+def session_utc_offset(session_date, timezone='Europe/London'):
+    noon = pd.Timestamp(session_date) + pd.Timedelta(hours=12)
+    return noon.tz_localize(timezone).utcoffset().total_seconds() / 3600
+
+
+#For every left time the index of the last right time at or before it within tolerance (s), -1 if there is none.
+#right_ns must be sorted.
+def asof_indices(left_ns, right_ns, tolerance=0):
+    left_ns = np.asarray(left_ns, dtype=np.int64)
+    right_ns = np.asarray(right_ns, dtype=np.int64)
+    idx = np.searchsorted(right_ns, left_ns, side='right') - 1
+    found = idx >= 0
+    found[found] = left_ns[found] - right_ns[idx[found]] <= int(round(tolerance * NS_PER_SECOND))
+    idx[~found] = -1
+    return idx
+
+
+#values of 'column' at the rows idx (-1 gives NaN). The dtype is kept if every row is found.
+def take(column, idx):
+    column = np.asarray(column)
+    if len(column) and (idx >= 0).all():
+        return column[idx]
+    values = column[np.maximum(idx, 0)] if len(column) else np.full(len(idx), np.nan)
+    values = values.astype(np.result_type(values.dtype, np.float64))
+    values[idx < 0] = np.nan
+    return values
+
+
+#As-of join of two dataframes with a 'time' column - returns the rows of left ordered by time, with the
+#columns of right added
+def asof_join(left, right, tolerance=0):
+    left_ns = to_epoch_ns(left['time'])
+    order = np.argsort(left_ns, kind='stable')
+    right_ns = to_epoch_ns(right['time'])
+    right_order = np.argsort(right_ns, kind='stable')
+    idx = asof_indices(left_ns[order], right_ns[right_order], tolerance)
+    idx = np.where(idx >= 0, right_order[np.maximum(idx, 0)], -1)
+
+    data = {name: left[name].to_numpy()[order] for name in left.columns}
+    for name in right.columns:
+        if name != 'time':
+            data[name] = take(right[name].to_numpy(), idx)
+    return pd.DataFrame(data)
+
+
+#Linear interpolation (by row position) of the NaN values of every column of the 2d array 'values' that lie between
+#two known values, at most 'limit' rows after the last known value - the same result as
+#Series.interpolate(method='linear', limit=limit, limit_area='inside') for each column.
+def interpolate_inside(values, limit=10):
+    values = np.array(values, dtype=float, ndmin=2, copy=True)
+    n = values.shape[0]
+    if n == 0:
+        return values
+    rows = np.arange(n)[:, None]
+    known = ~np.isnan(values)
+    #row of the previous and next known value of each cell (-1 / n if there is none)
+    prev = np.maximum.accumulate(np.where(known, rows, -1), axis=0)
+    next_ = np.minimum.accumulate(np.where(known, rows, n)[::-1], axis=0)[::-1]
+    fill = ~known & (prev >= 0) & (next_ < n) & (rows - prev <= limit)
+    cols = np.nonzero(fill)[1]
+    p, q, r = prev[fill], next_[fill], np.nonzero(fill)[0]
+    fp, fq = values[p, cols], values[q, cols]
+    slope = (fq - fp) / (q - p)
+    values[fill] = slope * (r - p) + fp
+    return values
@@ -0,0 +1,65 @@
+#Benchmark of the streaming gpx reader (gpx_reader.py) against parsing with gpxpy and building the dataframe point by
+#point, as sens.tree.comb.py did before. Time and peak memory (tracemalloc) are measured on a synthetic track.
+#Usage: python benchmarks/bench_gpx_reader.py [N_POINTS]   (default: one day at 1 Hz)
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import gpxpy
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from gpx_reader import read_gpx_stream
+from synthetic import write_gpx
+
+
+#the former point by point loop (all tracks, so the results can be compared)
+def read_gpx_loop(gpx_file_path):
+    with open(gpx_file_path, 'r') as f:
+        gpx = gpxpy.parse(f)
+    gpx_points = []
+    for track in gpx.tracks:
+        for segment in track.segments:
+            for p in segment.points:
+                gpx_points.append({
+                    'time': p.time,
+                    'latitude': p.latitude,
+                    'longitude': p.longitude,
+                    'elevation': p.elevation,
+                })
+    return pd.DataFrame.from_records(gpx_points)
+
+
+def measure(func, path):
+    start = time.perf_counter()
+    result = func(path)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    func(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def main(argv):
+    n_points = int(argv[1]) if len(argv) > 1 else 86400
+    with tempfile.TemporaryDirectory() as tmp:
+        gpx_path = os.path.join(tmp, '2024-05-27_LL.gpx')
+        write_gpx(gpx_path, n_points, n_tracks=3, segments_per_track=2)
+
+        loop_df, loop_time, loop_peak = measure(read_gpx_loop, gpx_path)
+        stream_track, stream_time, stream_peak = measure(read_gpx_stream, gpx_path)
+
+    #both readers must give the same points
+    stream_df = stream_track.to_frame()
+    loop_df['time'] = pd.to_datetime(loop_df['time'], utc=True).astype(stream_df['time'].dtype)
+    pd.testing.assert_frame_equal(loop_df, stream_df)
+
+    print(f'{n_points} points: gpxpy loop {loop_time:.2f}s ({loop_peak / 1e6:.0f} MB peak), '
+          f'streaming {stream_time:.2f}s ({stream_peak / 1e6:.0f} MB peak), speedup {loop_time / stream_time:.1f}x')
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,47 @@
+#Benchmark of the bulk decoder against the line by line decoder of SensorFileParser on a synthetic log. Both
+#decoders are also compared on a log with corrupted lines (synthetic.malformed_log_lines).
+#Usage: python benchmarks/bench_sensor_parser.py [N_LINES]   (default: one day at 1 Hz)
+
+import os
+import sys
+import tempfile
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from sensor_file_parser import SensorFileParser
+from synthetic import write_atmotube_log, atmotube_log_lines, malformed_log_lines
+
+
+def main(argv):
+    n_lines = int(argv[1]) if len(argv) > 1 else 86400
+    parser = SensorFileParser()
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = os.path.join(tmp, '2024-05-27_LL.txt')
+        write_atmotube_log(log_path, n_lines)
+        with open(log_path) as f:
+            lines = f.readlines()
+
+        start = time.perf_counter()
+        loop_result = parser.decode_lines_loop(lines, '2024-05-27')
+        loop_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        bulk_result = parser.decode_lines(lines, '2024-05-27')
+        bulk_time = time.perf_counter() - start
+
+    #both decoders must give identical dataframes
+    for loop_df, bulk_df in zip(loop_result, bulk_result):
+        pd.testing.assert_frame_equal(loop_df, bulk_df)
+
+    #corrupted lines are skipped by both decoders
+    malformed = malformed_log_lines(atmotube_log_lines(min(n_lines, 5000)))
+    for loop_df, bulk_df in zip(parser.decode_lines_loop(malformed, '2024-05-27'),
+                                parser.decode_lines(malformed, '2024-05-27')):
+        pd.testing.assert_frame_equal(loop_df, bulk_df)
+
+    print(f'{len(lines)} lines: line by line {loop_time:.2f}s, bulk {bulk_time:.2f}s, speedup {loop_time / bulk_time:.1f}x')
+
+
+if __name__ == "__main__":
+    main(sys.argv)
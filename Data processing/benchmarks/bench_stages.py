@@ -0,0 +1,169 @@
+#Benchmark suite of the processing stages on synthetic sessions of different lengths: every stage is run under the
+#instrumentation of instrument.py (wall time, peak RSS, row counts) and compared with the stored baselines in
+#benchmarks/baselines.json, so regressions are flagged (exit code 1).
+
+#Inputs are made by synthetic.py: an nRF Connect log (meteo and env lines at 1 Hz), a 1 Hz gpx track of the same
+#walk and a tree inventory csv at city scale (about 880000 trees, as the GLA London database). Stages:
+#parse (SensorFileParser.parse_file), write decoded (csv), gpx (read_gpx), read sensor, align, interpolate,
+#tree cache (build, once) and tree bbox, match (match_trees at every radius), products (air_tree_products at every
+#radius), export csv / export parquet (largest radius) and, with --db, load (load_data.load_rows into the database
+#of import.config.json - rolled back, so nothing is kept).
+
+#A session is at most a day: logs only have the time of day and the pipeline runs one session per day, so a week is
+#seven 'day' sessions (pipeline.py --workers).
+
+#Usage: python benchmarks/bench_stages.py [--sizes walk day] [--trees 880000] [--repeat 3] [--metrics FILE]
+#                                         [--baseline benchmarks/baselines.json] [--update-baseline] [--db]
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import air_tree
+import instrument
+from sensor_file_parser import SensorFileParser
+from table_io import write_table
+from tree_cache import build_tree_cache, TreeCache
+from synthetic import write_atmotube_log, write_gpx, write_tree_csv
+
+#session lengths (seconds at 1 Hz): a 40 minute walk, an hour and a 12 hour logging day
+SIZES = {'walk': 2400, 'hour': 3600, 'day': 43200}
+RADII = [5, 10, 15, 20, 50]
+SESSION = '2024-05-27_LL'
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+
+def run_case(case, seconds, tmp, tree_cache, radii, conn=None):
+    log_path = os.path.join(tmp, f'{case}_{SESSION}.txt')
+    gpx_path = os.path.join(tmp, f'{case}_{SESSION}.gpx')
+    write_atmotube_log(log_path, seconds)
+    write_gpx(gpx_path, seconds)
+
+    with instrument.stage('parse', case=case):
+        df_meteo, df_env = SensorFileParser().parse_file(log_path, SESSION[:10])
+        instrument.count(lines=seconds, meteo_rows=len(df_meteo), env_rows=len(df_env))
+
+    meteo_path = os.path.join(tmp, f'{case}_meteo.csv')
+    env_path = os.path.join(tmp, f'{case}_env.csv')
+    with instrument.stage('write decoded', case=case):
+        write_table(df_meteo, meteo_path, index=False)
+        write_table(df_env, env_path, index=False)
+        instrument.count(rows=len(df_meteo) + len(df_env))
+
+    with instrument.stage('gpx', case=case):
+        df_gpx = air_tree.read_gpx(gpx_path)
+        instrument.count(gpx_points=len(df_gpx))
+
+    with instrument.stage('read sensor', case=case):
+        df_sens_comb = air_tree.read_sensor(env_path, meteo_path)
+        instrument.count(rows=len(df_sens_comb))
+
+    with instrument.stage('align', case=case):
+        df_sens_gpx = air_tree.align(df_sens_comb, df_gpx)
+        instrument.count(rows=len(df_sens_gpx))
+
+    with instrument.stage('interpolate', case=case):
+        df_sens_gpx = air_tree.located(air_tree.interpolate(df_sens_gpx))
+        instrument.count(rows=len(df_sens_gpx))
+
+    with instrument.stage('tree bbox', case=case):
+        df_trees = tree_cache.load_bbox(*air_tree.sampling_area(df_sens_gpx))
+        instrument.count(trees=len(df_trees))
+
+    #every radius is matched on its own (as separate runs would) - the pipeline matches the largest radius once
+    for d in radii:
+        with instrument.stage('match', case=case, dist=d):
+            df_matched, pairs = air_tree.match_trees(df_sens_gpx, df_trees, d)
+            instrument.count(rows=len(df_matched), pairs=len(pairs[0]))
+
+    #outputs of every radius are made from the pairs of the largest radius, as in the pipeline
+    for d in radii:
+        with instrument.stage('products', case=case, dist=d):
+            df_air_tree, sens_gpx_tree = air_tree.air_tree_products(df_matched, df_trees, pairs, d)
+            instrument.count(rows=len(sens_gpx_tree), matches=len(df_air_tree))
+
+    d = max(radii)
+    output = os.path.join(tmp, f'{SESSION}_{d}m_all_air_tree_data.csv')
+    with instrument.stage('export csv', case=case, dist=d):
+        write_table(sens_gpx_tree, output, 'csv')
+        instrument.count(rows=len(sens_gpx_tree), bytes=os.path.getsize(output))
+    try:
+        with instrument.stage('export parquet', case=case, dist=d):
+            parquet_output = write_table(sens_gpx_tree, output, 'parquet')[0]
+            instrument.count(rows=len(sens_gpx_tree), bytes=os.path.getsize(parquet_output))
+    except ImportError as e:
+        print(f'skip export parquet ({e})')
+
+    if conn is not None:
+        from load_data import open_csv, load_rows
+        with instrument.stage('load', case=case, dist=d), open_csv(Path(output)) as f, conn.cursor() as cur:
+            copied, new, matches = load_rows(cur, f, SESSION, SESSION[11:13], d)
+            instrument.count(rows=copied, measurements=len(new), matches=matches)
+        conn.rollback()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Time and memory of every processing stage on synthetic sessions.')
+    parser.add_argument('--sizes', nargs='+', default=['walk', 'day'],
+                        help=f'session lengths: {", ".join(SIZES)} or a number of seconds (default: walk day)')
+    parser.add_argument('--trees', type=int, default=880000, help='trees in the synthetic inventory (default: 880000)')
+    parser.add_argument('--radii', type=int, nargs='+', default=RADII, help='radii (m) to match trees within')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every size, the best run is compared '
+                                                              '(default: 3)')
+    parser.add_argument('--metrics', help='metrics file to append the stages to (default: a temporary file)')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline to compare with (default: %(default)s)')
+    parser.add_argument('--update-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--db', action='store_true', help='also time loading into the database of import.config.json '
+                                                          '(rolled back)')
+    args = parser.parse_args(argv[1:])
+
+    sizes = {}
+    for size in args.sizes:
+        seconds = SIZES[size] if size in SIZES else int(size)
+        if seconds > 86400:
+            parser.error(f'{size}: a session can be at most a day (86400 seconds)')
+        sizes[size] = seconds
+
+    conn = None
+    if args.db:
+        from db_matcher import connect
+        with open("import.config.json", "r") as jsonfile:
+            conn = connect(json.load(jsonfile))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        metrics = args.metrics or os.path.join(tmp, 'metrics.jsonl')
+        instrument.enable(metrics)
+        start = len(instrument.read_metrics(metrics)) if os.path.exists(metrics) else 0
+
+        tree_path = os.path.join(tmp, 'trees.csv')
+        write_tree_csv(tree_path, args.trees)
+        with instrument.stage('tree cache', case=f'{args.trees} trees'):
+            meta = build_tree_cache(tree_path, os.path.join(tmp, 'tree_cache'))
+            instrument.count(trees=meta['n_trees'])
+        tree_cache = TreeCache(os.path.join(tmp, 'tree_cache'))
+
+        try:
+            for _ in range(args.repeat):
+                for case, seconds in sizes.items():
+                    run_case(case, seconds, tmp, tree_cache, sorted(args.radii), conn)
+        finally:
+            if conn is not None:
+                conn.close()
+        summary = instrument.summarise(instrument.read_metrics(metrics)[start:])
+
+    if args.update_baseline:
+        instrument.write_baseline(args.baseline, summary)
+        instrument.report(summary)
+        print(f'baseline {args.baseline} updated ({len(summary)} stages)')
+        return
+    baseline = instrument.read_baseline(args.baseline) if os.path.exists(args.baseline) else None
+    found = instrument.report(summary, baseline)
+    raise SystemExit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,56 @@
+#Checks the manifest of batch decoding (import_data.import_batch) on synthetic logs: unchanged files are skipped, and
+#they are decoded again when output_format changes (csv -> parquet -> both), so the tables of the new format exist.
+#Usage: python benchmarks/check_import_batch.py [N_LINES]   (default: 600 lines per log)
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from import_data import import_batch, decoded_paths
+from synthetic import write_atmotube_log
+
+SESSIONS = ['2024-05-27_LL', '2024-05-28_LL']
+
+
+#modification time of the decoded files of every session (None if a file is missing)
+def decoded_times(cache_path, output_format):
+    return {session: [os.stat(p).st_mtime_ns if os.path.exists(p) else None
+                      for p in decoded_paths(cache_path + session, output_format)] for session in SESSIONS}
+
+
+#decodes the logs in output_format and returns the sessions that were decoded (not skipped)
+def decode(import_config, output_format):
+    before = decoded_times(import_config['cache_path'], output_format)
+    if import_batch('*.txt', dict(import_config, output_format=output_format), workers=1):
+        raise SystemExit(f'{output_format}: decoding failed')
+    after = decoded_times(import_config['cache_path'], output_format)
+    return [session for session in SESSIONS if before[session] != after[session]]
+
+
+def main(argv):
+    n_lines = int(argv[1]) if len(argv) > 1 else 600
+    with tempfile.TemporaryDirectory() as tmp:
+        import_config = {'data_path': os.path.join(tmp, 'in') + os.sep, 'cache_path': os.path.join(tmp, 'cache') + os.sep}
+        os.makedirs(import_config['data_path'])
+        os.makedirs(import_config['cache_path'])
+        for session in SESSIONS:
+            write_atmotube_log(import_config['data_path'] + session + '.txt', n_lines)
+
+        failed = []
+        for output_format, expected in [('csv', SESSIONS), ('csv', []), ('parquet', SESSIONS), ('parquet', []),
+                                        ('both', SESSIONS), ('both', [])]:
+            decoded = decode(import_config, output_format)
+            missing = [p for s in SESSIONS for p in decoded_paths(import_config['cache_path'] + s, output_format)
+                       if not os.path.exists(p)]
+            print(f'{output_format}: decoded {decoded or "none"}'
+                  + (f', MISSING {[os.path.basename(p) for p in missing]}' if missing else ''))
+            if (decoded != expected or missing) and output_format not in failed:
+                failed.append(output_format)
+
+    print('manifest ok' if not failed else f'manifest differences in: {", ".join(failed)}')
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,179 @@
+#Generators for synthetic input data used by the benchmarks.
+
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+METEO_UUID = 'DB450003-8E9A-4818-ADD7-6ED94A328AB4'
+ENV_UUID = 'DB450005-8E9A-4818-ADD7-6ED94A328AB4'
+
+
+def _hex_le(value, n_bytes):
+    return int(value).to_bytes(n_bytes, 'little').hex().upper()
+
+
+#split a hex payload into the 4 character groups written by nRF Connect
+def _groups(payload):
+    return ' '.join(payload[i:i + 4] for i in range(0, len(payload), 4))
+
+
+#nRF Connect log of an Atmotube Pro: one meteo line (10 words) for every two env lines (12 words), one line per
+#second, plus some connection messages and lines without timestamp that the parser has to skip
+def atmotube_log_lines(n_lines, start=datetime(2024, 5, 27, 11, 0, 0), seed=0):
+    rng = np.random.default_rng(seed)
+    lines = []
+    for i in range(n_lines):
+        time_str = (start + timedelta(seconds=i)).strftime('%H:%M:%S')
+        if i % 3 == 0:
+            payload = (_hex_le(rng.integers(5, 35), 1) + _hex_le(rng.integers(20, 90), 1)
+                       + _hex_le(rng.integers(99000, 104000), 4) + _hex_le(rng.integers(500, 3500), 2))
+            lines.append(f'{time_str},D,Characteristic,Updated Value of Characteristic {METEO_UUID} to {_groups(payload)}\n')
+        else:
+            payload = ''.join(_hex_le(rng.integers(0, 5000), 3) for _ in range(4))
+            lines.append(f'{time_str},D,Characteristic,Updated Value of Characteristic {ENV_UUID} to {_groups(payload)}\n')
+        if i % 500 == 0:
+            lines.append(f'{time_str},I,Connection,Connected to ATMOTUBE\n')
+        if i % 1000 == 0:
+            lines.append('Log exported from nRF Connect\n')
+    return lines
+
+
+#Corrupted versions of log lines as a broken bluetooth transfer leaves them: damaged timestamps together with hex
+#words of odd length or with non-hex characters, non-ascii characters, truncated payloads, extra words and lines
+#with extra commas. Lines with a damaged timestamp are skipped by the parser, the others hold no data (wrong number
+#of words or fields), so they never stop decoding. One corrupted line is inserted after every 'every' lines.
+def malformed_log_lines(lines, every=7, seed=0):
+    rng = np.random.default_rng(seed)
+    damage = [
+        lambda ln: '1x' + ln[2:].replace(' to ', ' to 0', 1),
+        lambda ln: '1x' + ln[2:-3] + 'G\n',
+        lambda ln: ':' + ln[1:].replace(' to ', ' to é', 1),
+        lambda ln: ln.rsplit(' ', 1)[0] + '\n',
+        lambda ln: ln[:-1] + ' 00\n',
+        lambda ln: ln.replace(',', ',,', 1),
+        lambda ln: ln[:len(ln) // 2] + '\n',
+        lambda ln: '\n',
+    ]
+    out = []
+    for i, ln in enumerate(lines):
+        out.append(ln)
+        if i % every == 0 and 'Updated Value' in ln:
+            out.append(damage[rng.integers(len(damage))](ln))
+    return out
+
+
+def write_atmotube_log(path, n_lines, seed=0):
+    with open(path, 'w') as f:
+        f.writelines(atmotube_log_lines(n_lines, seed=seed))
+
+
+#TripLogger gpx track: one point per second walking around Lewisham, split into n_tracks tracks of
+#segments_per_track segments. Some points have no elevation.
+def gpx_document(n_points, start=datetime(2024, 5, 27, 10, 0, 0), seed=0, n_tracks=1, segments_per_track=1):
+    rng = np.random.default_rng(seed)
+    lat = 51.4645 + np.cumsum(rng.normal(0, 0.00002, n_points))
+    lon = -0.0166 + np.cumsum(rng.normal(0, 0.00003, n_points))
+    ele = 10 + np.cumsum(rng.normal(0, 0.1, n_points))
+    n_segments = n_tracks * segments_per_track
+    bounds = np.linspace(0, n_points, n_segments + 1).astype(int)
+
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+             '<gpx version="1.1" creator="TripLogger" xmlns="http://www.topografix.com/GPX/1/1">']
+    for segment in range(n_segments):
+        if segment % segments_per_track == 0:
+            parts.append(f'<trk><name>track {segment // segments_per_track + 1}</name>')
+        parts.append('<trkseg>')
+        for i in range(bounds[segment], bounds[segment + 1]):
+            time_str = (start + timedelta(seconds=i)).strftime('%Y-%m-%dT%H:%M:%SZ')
+            ele_str = f'<ele>{ele[i]:.3f}</ele>' if i % 97 else ''
+            parts.append(f'<trkpt lat="{lat[i]:.8f}" lon="{lon[i]:.8f}">{ele_str}<time>{time_str}</time></trkpt>')
+        parts.append('</trkseg>')
+        if segment % segments_per_track == segments_per_track - 1:
+            parts.append('</trk>')
+    parts.append('</gpx>\n')
+    return ''.join(parts)
+
+
+def write_gpx(path, n_points, seed=0, n_tracks=1, segments_per_track=1):
+    with open(path, 'w') as f:
+        f.write(gpx_document(n_points, seed=seed, n_tracks=n_tracks, segments_per_track=segments_per_track))
+
+
+#(tree name, taxon name, share of the trees) - common London street trees, with some of the name variants of the
+#GLA inventory that are mapped to one species when the tree cache is built (see tree_species.py)
+TREE_SPECIES = [
+    ('London Plane', 'Platanus x hispanica', 0.18),
+    ('Common Lime', 'Tilia x europaea', 0.09),
+    ('Lime Tree', 'Tilia x europaea', 0.02),
+    ('Cherry', 'Prunus', 0.08),
+    ("Cherry 'Kanzan'", 'Prunus serrulata', 0.03),
+    ('Norway Maple', 'Acer platanoides', 0.07),
+    ('Sycamore Maple', 'Acer pseudoplatanus', 0.05),
+    ('Common Ash', 'Fraxinus excelsior', 0.05),
+    ('Mountain Ash', 'Sorbus aucuparia', 0.03),
+    ('Birch', 'Betula pendula', 0.06),
+    ('Common Hornbeam', 'Carpinus betulus', 0.05),
+    ('English Oak', 'Quercus robur', 0.04),
+    ('Horse-Chestnut', 'Aesculus hippocastanum', 0.03),
+    ('Common Hawthorn', 'Crataegus monogyna', 0.04),
+    ('Swedish Whitebeam', 'Sorbus intermedia', 0.03),
+    ('Crab Apple', 'Malus', 0.03),
+    ('Pear', 'Pyrus calleryana', 0.03),
+    ('Common Alder', 'Alnus glutinosa', 0.02),
+    ('Tree of Heaven', 'Ailanthus altissima', 0.02),
+    ('Unknown', None, 0.05),
+]
+#London boroughs (lat, lon of the centre) the trees are spread over
+BOROUGHS = [('Lewisham', 51.445, -0.020), ('Southwark', 51.475, -0.080), ('Camden', 51.545, -0.165),
+            ('Lambeth', 51.460, -0.115), ('Greenwich', 51.470, 0.045), ('Hackney', 51.545, -0.055),
+            ('Islington', 51.545, -0.105), ('Westminster', 51.510, -0.150), ('Croydon', 51.370, -0.095),
+            ('Barnet', 51.625, -0.200), ('Ealing', 51.515, -0.310), ('Bromley', 51.375, 0.050)]
+AGE_GROUPS = ['Young', 'Semi-Mature', 'Mature', 'Over-Mature', 'Veteran']
+
+
+#Tree inventory in the format of the GLA London tree database (one row per tree, columns as read by tree_cache.py).
+#Trees are spread over the boroughs, with a share of local_fraction dense around the start of the synthetic walk
+#(gpx_document) so walks meet about as many trees as a street walk in Lewisham. Some names have stray whitespace and
+#a few trees have no coordinates, as in the real inventory.
+def tree_inventory(n_trees, seed=0, local_fraction=0.05, center=(51.4645, -0.0166)):
+    rng = np.random.default_rng(seed)
+    n_local = int(n_trees * local_fraction)
+    borough = rng.integers(0, len(BOROUGHS), n_trees)
+    centres = np.array([(lat, lon) for _, lat, lon in BOROUGHS])
+    lat = centres[borough, 0] + rng.normal(0, 0.02, n_trees)
+    lon = centres[borough, 1] + rng.normal(0, 0.03, n_trees)
+    lat[:n_local] = center[0] + rng.uniform(-0.012, 0.012, n_local)
+    lon[:n_local] = center[1] + rng.uniform(-0.018, 0.018, n_local)
+    borough[:n_local] = 0
+
+    shares = np.array([share for _, _, share in TREE_SPECIES])
+    species = rng.choice(len(TREE_SPECIES), n_trees, p=shares / shares.sum())
+    names = np.array([name for name, _, _ in TREE_SPECIES], dtype=object)[species]
+    names[rng.random(n_trees) < 0.01] += ' '
+    taxon = np.array([taxon for _, taxon, _ in TREE_SPECIES], dtype=object)[species]
+    age = rng.integers(0, len(AGE_GROUPS), n_trees)
+    dbh = np.round(rng.gamma(2.0, 12.0, n_trees), 2)
+    no_position = rng.random(n_trees) < 0.001
+
+    return pd.DataFrame({
+        'objectid': np.arange(1000000, 1000000 + n_trees),
+        'lat': np.where(no_position, np.nan, np.round(lat, 6)),
+        'lon': np.where(no_position, np.nan, np.round(lon, 6)),
+        'borough': np.array([name for name, _, _ in BOROUGHS], dtype=object)[borough],
+        'gla_tree_group': np.where(rng.random(n_trees) < 0.8, 'Street tree', 'Park tree'),
+        'tree_name': names,
+        'taxon_name': taxon,
+        'age': np.where(rng.random(n_trees) < 0.3, age * 10.0 + 5, np.nan),
+        'age_group': np.array(AGE_GROUPS, dtype=object)[age],
+        'spread_m': np.round(dbh / 5 + rng.uniform(0, 2, n_trees), 1),
+        'height_m': np.round(dbh / 3 + rng.uniform(1, 5, n_trees), 1),
+        'diameter_at_breast_height_cm': np.where(rng.random(n_trees) < 0.9, dbh, np.nan),
+        'gdb_geomattr_data': np.nan,
+        'load_date': '10.07.2024',
+        'updated': '08.07.2024',
+    })
+
+
+#GLA tree inventory csv - the whole of London has about 880000 trees
+def write_tree_csv(path, n_trees=880000, seed=0, local_fraction=0.05):
+    tree_inventory(n_trees, seed, local_fraction).to_csv(path, index=False)
@@ -0,0 +1,97 @@
+#Checks the postgis matching backend (db_matcher.py) against the python matcher for a session: the same pairs of
+#air measurements and trees (counted per radius), distances and distance to the closest tree, and the same outputs for
+#every radius.
+#Load the tree database into airquality_db first (python load_trees.py).
+
+#usage: python check_postgis_matching.py [SESSION] [--radii 5 10 15 20 50] [--trees TREE_CSV]   (default: 2024-05-27_LL)
+
+import json
+import argparse
+from sys import argv
+import numpy as np
+import pandas as pd
+import air_tree
+from db_matcher import connect, match_trees_postgis
+from pipeline import Pipeline, find_sessions
+
+#largest difference (m) allowed between distances calculated in python and in the database
+DISTANCE_TOLERANCE = 1e-6
+
+
+def compare_products(python, postgis):
+    try:
+        pd.testing.assert_frame_equal(python, postgis, check_exact=False, rtol=0, atol=DISTANCE_TOLERANCE)
+        return None
+    except AssertionError as e:
+        return str(e).splitlines()[0]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Compare postgis and python tree matching for a session.')
+    parser.add_argument('session', nargs='?', default='2024-05-27_LL', help="session prefix, e.g. 2024-05-27_LL")
+    parser.add_argument('--radii', type=int, nargs='+', default=[5, 10, 15, 20, 50], help='radii (m) to compare')
+    parser.add_argument('--trees', help="tree database csv (default: 'tree_data_path' in import.config.json)")
+    args = parser.parse_args(argv[1:])
+
+    with open("import.config.json", "r") as jsonfile:
+        import_config = json.load(jsonfile)
+    tree_data_path = args.trees or import_config.get("tree_data_path")
+    if not tree_data_path:
+        parser.error("specify the tree database csv with --trees or 'tree_data_path' in import.config.json")
+    sessions = find_sessions(import_config, [args.session])
+    if args.session not in sessions:
+        raise SystemExit(f'no sensor log and gpx file for {args.session}')
+
+    #located air measurements of the session (decoded, aligned and interpolated as in the pipeline)
+    pipeline = Pipeline(import_config, tree_data_path, args.radii)
+    interpolate = pipeline.session_stages(args.session, *sessions[args.session])[1]
+    df_sens_gpx = air_tree.located(interpolate.value())
+    bbox = air_tree.sampling_area(df_sens_gpx)
+    df_trees = pipeline.tree_cache().load_bbox(*bbox)
+
+    df_python, pairs_python = air_tree.match_trees(df_sens_gpx, df_trees, max(args.radii))
+    conn = connect(import_config)
+    try:
+        df_postgis, pairs_postgis = match_trees_postgis(conn, df_sens_gpx, df_trees, max(args.radii), bbox)
+    finally:
+        conn.close()
+
+    failed = []
+    same_pairs = (np.array_equal(pairs_python[0], pairs_postgis[0]) and
+                  np.array_equal(pairs_python[1], pairs_postgis[1]))
+    print(f'pairs within {max(args.radii)} m: python {len(pairs_python[0])}, postgis {len(pairs_postgis[0])}'
+          f'{"" if same_pairs else " - DIFFERENT"}')
+    if same_pairs:
+        diff = np.abs(pairs_python[2] - pairs_postgis[2]).max(initial=0)
+        print(f'largest distance difference: {diff:.3g} m')
+        if diff > DISTANCE_TOLERANCE:
+            failed.append('distances')
+    else:
+        failed.append('pairs')
+
+    nearest = np.abs(df_python['Dist_to_closest_tree'] - df_postgis['Dist_to_closest_tree'])
+    print(f'largest difference of Dist_to_closest_tree: {nearest.max():.3g} m')
+    if nearest.max() > DISTANCE_TOLERANCE or (df_python['Dist_to_closest_tree'].isna() !=
+                                              df_postgis['Dist_to_closest_tree'].isna()).any():
+        failed.append('Dist_to_closest_tree')
+
+    for d in args.radii:
+        n_python, n_postgis = (pairs_python[2] <= d).sum(), (pairs_postgis[2] <= d).sum()
+        print(f'{d}m pairs: python {n_python}, postgis {n_postgis}{"" if n_python == n_postgis else " - DIFFERENT"}')
+    for d in args.radii:
+        if 'pairs' in failed:
+            break
+        outputs_python = air_tree.air_tree_products(df_python, df_trees, pairs_python, d)
+        outputs_postgis = air_tree.air_tree_products(df_postgis, df_trees, pairs_postgis, d)
+        for name, python, postgis in zip(['air_tree_matched', 'all_air_tree_data'], outputs_python, outputs_postgis):
+            error = compare_products(python, postgis)
+            print(f'{d}m {name}: {len(python)} rows {"same" if error is None else "DIFFERENT: " + error}')
+            if error is not None:
+                failed.append(f'{d}m {name}')
+
+    print('postgis matching is the same as python' if not failed else f'differences in: {", ".join(failed)}')
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main(argv)
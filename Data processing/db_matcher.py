@@ -0,0 +1,128 @@
+#Tree matching in the database (PostGIS) - an alternative to the python matcher (tree_matcher.py) selected with
+#match_backend = 'postgis' in sens.tree.comb.py or --backend postgis in pipeline.py. The located air measurements of a
+#session are copied into a temporary table and the trees within max_radius are found with st_dwithin on the
+#geography index of sensor.trees; distances are calculated with the same haversine formula as the python matcher
+#(sensor.haversine_m), so the outputs are the same. The whole tree database has to be loaded first (load_trees.py).
+
+#New radii for sessions already in the database don't need the python pipeline: sensor.add_radius matches the
+#stored measurements in the database and creates the view sensor.dist_[d].
+#usage: python db_matcher.py --radius 25 [30 ...]
+
+import io
+import json
+import argparse
+from sys import argv
+import numpy as np
+import pandas as pd
+import psycopg2
+
+POINTS_SQL = ('create temporary table match_points (idx integer, lat double precision, lon double precision, '
+              'geog geography) on commit drop')
+
+#trees of the sampling area (bbox) within max_radius of every point - candidates from st_dwithin (1% wider) are
+#kept if their haversine distance is at most max_radius, as in tree_matcher.py
+PAIRS_SQL = ('select p.idx, t.objectid, c.distance from match_points p '
+             'join sensor.trees t on st_dwithin(t.tree_geom::geography, p.geog, %(search)s) '
+             'cross join lateral (select sensor.haversine_m(p.lat, p.lon, st_y(t.tree_geom), st_x(t.tree_geom)) '
+             'as distance) c '
+             'where t.tree_geom && st_makeenvelope(%(min_lon)s, %(min_lat)s, %(max_lon)s, %(max_lat)s, 4326) '
+             'and c.distance <= %(radius)s')
+
+#distance to the closest tree of the sampling area - the nearest trees on the sphere (geography <->) are checked
+#with the haversine formula
+NEAREST_SQL = ('select p.idx, (select min(sensor.haversine_m(p.lat, p.lon, st_y(n.tree_geom), st_x(n.tree_geom))) '
+               'from (select t.tree_geom from sensor.trees t '
+               'where t.tree_geom && st_makeenvelope(%(min_lon)s, %(min_lat)s, %(max_lon)s, %(max_lat)s, 4326) '
+               'order by t.tree_geom::geography <-> p.geog limit 4) n) '
+               'from match_points p order by p.idx')
+
+
+#number of trees in sensor.trees and their last update - changes when the trees are (re)loaded (load_trees.py,
+#load_data.py), so the pipeline doesn't reuse matches made with other trees
+TREE_STAMP_SQL = 'select count(*), max(updated) from sensor.trees'
+
+
+def connect(import_config):
+    db_config = import_config.get("tseries_connection", import_config)
+    return psycopg2.connect(host=db_config['host'], database=db_config['database'], user=db_config['user'],
+                            password=db_config['password'], port=db_config['port'])
+
+
+def tree_table_stamp(conn):
+    try:
+        with conn.cursor() as cur:
+            cur.execute(TREE_STAMP_SQL)
+            n_trees, updated = cur.fetchone()
+    finally:
+        conn.rollback()
+    return f'{n_trees} {updated.isoformat() if updated else None}'
+
+
+#Same result as air_tree.match_trees, calculated in the database: adds 'Dist_to_closest_tree' to df_sens_gpx and
+#returns it with the (air measurement, tree number, distance) pairs within max_radius. Tree numbers are the rows of
+#df_trees (the trees of the sampling area, see air_tree.sampling_area) with the objectid of the matched tree.
+def match_trees_postgis(conn, df_sens_gpx, df_trees, max_radius, bbox):
+    min_lat, max_lat, min_lon, max_lon = bbox
+    params = {'search': max_radius * 1.01, 'radius': max_radius,
+              'min_lat': min_lat, 'max_lat': max_lat, 'min_lon': min_lon, 'max_lon': max_lon}
+    points = io.StringIO()
+    df_sens_gpx[['Index', 'latitude', 'longitude']].to_csv(points, index=False, header=False)
+    points.seek(0)
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute(POINTS_SQL)
+            cur.copy_expert('copy match_points (idx, lat, lon) from stdin with (format csv)', points)
+            cur.execute('update match_points set geog = st_setsrid(st_makepoint(lon, lat), 4326)::geography')
+            cur.execute('analyze match_points')
+            cur.execute(PAIRS_SQL, params)
+            rows = cur.fetchall()
+            cur.execute(NEAREST_SQL, params)
+            nearest = cur.fetchall()
+    finally:
+        conn.rollback()
+
+    air = np.array([r[0] for r in rows], dtype=np.int64)
+    dist = np.array([r[2] for r in rows], dtype=float)
+    #row of each matched tree in df_trees
+    tree = pd.Index(df_trees['objectid']).get_indexer([r[1] for r in rows])
+    if (tree < 0).any():
+        raise ValueError('sensor.trees is not the tree database used for this session - load it with load_trees.py')
+
+    #'Index' is the row number of the air measurement
+    df_sens_gpx = df_sens_gpx.reset_index(drop=True)
+    df_sens_gpx['Dist_to_closest_tree'] = np.array([np.nan if r[1] is None else r[1] for r in nearest], dtype=float)
+
+    #pairs are ordered by air measurement then tree, as in tree_matcher.py
+    order = np.lexsort((tree, air))
+    return df_sens_gpx, (air[order], tree[order].astype(np.int64), dist[order])
+
+
+#matches all sessions loaded with a smaller radius up to d in the database and creates the view sensor.dist_[d]
+def add_radius(conn, d):
+    with conn.cursor() as cur:
+        cur.execute('select sensor.add_radius(%s)', (d,))
+        added = cur.fetchone()[0]
+    conn.commit()
+    return added
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Match trees within new radii in the database and create the '
+                                                 'sensor.dist_[d] views.')
+    parser.add_argument('--radius', type=int, nargs='+', required=True, help='radii (m), e.g. 25 30')
+    args = parser.parse_args(argv[1:])
+
+    with open("import.config.json", "r") as jsonfile:
+        import_config = json.load(jsonfile)
+
+    conn = connect(import_config)
+    try:
+        for d in args.radius:
+            print(f'dist_{d}: {add_radius(conn, d)} tree matches added')
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main(argv)
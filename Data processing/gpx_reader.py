@@ -0,0 +1,151 @@
+#Streaming reader for gpx tracks (TripLogger exports). Track points are read one by one with iterparse straight into
+#numpy arrays, without building the gpxpy object tree - points of all tracks and all segments are returned in file
+#order. gpxpy is only needed for the 'gpxpy' engine, which is used as a fallback for files the streaming reader
+#can't parse. GpxFeed reads the points of a track that is still being written.
+
+import xml.etree.ElementTree as ET
+import numpy as np
+import pandas as pd
+
+try:
+    import gpxpy
+except ImportError:
+    gpxpy = None
+
+#initial size of the arrays, they grow by doubling
+_INITIAL_POINTS = 4096
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+class GpxTrack:
+    #time: datetime64[ns] (UTC), latitude/longitude/elevation: float64 (NaN if missing)
+    def __init__(self, time, latitude, longitude, elevation):
+        self.time = time
+        self.latitude = latitude
+        self.longitude = longitude
+        self.elevation = elevation
+
+    def __len__(self):
+        return len(self.latitude)
+
+    #dataframe with a tz-aware (UTC) 'time' column, the same columns as the point by point gpxpy loop
+    def to_frame(self):
+        return pd.DataFrame({
+            'time': pd.Series(self.time).dt.tz_localize('UTC'),
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'elevation': self.elevation,
+        })
+
+
+def _parse_times(times):
+    parsed = pd.to_datetime(pd.Series(times, dtype=object), utc=True, format='ISO8601')
+    return parsed.dt.tz_localize(None).to_numpy(dtype='datetime64[ns]')
+
+
+#read all track points (trk/trkseg/trkpt) of a gpx file with iterparse
+def read_gpx_stream(gpx_file_path):
+    size = _INITIAL_POINTS
+    lat = np.empty(size)
+    lon = np.empty(size)
+    ele = np.empty(size)
+    times = []
+    n = 0
+    point_ele = point_time = None
+    in_point = False
+
+    for event, elem in ET.iterparse(gpx_file_path, events=('start', 'end')):
+        tag = _local(elem.tag)
+        if event == 'start':
+            if tag == 'trkpt':
+                in_point = True
+                point_ele = point_time = None
+            continue
+        if not in_point:
+            if tag == 'trkseg':
+                #points of finished segments are not needed anymore
+                elem.clear()
+            continue
+        if tag == 'ele':
+            point_ele = elem.text
+        elif tag == 'time':
+            point_time = elem.text
+        elif tag == 'trkpt':
+            if n == size:
+                size *= 2
+                lat.resize(size, refcheck=False)
+                lon.resize(size, refcheck=False)
+                ele.resize(size, refcheck=False)
+            lat[n] = float(elem.get('lat'))
+            lon[n] = float(elem.get('lon'))
+            ele[n] = float(point_ele) if point_ele and point_ele.strip() else np.nan
+            times.append(point_time.strip() if point_time else None)
+            n += 1
+            in_point = False
+            elem.clear()
+
+    return GpxTrack(_parse_times(times), lat[:n].copy(), lon[:n].copy(), ele[:n].copy())
+
+
+#Incremental reader for a gpx file that is still being written (e.g. by TripLogger during a walk): feed() takes the
+#bytes appended to the file since the last call and returns the track points completed in them as a GpxTrack.
+class GpxFeed:
+    def __init__(self):
+        self._parser = ET.XMLPullParser(events=('start', 'end'))
+        self._in_point = False
+        self._ele = self._time = None
+
+    def feed(self, data):
+        self._parser.feed(data)
+        lat, lon, ele, times = [], [], [], []
+        for event, elem in self._parser.read_events():
+            tag = _local(elem.tag)
+            if event == 'start':
+                if tag == 'trkpt':
+                    self._in_point = True
+                    self._ele = self._time = None
+                continue
+            if not self._in_point:
+                continue
+            if tag == 'ele':
+                self._ele = elem.text
+            elif tag == 'time':
+                self._time = elem.text
+            elif tag == 'trkpt':
+                lat.append(float(elem.get('lat')))
+                lon.append(float(elem.get('lon')))
+                ele.append(float(self._ele) if self._ele and self._ele.strip() else np.nan)
+                times.append(self._time.strip() if self._time else None)
+                self._in_point = False
+                elem.clear()
+        return GpxTrack(_parse_times(times), np.array(lat, dtype=float), np.array(lon, dtype=float),
+                        np.array(ele, dtype=float))
+
+
+#read all track points with gpxpy (slower, needs gpxpy installed)
+def read_gpx_gpxpy(gpx_file_path):
+    if gpxpy is None:
+        raise ImportError('gpxpy is not installed')
+    with open(gpx_file_path, 'r') as f:
+        gpx = gpxpy.parse(f)
+    points = [p for track in gpx.tracks for segment in track.segments for p in segment.points]
+    times = [p.time.isoformat() if p.time is not None else None for p in points]
+    return GpxTrack(_parse_times(times),
+                    np.array([p.latitude for p in points], dtype=float),
+                    np.array([p.longitude for p in points], dtype=float),
+                    np.array([np.nan if p.elevation is None else p.elevation for p in points], dtype=float))
+
+
+#engine: 'stream' (falls back to gpxpy if the file can't be parsed and gpxpy is installed) or 'gpxpy'
+def read_gpx_track(gpx_file_path, engine='stream'):
+    if engine == 'gpxpy':
+        return read_gpx_gpxpy(gpx_file_path)
+    try:
+        return read_gpx_stream(gpx_file_path)
+    except ET.ParseError:
+        if gpxpy is None:
+            raise
+        return read_gpx_gpxpy(gpx_file_path)
@@ -1,34 +1,166 @@
 import os
 from sys import argv
+import argparse
+import glob
+import hashlib
 import pandas
 import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
 from sensor_file_parser import SensorFileParser
+import instrument
+from table_io import TableWriter, preferred_path, table_paths
+
+MANIFEST_NAME = 'import_manifest.json'
+
+
+#writes decoded (meteo, env) chunks to output_stem + '_meteo.csv' / '_env.csv' (and/or .parquet, see table_io.py)
+#as they come in - returns the paths of the (meteo, env) files to read
+def write_chunks(chunks, output_stem, file_parser, output_format='csv'):
+    meteo_path = output_stem + '_meteo.csv'
+    env_path = output_stem + '_env.csv'
+    with TableWriter(meteo_path, output_format) as meteo_writer, TableWriter(env_path, output_format) as env_writer:
+        first = True
+        meteo_rows = env_rows = 0
+        for meteo_df, env_df in chunks:
+            meteo_writer.write(meteo_df)
+            env_writer.write(env_df)
+            meteo_rows += len(meteo_df)
+            env_rows += len(env_df)
+            first = False
+        instrument.count(meteo_rows=meteo_rows, env_rows=env_rows)
+        if first:
+            #empty input file - write the headers only
+            meteo_writer.write(pandas.DataFrame([], columns=file_parser.cols_meteo))
+            env_writer.write(pandas.DataFrame([], columns=file_parser.cols_env))
+    return [preferred_path(meteo_path, output_format), preferred_path(env_path, output_format)]
+
+
+#decodes one sensor file into the cache folder and returns the output paths
+#fileparser needs full file path and date (from name 0:10)
+def decode_file(file_name, output_stem, date, chunk_lines=100000, output_format='csv'):
+    #logic in class sensorFileParser
+    file_parser = SensorFileParser()
+    #results are written chunk by chunk - one dataframe for meteo and one for environment per chunk,
+    #so memory use doesn't grow with the length of the log
+    with instrument.stage('decode', file=os.path.basename(file_name)):
+        chunks = file_parser.iter_chunks(file_name, date, chunk_lines)
+        return write_chunks(chunks, output_stem, file_parser, output_format)
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def read_manifest(path):
+    try:
+        with open(path, 'r') as jsonfile:
+            return json.load(jsonfile)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(path, manifest):
+    #write to a temporary file first so an interrupted run never leaves a broken manifest
+    with open(path + '.tmp', 'w') as jsonfile:
+        json.dump(manifest, jsonfile, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+#path of a sensor file, directory or glob pattern given on the command line - relative to data_path unless absolute
+def sensor_path(pattern, data_path):
+    return pattern if os.path.isabs(pattern) else data_path + pattern
+
+
+#sensor files selected by a directory, a glob pattern or a single file name (relative to data_path)
+def find_sensor_files(pattern, data_path):
+    path = sensor_path(pattern, data_path)
+    if os.path.isdir(path):
+        path = os.path.join(path, '*.txt')
+    return sorted(p for p in glob.glob(path) if os.path.isfile(p))
+
+
+#all files written for a decoded sensor file in output_format (csv, parquet or both)
+def decoded_paths(output_stem, output_format='csv'):
+    return table_paths(output_stem + '_meteo.csv', output_format) + table_paths(output_stem + '_env.csv', output_format)
+
+
+#Decodes many sensor files concurrently. A manifest in cache_path records the content hash of every input, the
+#output_format and its output files - inputs that haven't changed since they were last decoded in the same format
+#(and whose files are all there) are skipped.
+def import_batch(pattern, import_config, workers=None, force=False):
+    cache_path = import_config["cache_path"]
+    chunk_lines = import_config.get("parse_chunk_lines", 100000)
+    output_format = import_config.get("output_format", "csv")
+    manifest_path = cache_path + MANIFEST_NAME
+    manifest = read_manifest(manifest_path)
+
+    todo = {}
+    for file_name in find_sensor_files(pattern, import_config["data_path"]):
+        sensor_file = os.path.basename(file_name)
+        sha = file_sha256(file_name)
+        entry = manifest.get(sensor_file)
+        if (not force and entry and entry['sha256'] == sha and entry.get('output_format') == output_format and
+                all(os.path.exists(p) for p in decoded_paths(cache_path + sensor_file[:-4], output_format))):
+            print(f'skip {sensor_file} (unchanged)')
+            continue
+        todo[sensor_file] = (file_name, sha)
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(decode_file, file_name, cache_path + sensor_file[:-4], sensor_file[0:10], chunk_lines,
+                               output_format): sensor_file
+                   for sensor_file, (file_name, sha) in todo.items()}
+        for future in as_completed(futures):
+            sensor_file = futures[future]
+            try:
+                outputs = future.result()
+            except Exception as e:
+                print(f'Error during import ---> {e} {sensor_file}')
+                failed.append(sensor_file)
+                continue
+            print(f'import {sensor_file}')
+            manifest[sensor_file] = {'sha256': todo[sensor_file][1], 'outputs': outputs,
+                                     'output_format': output_format,
+                                     'decoded': datetime.now().isoformat(timespec='seconds')}
+            write_manifest(manifest_path, manifest)
+
+    print(f'{len(todo) - len(failed)} decoded, {len(failed)} failed')
+    return failed
 
 
 def main(argv):
-    sensor_file = argv[1]
-    print(f'import {sensor_file}')
+    parser = argparse.ArgumentParser(description='Decode Atmotube sensor logs exported from nRF Connect.')
+    parser.add_argument('sensor_file', help='sensor file name (YYYY-MM-DD_LL_*.txt), or a directory / glob pattern '
+                                            'for batch mode (relative to data_path in import.config.json)')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes in batch mode (default: all cores)')
+    parser.add_argument('--force', action='store_true', help='decode files in batch mode even if they are unchanged')
+    parser.add_argument('--metrics', help='append the time, peak memory and rows of every file to this file (JSON lines, '
+                                          'see instrument.py)')
+    args = parser.parse_args(argv[1:])
+    if args.metrics:
+        instrument.enable(args.metrics)
 
     #must specify data path in import.config.json
     with open("import.config.json", "r") as jsonfile:
         import_config = json.load(jsonfile)
 
-    file_name = import_config["data_path"] + sensor_file
-    output_name = import_config["cache_path"] + sensor_file
+    sensor_file = args.sensor_file
+    file_name = sensor_path(sensor_file, import_config["data_path"])
+    if os.path.isdir(file_name) or glob.has_magic(sensor_file):
+        failed = import_batch(sensor_file, import_config, args.workers, args.force)
+        raise SystemExit(1 if failed else 0)
 
-    #logic in class sensorFileParser
-    file_parser = SensorFileParser()
-    #results are 2 dataframes one for meteo and one for environment
-    #fileparser needs full file path and date (from name 0:10)
-    results = file_parser.parse_file(file_name, sensor_file[0:10])
-    meteo_df:pandas.DataFrame = results[0]
-    env_df:pandas.DataFrame = results[1]
-   # voc_df:pandas.DataFrame = results[2] #edit
-    meteo_df.to_csv(output_name[:-4]+'_meteo.csv', index=False)
-    env_df.to_csv(output_name[:-4] + '_env.csv', index=False)
-   # voc_df.to_csv(output_name[:-4] + '_voc.csv', index=False) #edit
-    
+    sensor_file = os.path.basename(sensor_file)
+    print(f'import {sensor_file}')
+    output_name = import_config["cache_path"] + sensor_file
+    decode_file(file_name, output_name[:-4], sensor_file[0:10], import_config.get("parse_chunk_lines", 100000),
+                import_config.get("output_format", "csv"))
 
 
 if __name__ == "__main__":
-    main(argv)
\ No newline at end of file
+    main(argv)
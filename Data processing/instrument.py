@@ -0,0 +1,256 @@
+#Opt-in instrumentation of the processing stages: wall time, peak RSS and row counts of every stage are written to a
+#metrics file as one JSON line per stage. It is off unless a metrics file is given, with --metrics FILE (pipeline.py,
+#import_data.py, load_data.py, benchmarks/bench_stages.py) or the environment variable TREES_METRICS, which worker
+#processes inherit. Lines are appended, so several runs and processes can write to the same file.
+
+#Peak RSS is the largest resident memory of the process during the stage - on Linux the peak is reset when a stage
+#starts (/proc/self/clear_refs), elsewhere it is the peak of the process so far. It includes the memory the process
+#already held, so regressions are judged on the growth over the RSS at the start of the stage (rss_growth_mb, Linux
+#only). Stages running at the same time in threads (load_data.py) share the peak of their process: a stage starting
+#in one thread keeps the peak so far for the stages running in all threads before it resets it.
+
+#Regressions: python instrument.py METRICS.jsonl --baseline BASELINE.json compares the stages of a metrics file with
+#a stored baseline and exits with 1 if a stage is slower or uses more memory than its baseline allows
+#(--update stores the metrics file as the new baseline).
+
+import os
+import json
+import time
+import platform
+import argparse
+import threading
+from sys import argv
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+METRICS_ENV = 'TREES_METRICS'
+#a stage is flagged if it takes longer than TIME_TOLERANCE x its baseline time (and more than MIN_SECONDS longer,
+#so short stages don't fail on timer noise) or its memory grows by more than RSS_TOLERANCE x the baseline growth
+#(and more than MIN_RSS_MB)
+TIME_TOLERANCE = 1.5
+MIN_SECONDS = 0.05
+RSS_TOLERANCE = 1.25
+MIN_RSS_MB = 32
+#fields that identify a stage in a metrics file - records with the same key are compared with the same baseline
+KEY_FIELDS = ['case', 'session', 'file', 'stage', 'dist']
+MEASURES = ['seconds', 'peak_rss_mb', 'rss_growth_mb']
+
+#records of the stages running in all threads (innermost last) - the peak is reset for the whole process
+_running = []
+_lock = threading.Lock()
+
+
+def enable(path):
+    os.environ[METRICS_ENV] = os.path.abspath(path)
+
+
+def metrics_path():
+    return os.environ.get(METRICS_ENV) or None
+
+
+#records of the stages running in this thread
+def _stack():
+    thread = threading.get_ident()
+    with _lock:
+        return [record for record in _running if record['_thread'] == thread]
+
+
+def _status_mb(field):
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+#current resident memory of the process (MB), None where /proc is not available
+def rss_mb():
+    return _status_mb('VmRSS')
+
+
+#peak resident memory of the process (MB) since the last reset
+def peak_rss_mb():
+    peak = _status_mb('VmHWM')
+    if peak is not None:
+        return peak
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #bytes on macOS, kB elsewhere
+    return peak / 1024 ** 2 if platform.system() == 'Darwin' else peak / 1024
+
+
+#starts a new peak - the peak so far is kept for the stages already running (nested stages and stages of other
+#threads). Called with _lock held.
+def _reset_peak():
+    peak = peak_rss_mb()
+    for record in _running:
+        record['_peak'] = max(record['_peak'], peak or 0)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _write(record):
+    with open(metrics_path(), 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+#Measures the block as stage 'name' if instrumentation is enabled. Extra fields (session, file, ...) are written with
+#the record; row counts are added from inside the block with count(). A stage inside a running stage of the same name
+#(decode_file in the decode stage of pipeline.py) is part of that stage.
+@contextmanager
+def stage(name, **fields):
+    if metrics_path() is None or any(record['stage'] == name for record in _stack()):
+        yield
+        return
+    record = dict(stage=name, **fields)
+    with _lock:
+        _reset_peak()
+        record.update(_peak=0, _thread=threading.get_ident())
+        start_rss = rss_mb()
+        _running.append(record)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        record['error'] = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        with _lock:
+            #by identity - stages of other threads can have the same fields
+            del _running[next(i for i, running in enumerate(_running) if running is record)]
+            peak = max(record.pop('_peak'), peak_rss_mb() or 0)
+        del record['_thread']
+        record.update(seconds=round(seconds, 6), peak_rss_mb=round(peak, 1))
+        if start_rss is not None:
+            record['rss_growth_mb'] = round(max(peak - start_rss, 0), 1)
+        record.update(pid=os.getpid(), at=datetime.now(timezone.utc).isoformat(timespec='seconds'))
+        _write(record)
+
+
+#adds row counts (or other numbers) to the innermost running stage, e.g. count(rows=len(df))
+def count(**counts):
+    stack = _stack()
+    if stack:
+        stack[-1].update({name: int(value) for name, value in counts.items()})
+
+
+def read_metrics(path):
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def record_key(record):
+    return ' '.join(f'{record[field]}m' if field == 'dist' else str(record[field])
+                    for field in KEY_FIELDS if record.get(field) is not None)
+
+
+#best time and lowest memory of every stage key (stages run several times, e.g. benchmark repeats) and its row counts
+def summarise(records):
+    summary = {}
+    for record in records:
+        if record.get('error'):
+            continue
+        key = record_key(record)
+        counts = {name: value for name, value in record.items()
+                  if name not in KEY_FIELDS + MEASURES + ['pid', 'at'] and isinstance(value, int)}
+        entry = summary.setdefault(key, counts)
+        for name in MEASURES:
+            if name in record:
+                entry[name] = min(entry.get(name, record[name]), record[name])
+    return summary
+
+
+def machine():
+    return {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()}
+
+
+def read_baseline(path):
+    with open(path, 'r') as jsonfile:
+        return json.load(jsonfile)
+
+
+def write_baseline(path, summary):
+    with open(path, 'w') as jsonfile:
+        json.dump({'machine': machine(), 'stages': summary}, jsonfile, indent=1, sort_keys=True)
+        jsonfile.write('\n')
+
+
+#stages of summary that are slower or use more memory than their baseline - (key, metric, baseline, value)
+def regressions(summary, baseline, time_tolerance=TIME_TOLERANCE, rss_tolerance=RSS_TOLERANCE):
+    found = []
+    for key, entry in summary.items():
+        base = baseline['stages'].get(key)
+        if base is None:
+            continue
+        if entry['seconds'] > base['seconds'] * time_tolerance and entry['seconds'] - base['seconds'] > MIN_SECONDS:
+            found.append((key, 'seconds', base['seconds'], entry['seconds']))
+        if ('rss_growth_mb' in base and 'rss_growth_mb' in entry and
+                entry['rss_growth_mb'] > base['rss_growth_mb'] * rss_tolerance and
+                entry['rss_growth_mb'] - base['rss_growth_mb'] > MIN_RSS_MB):
+            found.append((key, 'rss_growth_mb', base['rss_growth_mb'], entry['rss_growth_mb']))
+    return found
+
+
+#prints the stages of summary (with the change against the baseline) and the regressions - returns the regressions
+def report(summary, baseline=None, time_tolerance=TIME_TOLERANCE, rss_tolerance=RSS_TOLERANCE):
+    stages = baseline['stages'] if baseline else {}
+    width = max([len(key) for key in summary] + [5])
+    for key, entry in summary.items():
+        counts = ', '.join(f'{name} {value}' for name, value in entry.items() if name not in MEASURES)
+        line = f'{key:{width}}  {entry["seconds"]:9.3f}s  {entry["peak_rss_mb"]:8.1f} MB peak'
+        if 'rss_growth_mb' in entry:
+            line += f' (+{entry["rss_growth_mb"]:.1f})'
+        if key in stages:
+            line += (f'  [baseline {stages[key]["seconds"]:.3f}s, +{stages[key].get("rss_growth_mb", 0):.1f} MB, '
+                     f'{entry["seconds"] / max(stages[key]["seconds"], 1e-9):.2f}x]')
+        print(line + (f'  {counts}' if counts else ''))
+    if not baseline:
+        return []
+    if baseline.get('machine') != machine():
+        print(f'note: the baseline was measured on another machine ({baseline.get("machine")})')
+    found = regressions(summary, baseline, time_tolerance, rss_tolerance)
+    for key, metric, base, value in found:
+        print(f'REGRESSION {key}: {metric} {value:.3f} (baseline {base:.3f})')
+    missing = [key for key in stages if key not in summary]
+    print(f'{len(summary)} stages, {len(found)} regressions'
+          + (f', {len(missing)} baseline stages not measured' if missing else ''))
+    return found
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Summarise a metrics file per stage and compare it with a baseline.')
+    parser.add_argument('metrics', help='metrics file (JSON lines written with --metrics or TREES_METRICS)')
+    parser.add_argument('--baseline', help='baseline file to compare with (or to write with --update)')
+    parser.add_argument('--update', action='store_true', help='store the metrics as the new baseline')
+    parser.add_argument('--time-tolerance', type=float, default=TIME_TOLERANCE,
+                        help=f'flag stages slower than this factor x the baseline (default {TIME_TOLERANCE})')
+    parser.add_argument('--rss-tolerance', type=float, default=RSS_TOLERANCE,
+                        help=f'flag stages whose memory growth (peak RSS over the RSS at the start of the stage) is more '
+                             f'than this factor x the baseline growth (default {RSS_TOLERANCE})')
+    args = parser.parse_args(argv[1:])
+
+    summary = summarise(read_metrics(args.metrics))
+    if args.update:
+        if not args.baseline:
+            parser.error('--update needs --baseline FILE')
+        write_baseline(args.baseline, summary)
+        report(summary)
+        print(f'baseline {args.baseline} updated ({len(summary)} stages)')
+        return
+    baseline = read_baseline(args.baseline) if args.baseline else None
+    found = report(summary, baseline, args.time_tolerance, args.rss_tolerance)
+    raise SystemExit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main(argv)
@@ -0,0 +1,385 @@
+#Live ingestion: follows the sensor log (nRF Connect) and the gpx track of a walk while they are still being written
+#and loads the air measurements with their trees into the database in small batches, so the results can be queried
+#minutes after the walk instead of after exporting, decoding, matching and loading the files.
+
+#The steps run as asyncio tasks connected by bounded queues. New lines of the log are decoded with SensorFileParser.
+#Every air measurement waits until the lines after it (so its meteo values) and a gpx point at or after its time have
+#arrived, or until max_delay has passed. It then gets the meteo values (as-of join, see alignment.py) and its position:
+#the gpx point at the same time, or linear interpolation (by time) between two points at most max_gap seconds apart.
+#Measurements without a position are dropped. Located measurements are matched against the trees of the area around
+#the walk (tree cache + TreeMatcher kept in memory, reloaded when the walk leaves the area) and written in batches of
+#batch_rows rows or after batch_seconds. If the database falls behind, the queues fill up and reading the files pauses
+#(backpressure), so memory stays bounded and the delay of a measurement is at most about max_delay + batch_seconds
+#plus the time of writing the batches queued before it.
+
+#The run ends when neither file has grown for 'idle' seconds (or on Ctrl+C) - the measurements still waiting are
+#written before it stops.
+
+#usage: python live.py SENSOR_LOG GPX_FILE [--radius 50] [--batch-rows 500] [--batch-seconds 5] [--max-delay 60]
+#       [--idle 300] [--trees TREE_CSV] [--output FILE]   (--output writes the rows to a csv/parquet file instead of
+#       the database)
+
+import io
+import os
+import json
+import time
+import signal
+import asyncio
+import argparse
+from sys import argv
+import numpy as np
+import pandas as pd
+import air_tree
+from alignment import NS_PER_SECOND, to_epoch_ns, utc_to_local_ns, asof_indices, take
+from gpx_reader import GpxFeed
+from sensor_file_parser import SensorFileParser
+from table_io import TableWriter
+from tree_cache import open_tree_cache
+from tree_matcher import TreeMatcher
+
+#half size (degrees) of the area of trees kept in memory around the walk, and the margin (about 100m, as
+#air_tree.sampling_area) measurements keep from the edge of the area before it is reloaded
+AREA_LAT, AREA_LON = 0.005, 0.0075
+MARGIN_LAT, MARGIN_LON = 0.001, 0.0015
+
+#lists of new lines / batches waiting for the next step
+LINE_QUEUE_SIZE = 4
+BATCH_QUEUE_SIZE = 2
+#lines decoded at once
+MAX_LINES = 5000
+
+
+#State of one session: decoded measurements waiting for their position, recent meteo values and gpx points and the
+#trees of the area around the walk.
+class LiveSession:
+    def __init__(self, session, tree_cache, radius=50, tolerance=0, max_gap=15, max_delay=60,
+                 timezone='Europe/London'):
+        self.session = session
+        self.date = session[0:10]
+        self.tree_cache = tree_cache
+        self.radius = radius
+        self.tolerance = tolerance
+        self.max_gap = max_gap
+        self.max_delay = max_delay
+        self.timezone = timezone
+        self.parser = SensorFileParser()
+
+        self.env = pd.DataFrame([], columns=self.parser.cols_env)
+        self.env_ns = np.empty(0, dtype=np.int64)
+        self.arrival = np.empty(0)
+        self.meteo = pd.DataFrame([], columns=self.parser.cols_meteo)
+        self.meteo_ns = np.empty(0, dtype=np.int64)
+        #time of the latest line of the log
+        self.sensor_ns = np.iinfo(np.int64).min
+
+        self.pos_ns = np.empty(0, dtype=np.int64)
+        self.pos = np.empty((0, 3))
+
+        self.area = None
+        self.df_trees = None
+        self.matcher = None
+
+        self.n_air = 0
+        self.dropped = 0
+        self.last_data = time.monotonic()
+
+    def add_lines(self, lines, now):
+        meteo, env = self.parser.decode_lines(lines, self.date)
+        self.last_data = now
+        if len(meteo):
+            self.meteo = pd.concat([self.meteo, meteo], ignore_index=True) if len(self.meteo) else meteo
+            self.meteo_ns = np.concatenate([self.meteo_ns, to_epoch_ns(meteo['time'])])
+            self.sensor_ns = max(self.sensor_ns, self.meteo_ns.max())
+        if len(env):
+            self.env = pd.concat([self.env, env], ignore_index=True) if len(self.env) else env
+            self.env_ns = np.concatenate([self.env_ns, to_epoch_ns(env['time'])])
+            self.arrival = np.concatenate([self.arrival, np.full(len(env), now)])
+            self.sensor_ns = max(self.sensor_ns, self.env_ns.max())
+        #the log is in time order except for a few lines - keep the meteo values sorted for the as-of join
+        if len(meteo) and (np.diff(self.meteo_ns) < 0).any():
+            order = np.argsort(self.meteo_ns, kind='stable')
+            self.meteo, self.meteo_ns = self.meteo.iloc[order].reset_index(drop=True), self.meteo_ns[order]
+
+    #gpx points (GpxTrack) - times are converted to the local time of the sensor
+    def add_positions(self, track, now):
+        if not len(track):
+            return
+        self.last_data = now
+        utc_ns = to_epoch_ns(track.time)
+        valid = ~np.isnat(track.time)
+        local_ns = utc_to_local_ns(utc_ns[valid], self.timezone)
+        self.pos_ns = np.concatenate([self.pos_ns, local_ns])
+        self.pos = np.concatenate([self.pos, np.column_stack([track.latitude, track.longitude,
+                                                              track.elevation])[valid]])
+        if (np.diff(self.pos_ns) < 0).any():
+            order = np.argsort(self.pos_ns, kind='stable')
+            self.pos_ns, self.pos = self.pos_ns[order], self.pos[order]
+
+    #latitude, longitude and elevation at the times t (NaN where there is no gpx point at t and the points around
+    #t are more than max_gap seconds apart)
+    def locate(self, t):
+        located = np.full((len(t), 3), np.nan)
+        if not len(self.pos_ns):
+            return located
+        prev = np.searchsorted(self.pos_ns, t, side='right') - 1
+        has_prev = prev >= 0
+        prev_safe = np.maximum(prev, 0)
+        exact = has_prev & (self.pos_ns[prev_safe] == t)
+        located[exact] = self.pos[prev[exact]]
+
+        nxt = prev + 1
+        between = has_prev & ~exact & (nxt < len(self.pos_ns))
+        p, q = prev[between], nxt[between]
+        gap = self.pos_ns[q] - self.pos_ns[p]
+        close = gap <= int(round(self.max_gap * NS_PER_SECOND))
+        p, q, rows = p[close], q[close], np.flatnonzero(between)[close]
+        w = ((t[rows] - self.pos_ns[p]) / (self.pos_ns[q] - self.pos_ns[p]))[:, None]
+        located[rows] = self.pos[p] + w * (self.pos[q] - self.pos[p])
+        return located
+
+    #Located measurements that are ready (all of them if flush) - same columns as the interpolated sensor+gpx data
+    #of the pipeline - and the arrival time of the oldest one. Old meteo values and gpx points are dropped.
+    def take_ready(self, now, flush=False):
+        last_pos = self.pos_ns[-1] if len(self.pos_ns) else np.iinfo(np.int64).min
+        ready = (((self.env_ns < self.sensor_ns) & (self.env_ns <= last_pos))
+                 | (now - self.arrival >= self.max_delay) | flush)
+        if not ready.any():
+            return None, None
+        env, t, oldest = self.env[ready].reset_index(drop=True), self.env_ns[ready], self.arrival[ready].min()
+        self.env, self.env_ns, self.arrival = (self.env[~ready].reset_index(drop=True), self.env_ns[~ready],
+                                               self.arrival[~ready])
+
+        idx = asof_indices(t, self.meteo_ns, self.tolerance)
+        for name in self.parser.cols_meteo[1:]:
+            env[name] = take(self.meteo[name].to_numpy(), idx)
+        env[['latitude', 'longitude', 'elevation']] = self.locate(t)
+        located = env['latitude'].notna().to_numpy()
+        self.dropped += int((~located).sum())
+
+        #values older than the measurements still waiting (and the newest ones) are not needed anymore
+        keep_from = self.env_ns.min() if len(self.env_ns) else t.max()
+        keep_meteo = self.meteo_ns >= keep_from - int(round(self.tolerance * NS_PER_SECOND))
+        keep_meteo[-1:] = True
+        self.meteo, self.meteo_ns = self.meteo[keep_meteo].reset_index(drop=True), self.meteo_ns[keep_meteo]
+        keep_pos = self.pos_ns >= keep_from - int(round(self.max_gap * NS_PER_SECOND))
+        keep_pos[-1:] = True
+        self.pos_ns, self.pos = self.pos_ns[keep_pos], self.pos[keep_pos]
+
+        env = env[located].reset_index(drop=True)
+        if not len(env):
+            return None, None
+        env['Index'] = np.arange(len(env))
+        return env, oldest
+
+    #trees of the area around the measurements - reloaded from the tree cache when they leave the area
+    def trees_around(self, df):
+        lat, lon = df['latitude'].to_numpy(), df['longitude'].to_numpy()
+        if self.area is not None:
+            min_lat, max_lat, min_lon, max_lon = self.area
+            if (lat.min() >= min_lat + MARGIN_LAT and lat.max() <= max_lat - MARGIN_LAT
+                    and lon.min() >= min_lon + MARGIN_LON and lon.max() <= max_lon - MARGIN_LON):
+                return self.df_trees, self.matcher
+        self.area = (lat.min() - AREA_LAT, lat.max() + AREA_LAT, lon.min() - AREA_LON, lon.max() + AREA_LON)
+        self.df_trees = self.tree_cache.load_bbox(*self.area)
+        self.matcher = TreeMatcher(self.df_trees['lat'].to_numpy(), self.df_trees['lon'].to_numpy(),
+                                   cell_size=self.radius)
+        return self.df_trees, self.matcher
+
+    #all_air_tree_data rows (one per measurement and tree within radius) of located measurements - air measurements
+    #are numbered through the whole session
+    def match(self, df):
+        df_trees, matcher = self.trees_around(df)
+        df, pairs = air_tree.match_trees(df, df_trees, self.radius, matcher)
+        rows = air_tree.air_tree_products(df, df_trees, pairs, self.radius)[1]
+        rows['Air measurement'] += self.n_air
+        self.n_air += len(df)
+        return rows
+
+
+#writes batches into the database with the statements of load_data.py, one transaction per batch
+class DatabaseSink:
+    def __init__(self, conn, session, dist):
+        self.conn = conn
+        self.session = session
+        self.location = session[11:13]
+        self.dist = dist
+        with conn.cursor() as cur:
+            cur.execute('select sensor.add_measurement_partition(%s::date)', (session[:10],))
+        conn.commit()
+
+    def write(self, rows):
+        from load_data import load_rows
+        text = io.StringIO()
+        rows.to_csv(text)
+        text.seek(0)
+        with self.conn.cursor() as cur:
+            copied, new, matches = load_rows(cur, text, self.session, self.location, self.dist)
+        self.conn.commit()
+        return f'{copied} rows, {sum(new)} new measurements, {matches} tree matches'
+
+    def close(self):
+        self.conn.close()
+
+
+#writes batches to a csv and/or parquet file (see table_io.py) instead of the database
+class FileSink:
+    def __init__(self, path, output_format):
+        self.writer = TableWriter(path, output_format)
+
+    def write(self, rows):
+        self.writer.write(rows)
+        return f'{len(rows)} rows'
+
+    def close(self):
+        self.writer.close()
+
+
+#puts the new lines of a growing text file into the queue (waits while the queue is full) - None at the end
+async def follow_log(path, queue, stop, poll=1.0):
+    while not os.path.exists(path) and not stop.is_set():
+        await asyncio.sleep(poll)
+    rest = ''
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            while True:
+                text = f.read(1 << 20)
+                if not text:
+                    if stop.is_set():
+                        break
+                    await asyncio.sleep(poll)
+                    continue
+                lines = (rest + text).split('\n')
+                rest = lines.pop()
+                for start in range(0, len(lines), MAX_LINES):
+                    await queue.put([ln + '\n' for ln in lines[start:start + MAX_LINES]])
+    if rest:
+        await queue.put([rest + '\n'])
+    await queue.put(None)
+
+
+#adds the points of a growing gpx file to the session
+async def follow_gpx(path, live, stop, poll=1.0):
+    feed = GpxFeed()
+    while not os.path.exists(path) and not stop.is_set():
+        await asyncio.sleep(poll)
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(1 << 20)
+            if data:
+                live.add_positions(feed.feed(data), time.monotonic())
+            elif stop.is_set():
+                return
+            else:
+                await asyncio.sleep(poll)
+
+
+#decodes, aligns and matches the lines and puts batches (rows, arrival of the oldest measurement) into 'batches'
+async def process(lines, batches, live, stop, batch_rows=500, batch_seconds=5.0, idle=300.0, poll=1.0):
+    pending, n_pending, oldest, opened = [], 0, None, None
+    finished = False
+    while not finished:
+        try:
+            item = await asyncio.wait_for(lines.get(), timeout=poll)
+        except asyncio.TimeoutError:
+            item = []
+        now = time.monotonic()
+        finished = item is None
+        if item:
+            live.add_lines(item, now)
+
+        df, arrival = live.take_ready(now, flush=finished)
+        if df is not None:
+            rows = live.match(df)
+            pending.append(rows)
+            n_pending += len(rows)
+            oldest = arrival if oldest is None else min(oldest, arrival)
+            opened = now if opened is None else opened
+        if pending and (n_pending >= batch_rows or now - opened >= batch_seconds or finished):
+            await batches.put((pd.concat(pending, ignore_index=True), oldest))
+            pending, n_pending, oldest, opened = [], 0, None, None
+        if now - live.last_data > idle:
+            stop.set()
+    await batches.put(None)
+
+
+#writes the batches (in a thread, so reading and matching go on meanwhile) and collects the delays
+async def write_batches(batches, sink, delays):
+    while True:
+        batch = await batches.get()
+        if batch is None:
+            return
+        rows, oldest = batch
+        summary = await asyncio.to_thread(sink.write, rows)
+        delays.append(time.monotonic() - oldest)
+        print(f'batch: {summary}, delay {delays[-1]:.1f}s')
+
+
+async def run_live(sensor_file, gpx_file, live, sink, batch_rows=500, batch_seconds=5.0, idle=300.0, poll=1.0):
+    stop = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGINT, stop.set)
+    except (NotImplementedError, RuntimeError):
+        pass
+    lines = asyncio.Queue(maxsize=LINE_QUEUE_SIZE)
+    batches = asyncio.Queue(maxsize=BATCH_QUEUE_SIZE)
+    delays = []
+    await asyncio.gather(follow_log(sensor_file, lines, stop, poll),
+                         follow_gpx(gpx_file, live, stop, poll),
+                         process(lines, batches, live, stop, batch_rows, batch_seconds, idle, poll),
+                         write_batches(batches, sink, delays))
+    return delays
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Load a walk into the database while the sensor log and gpx track '
+                                                 'are being written.')
+    parser.add_argument('sensor_file', help='sensor log (YYYY-MM-DD_LL_*.txt) that is being written by nRF Connect')
+    parser.add_argument('gpx_file', help='gpx track that is being written')
+    parser.add_argument('--session', help="session name (default: 'YYYY-MM-DD_LL' from the sensor file name)")
+    parser.add_argument('--radius', type=int, default=50, help='largest radius (m) trees are matched within')
+    parser.add_argument('--tolerance', type=float, default=0, help='max age (s) of the meteo values joined to an air '
+                                                                   'measurement (0: same time only)')
+    parser.add_argument('--max-gap', type=float, default=15, help='max time (s) between the gpx points a position '
+                                                                  'is interpolated between')
+    parser.add_argument('--max-delay', type=float, default=60, help='max time (s) a measurement waits for its '
+                                                                    'position and meteo values')
+    parser.add_argument('--batch-rows', type=int, default=500, help='rows written at once')
+    parser.add_argument('--batch-seconds', type=float, default=5, help='max time (s) rows wait for their batch')
+    parser.add_argument('--idle', type=float, default=300, help='stop when the files have not grown for this many '
+                                                                'seconds')
+    parser.add_argument('--poll', type=float, default=1, help='time (s) between checks of the files')
+    parser.add_argument('--timezone', default='Europe/London', help='timezone of the sensor clock')
+    parser.add_argument('--trees', help="tree database csv (default: 'tree_data_path' in import.config.json)")
+    parser.add_argument('--output', help='write the rows to this csv file (and/or parquet, see output_format) '
+                                         'instead of the database')
+    args = parser.parse_args(argv[1:])
+
+    with open("import.config.json", "r") as jsonfile:
+        import_config = json.load(jsonfile)
+    tree_data_path = args.trees or import_config.get("tree_data_path")
+    if not tree_data_path:
+        parser.error("specify the tree database csv with --trees or 'tree_data_path' in import.config.json")
+
+    session = args.session or os.path.basename(args.sensor_file)[:13]
+    tree_cache = open_tree_cache(tree_data_path, import_config["tree_cache_path"])
+    live = LiveSession(session, tree_cache, args.radius, args.tolerance, args.max_gap, args.max_delay, args.timezone)
+    if args.output:
+        sink = FileSink(args.output, import_config.get("output_format", "csv"))
+    else:
+        from db_matcher import connect
+        sink = DatabaseSink(connect(import_config), session, args.radius)
+
+    start = time.perf_counter()
+    try:
+        delays = asyncio.run(run_live(args.sensor_file, args.gpx_file, live, sink, args.batch_rows,
+                                      args.batch_seconds, args.idle, args.poll))
+    finally:
+        sink.close()
+    print(f'{session}: {live.n_air} measurements in {len(delays)} batches ({live.dropped} without position) in '
+          f'{time.perf_counter() - start:.0f}s, delay max {max(delays, default=0):.1f}s')
+
+
+if __name__ == "__main__":
+    main(argv)
@@ -1,60 +1,323 @@
+#Loads the sens+gpx+tree outputs ('YYYY-MM-DD_LL_[d]m_all_air_tree_data.csv' or .parquet in sens_gpx_tree_path)
+#into the database: sensor.sessions, sensor.measurements (one row per located air measurement), sensor.trees (one row
+#per objectid, tree names as codes into sensor.species) and sensor.tree_matches (measurement, tree, distance). The
+#views sensor.dist_[d] give the former wide tables (see Database/initdb-postgis.sh).
+
+#Each file is streamed with COPY into a temporary staging table (parquet files are converted to csv in memory) and
+#moved into the tables with one insert ... on conflict statement per table. Measurements are identified by
+#(session, time, sensor_geom) - several measurements can share a timestamp, so the position of the measurement is
+#part of the key. Files are recorded with their content hash in import.loaded_files, so loading a file that has not
+#changed is skipped.
+
+#sensor.measurements is partitioned by day - the partition of a session is created before its files are loaded.
+
+#Measurements within a park (sensor.green_spaces) are marked in_park when they are loaded.
+
+#Sessions are loaded by a pool of worker threads, each with its own connection and one transaction per file.
+
+#usage: python load_data.py [FILE ...] [--force] [--workers 4] [--metrics FILE]   (default: all files in
+#sens_gpx_tree_path - parquet files are used instead of csv files with the same name)
+
 # Library
-import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+import io
 import re
+import csv
 import json
+import time
+import argparse
+from sys import argv
 from pathlib import Path
-import pandas as pd
-from sqlalchemy import create_engine, text, exc
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from import_data import file_sha256
+from table_io import read_table
+import instrument
 
-# Load the database connection parameters
-with open("import.config.json", "r") as jsonfile:
-    import_config = json.load(jsonfile)
+FILE_NAME = re.compile(r'^(\d{4}-\d{2}-\d{2}_[A-Za-z0-9]{2})_(\d+)m_.*\.(csv|parquet)$')
 
-# Create a connection to the PostgreSQL server
-conn = psycopg2.connect(
-    host=import_config['host'],
-    database=import_config['database'],
-    user=import_config['user'],
-    password=import_config['password'],
-    port=import_config['port']
-)
+# (column, value selected from the csv in the staging table)
+MEASUREMENT_COLUMNS = [
+    ('"time"', '"time"::timestamp at time zone \'Europe/London\''),
+    ('pm_1', 'pm_1::double precision'),
+    ('pm_25', 'pm_25::double precision'),
+    ('pm_10', 'pm_10::double precision'),
+    ('pm_4', 'pm_4::double precision'),
+    ('temperature', 'temperature::double precision'),
+    ('humidity', 'humidity::double precision'),
+    ('pressure', 'pressure::double precision'),
+    ('temperature2', 'temperature2::double precision'),
+    ('sensor_geom', 'st_setsrid(st_makepoint(longitude::double precision, latitude::double precision), 4326)'),
+    ('elevation', 'elevation::double precision'),
+    ('dist_to_closest_tree', '"Dist_to_closest_tree"::double precision'),
+    ('air_measurement', '"Air measurement"::double precision::integer'),
+]
+TREE_COLUMNS = [
+    ('objectid', 'objectid::double precision::integer'),
+    ('tree_geom', 'st_setsrid(st_makepoint(lon::double precision, lat::double precision), 4326)'),
+    ('borough', 'borough'),
+    ('gla_tree_group', 'gla_tree_group'),
+    ('tree_name', 'tree_name'),
+    ('taxon_name', 'taxon_name'),
+    ('age', 'age'),
+    ('age_group', 'age_group'),
+    ('spread_m', 'spread_m::double precision'),
+    ('height_m', 'height_m::double precision'),
+    ('diameter_at_breast_height_cm', 'diameter_at_breast_height_cm::double precision'),
+    ('gdb_geomattr_data', 'gdb_geomattr_data::double precision'),
+]
+MATCH_COLUMNS = [
+    ('distance', '"Distance_to_tree"::double precision'),
+    ('tree_number', '"Tree number_x"::double precision::integer'),
+]
 
-# Create a cursor object
-cur = conn.cursor()
 
-# Set automatic commit to be true, so that each action is committed without having to call conn.committ() after each command
-conn.set_session(autocommit=True)
+def quote_ident(name):
+    return '"' + name.replace('"', '""') + '"'
 
-# Commit the changes and close the connection to the default database
-# Connect to the 'soccer' database
 
-engine = create_engine(f'postgresql://{import_config["user"]}:{import_config["password"]}@{import_config["host"]}:{import_config["port"]}/{import_config["database"]}')
+#csv text of a file for COPY - parquet files are converted, with the pandas index as first column like the csv files
+def open_csv(path):
+    if path.suffix == '.parquet':
+        text = io.StringIO()
+        read_table(path).to_csv(text)
+        text.seek(0)
+        return text
+    return open(path, 'r', newline='')
 
-# Define the file paths for your CSV files
-for path in Path(import_config["sens_gpx_tree_path"]).resolve().iterdir():
-    try:
-        location = path.name[11:13]
-        dist = re.search(r'\d+', path.name[14:16]).group()
-        print(f'Import: {path.name} -> {path.name.rfind("_")} {location} {dist} m')
-        df = pd.read_csv(path)
-        fname  = path.name.rstrip(".csv")
-
-        df.to_sql(fname, engine, if_exists='replace', index=False, schema='import')
-        cur.execute(f'insert into sensor.dist_{dist} ("time", location, pm_1, pm_25, pm_10, pm_4, temperature, '
-                    f'humidity, pressure, temperature2, sensor_geom, elevation, dist_to_closest_tree, air_measurement, '
-                    f'tree_number_x, air_tree_id, distance_to_tree, objectid, tree_geom, tree_within_d20, borough, '
-                    f'gla_tree_group, tree_name, taxon_name, age, age_group, spread_m, height_m, diameter_at_breast_height_cm, '
-                    f'gdb_geomattr_data, updated) select time, \'{location}\', pm_1, pm_25, pm_10, pm_4, temperature, humidity, pressure, temperature2, '
-                    f'st_setsrid(st_makepoint(longitude,latitude),4326), elevation, "Dist_to_closest_tree", "Air measurement", '
-                    f'"Tree number_x", "Air-tree ID", "Distance_to_tree", objectid, st_setsrid(st_makepoint(lon,lat),4326), '
-                    f'"Tree_within_d_(default: 20m)", borough, gla_tree_group, tree_name, taxon_name, age, age_group, spread_m, '
-                    f'height_m, diameter_at_breast_height_cm, gdb_geomattr_data, now()'
-                    f' from import."{fname}" i where not exists(select 1 from sensor.dist_{dist} where dist_{dist}.time = i.time '
-                    f'and st_equals(sensor_geom, st_setsrid(st_makepoint(longitude,latitude),4326)) );')
+
+#temporary table with one text column for every column in the csv header (dropped at the end of the transaction)
+def create_staging_table(cur, header):
+    #first column is the (unnamed) pandas index
+    header = ['row' if not name else name for name in header]
+    columns = ', '.join(quote_ident(name) + ' text' for name in header)
+    cur.execute(f'create temporary table stage_load ({columns}) on commit drop')
+
+
+def _names(columns, prefix=''):
+    return ', '.join(prefix + target for target, _ in columns)
+
+
+def _updates(columns, table, keep=()):
+    return ', '.join(f'{target} = coalesce(excluded.{target}, {table}.{target})' if target in keep
+                     else f'{target} = excluded.{target}' for target, _ in columns)
+
+
+#typed values of the csv rows with geometries built once (dropped at the end of the transaction)
+STAGED_SQL = ('create temporary table staged on commit drop as select '
+              + ', '.join(f'{value} as {target}' for target, value in MEASUREMENT_COLUMNS + TREE_COLUMNS + MATCH_COLUMNS)
+              + ' from stage_load')
+
+SESSION_SQL = ('insert into sensor.sessions (session, location, max_radius, loaded_at) '
+               'values (%(session)s, %(location)s, %(dist)s, now()) '
+               'on conflict (session) do update set max_radius = greatest(sessions.max_radius, excluded.max_radius), '
+               'loaded_at = excluded.loaded_at')
+
+#measurement columns that are not part of the key (session, time, sensor_geom)
+MEASUREMENT_VALUES = [c for c in MEASUREMENT_COLUMNS if c[0] not in ('"time"', 'sensor_geom')]
+
+#measurements within a park or other green space (sensor.green_spaces, gist index on the polygons)
+IN_PARK_SQL = 'exists (select 1 from sensor.green_spaces g where st_within(sensor_geom, g.geom))'
+
+#a measurement is repeated in the csv for every tree within the radius - it is inserted once, preferring a row with
+#its number ('Air measurement', only set on rows with a tree). Returns true for inserted and false for updated rows.
+MEASUREMENT_SQL = (f'insert into sensor.measurements (session, location, {_names(MEASUREMENT_COLUMNS)}, in_park, updated) '
+                   f'select distinct on ("time", sensor_geom) %(session)s, %(location)s, {_names(MEASUREMENT_COLUMNS)}, '
+                   f'{IN_PARK_SQL}, now() '
+                   f'from staged order by "time", sensor_geom, air_measurement nulls last '
+                   f'on conflict (session, "time", sensor_geom) do update set '
+                   f'{_updates(MEASUREMENT_VALUES, "measurements", keep=("air_measurement",))}, '
+                   f'in_park = excluded.in_park, updated = excluded.updated '
+                   f'returning (xmax = 0)')
+
+#tree names are stored as codes into sensor.species - new names are added first
+SPECIES_SQL = ('insert into sensor.species (tree_name) '
+               'select distinct tree_name from staged where tree_name is not null order by tree_name '
+               'on conflict (tree_name) do nothing')
+
+#columns of sensor.trees - species_id instead of tree_name
+TREE_TABLE_COLUMNS = [('species_id', 'sp.species_id') if target == 'tree_name' else (target, 's.' + target)
+                      for target, _ in TREE_COLUMNS]
+
+TREE_SQL = (f'insert into sensor.trees ({_names(TREE_TABLE_COLUMNS)}, updated) '
+            f'select distinct on (s.objectid) {", ".join(value for _, value in TREE_TABLE_COLUMNS)}, now() '
+            f'from staged s left join sensor.species sp on sp.tree_name = s.tree_name where s.objectid is not null '
+            f'order by s.objectid '
+            f'on conflict (objectid) do update set {_updates(TREE_TABLE_COLUMNS[1:], "trees")}, '
+            f'updated = excluded.updated')
+
+#outputs written before tree rows were carried through matching repeat trees sharing coordinates for the same
+#measurement - one match is kept per tree
+MATCH_SQL = ('insert into sensor.tree_matches (measurement_id, objectid, distance, tree_number) '
+             'select distinct on (m.id, s.objectid) m.id, s.objectid, s.distance, s.tree_number '
+             'from staged s join sensor.measurements m '
+             'on m.session = %(session)s and m.time = s.time and m.sensor_geom = s.sensor_geom '
+             'where s.objectid is not null order by m.id, s.objectid, s.tree_number '
+             'on conflict (measurement_id, objectid) do update set distance = excluded.distance, '
+             'tree_number = excluded.tree_number')
+
+
+#Copies the rows of an all_air_tree_data csv (file object with header) into the tables of a session, in the open
+#transaction. Returns the number of rows, the inserted (true) / updated (false) flag of every measurement and the
+#number of tree matches.
+def load_rows(cur, f, session, location, dist):
+    create_staging_table(cur, next(csv.reader(f)))
+    f.seek(0)
+    cur.copy_expert('copy stage_load from stdin with (format csv, header true)', f)
+    copied = cur.rowcount
+    params = {'session': session, 'location': location, 'dist': dist}
+    cur.execute(STAGED_SQL)
+    cur.execute(SESSION_SQL, params)
+    cur.execute(MEASUREMENT_SQL, params)
+    new = [row[0] for row in cur.fetchall()]
+    cur.execute(SPECIES_SQL)
+    cur.execute(TREE_SQL)
+    cur.execute(MATCH_SQL, params)
+    return copied, new, cur.rowcount
+
+
+#Loads one file in its own transaction. Returns a dict with the result, which is printed by the caller.
+def load_file(conn, path, force=False):
+    result = {'file': path.name, 'status': 'skipped', 'rows': 0, 'inserted': 0, 'updated': 0}
+    match = FILE_NAME.match(path.name)
+    if not match:
+        result['reason'] = 'not an all_air_tree_data file'
+        return result
+    session, dist = match.group(1), int(match.group(2))
+    location = session[11:13]
+    result.update(session=session, dist=dist)
+    sha = file_sha256(path)
+
+    with conn.cursor() as cur:
+        cur.execute('select sha256 from import.loaded_files where file_name = %s', (path.name,))
+        loaded = cur.fetchone()
+        if loaded and loaded[0] == sha and not force:
+            conn.rollback()
+            result['reason'] = 'already loaded'
+            return result
+
+        #the partition for the day of the session is created in a separate transaction - creating it while other
+        #loaders are writing to sensor.measurements would otherwise make them wait for each other
+        cur.execute('select sensor.add_measurement_partition(%s::date)', (session[:10],))
         conn.commit()
-    except  Exception as e:
-        print(f'Error during import ---> {e} {path}')
-        pass
 
-cur.close()
-conn.close()
+        with instrument.stage('load', session=session, dist=dist), open_csv(path) as f:
+            copied, new, matches = load_rows(cur, f, session, location, dist)
+            instrument.count(rows=copied, measurements=len(new), matches=matches)
+        cur.execute('insert into import.loaded_files (file_name, sha256, session, dist, rows, loaded_at) '
+                    'values (%s, %s, %s, %s, %s, now()) '
+                    'on conflict (file_name) do update set sha256 = excluded.sha256, rows = excluded.rows, '
+                    'loaded_at = excluded.loaded_at',
+                    (path.name, sha, session, dist, copied))
+    conn.commit()
+    result.update(status='loaded', rows=copied, inserted=sum(new), updated=len(new) - sum(new), matches=matches)
+    return result
+
+
+#runs load_file with a connection from the pool - errors are returned as a result instead of stopping the load
+def load_worker(pool, path, force=False):
+    start = time.perf_counter()
+    conn = pool.getconn()
+    try:
+        result = load_file(conn, path, force)
+    except Exception as e:
+        conn.rollback()
+        result = {'file': path.name, 'status': 'failed', 'rows': 0, 'error': str(e).strip()}
+    finally:
+        pool.putconn(conn)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+#loads the files of one session one after the other, largest radius first
+def load_session(pool, paths, force=False):
+    return [load_worker(pool, path, force) for path in paths]
+
+
+def report(result):
+    if result['status'] == 'loaded':
+        print(f'Import: {result["file"]} -> {result["session"][11:13]} {result["dist"]} m: {result["rows"]} rows, '
+              f'{result["inserted"]} new measurements, {result["updated"]} updated, {result["matches"]} tree matches '
+              f'in {result["seconds"]:.2f}s '
+              f'({result["rows"] / max(result["seconds"], 1e-9):.0f} rows/s)')
+    elif result['status'] == 'skipped':
+        print(f'skip {result["file"]} ({result["reason"]})')
+    else:
+        print(f'Error during import ---> {result["error"]} {result["file"]} ({result["seconds"]:.2f}s)')
+
+
+#files grouped by session, largest radius first. All radii of a session are written to the same rows, so each
+#session is loaded by one worker while different sessions are loaded side by side.
+def group_by_session(paths):
+    groups = {}
+    for path in paths:
+        match = FILE_NAME.match(path.name)
+        groups.setdefault(match.group(1) if match else path.name, []).append(path)
+    def radius(path):
+        match = FILE_NAME.match(path.name)
+        return -int(match.group(2)) if match else 0
+    return [sorted(group, key=radius) for group in groups.values()]
+
+
+#Loads the files with 'workers' threads sharing a pool of database connections. Returns the results of all files.
+def load_files(db_config, paths, workers=4, force=False):
+    pool = ThreadedConnectionPool(
+        1, workers,
+        host=db_config['host'],
+        database=db_config['database'],
+        user=db_config['user'],
+        password=db_config['password'],
+        port=db_config['port']
+    )
+    start = time.perf_counter()
+    results = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(load_session, pool, group, force) for group in group_by_session(paths)]
+            for future in as_completed(futures):
+                for result in future.result():
+                    report(result)
+                    results.append(result)
+    finally:
+        pool.closeall()
+
+    seconds = time.perf_counter() - start
+    loaded = [r for r in results if r['status'] == 'loaded']
+    failed = [r for r in results if r['status'] == 'failed']
+    rows = sum(r['rows'] for r in loaded)
+    print(f'{len(loaded)} loaded, {len(results) - len(loaded) - len(failed)} skipped, {len(failed)} failed: '
+          f'{rows} rows in {seconds:.2f}s ({rows / max(seconds, 1e-9):.0f} rows/s)')
+    for r in failed:
+        print(f'  failed: {r["file"]}: {r["error"]}')
+    return results
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Load all_air_tree_data csv/parquet files into the measurement, tree and '
+                                                 'tree match tables of the database.')
+    parser.add_argument('files', nargs='*', help='csv or parquet files to load (default: all files in sens_gpx_tree_path)')
+    parser.add_argument('--force', action='store_true', help='load files again even if they are unchanged')
+    parser.add_argument('--workers', type=int, default=4, help='number of sessions loaded at the same time (default: 4)')
+    parser.add_argument('--metrics', help='append the time, peak memory and rows of every file to this file (JSON lines, '
+                                          'see instrument.py)')
+    args = parser.parse_args(argv[1:])
+    if args.metrics:
+        instrument.enable(args.metrics)
+
+    # Load the database connection parameters
+    with open("import.config.json", "r") as jsonfile:
+        import_config = json.load(jsonfile)
+    db_config = import_config.get("tseries_connection", import_config)
+
+    if args.files:
+        paths = [Path(p).resolve() for p in args.files]
+    else:
+        paths = sorted(p for p in Path(import_config["sens_gpx_tree_path"]).resolve().iterdir() if p.is_file())
+        #outputs written as both csv and parquet are loaded once, from the parquet file
+        paths = [p for p in paths if not (p.suffix == '.csv' and p.with_suffix('.parquet') in paths)]
+
+    results = load_files(db_config, paths, max(args.workers, 1), args.force)
+    raise SystemExit(1 if any(r['status'] == 'failed' for r in results) else 0)
+
+
+if __name__ == "__main__":
+    main(argv)
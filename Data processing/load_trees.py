@@ -0,0 +1,70 @@
+#Loads the whole tree database (GLA London tree inventory csv) into sensor.trees, with the tree names normalised as in
+#the tree cache (tree_species.py). Needed for tree matching in the database (db_matcher.py, sensor.add_radius) - trees
+#loaded with the outputs by load_data.py are only the trees matched to a measurement.
+
+#usage: python load_trees.py [TREE_CSV]   (default: 'tree_data_path' in import.config.json)
+
+import io
+import csv
+import json
+import time
+from sys import argv
+import pandas as pd
+from tree_species import normalize_trees
+from load_data import TREE_COLUMNS, SPECIES_SQL, TREE_SQL, create_staging_table
+from db_matcher import connect
+
+#typed values of the tree csv rows and their row in the csv (dropped at the end of the transaction)
+STAGED_TREES_SQL = ('create temporary table staged on commit drop as select '
+                    + ', '.join(f'{value} as {target}' for target, value in TREE_COLUMNS)
+                    + ', "row"::integer as tree_row from stage_load')
+
+#row of every tree in the tree database csv - the sampling area trees of a session are numbered in this order (tree
+#numbers of the outputs, see sensor.match_trees)
+TREE_ROW_SQL = ('update sensor.trees t set tree_row = s.tree_row '
+                'from (select objectid, min(tree_row) as tree_row from staged group by objectid) s '
+                'where t.objectid = s.objectid')
+
+
+def load_trees(conn, csv_path):
+    df = pd.read_csv(csv_path, low_memory=False)
+    df = normalize_trees(df[df['lat'].notna() & df['lon'].notna() & df['objectid'].notna()])
+    text = io.StringIO()
+    df.to_csv(text)
+    text.seek(0)
+
+    with conn.cursor() as cur:
+        create_staging_table(cur, next(csv.reader(text)))
+        text.seek(0)
+        cur.copy_expert('copy stage_load from stdin with (format csv, header true)', text)
+        copied = cur.rowcount
+        cur.execute(STAGED_TREES_SQL)
+        cur.execute(SPECIES_SQL)
+        cur.execute(TREE_SQL)
+        cur.execute(TREE_ROW_SQL)
+    conn.commit()
+    with conn.cursor() as cur:
+        cur.execute('analyze sensor.trees')
+    conn.commit()
+    return copied
+
+
+def main(argv):
+    with open("import.config.json", "r") as jsonfile:
+        import_config = json.load(jsonfile)
+    csv_path = argv[1] if len(argv) > 1 else import_config.get("tree_data_path")
+    if not csv_path:
+        raise SystemExit("specify the tree database csv (python load_trees.py TREE_CSV) or 'tree_data_path' in "
+                         "import.config.json")
+
+    start = time.perf_counter()
+    conn = connect(import_config)
+    try:
+        trees = load_trees(conn, csv_path)
+    finally:
+        conn.close()
+    print(f'{trees} trees loaded from {csv_path} in {time.perf_counter() - start:.2f}s')
+
+
+if __name__ == "__main__":
+    main(argv)
@@ -0,0 +1,400 @@
+#Incremental runner for the whole processing chain of a session (sensor log + gpx track with the same
+#'YYYY-MM-DD_LL' prefix): decode -> align -> interpolate -> match -> export.
+
+#Every stage is identified by a key - the sha256 of the stage name and version, its parameters (radius,
+#interpolation limit, timezone), the keys of the stages it depends on and the content hash of its input files.
+#Results are cached in 'pipeline_cache_path' as <stage>/<key>.pkl and csv/parquet outputs are only rewritten when the key
+#that produced them changes, so a stage only runs again if something it depends on changed: a new tree csv re-runs
+#matching (and the exports after it) but not decoding, alignment or interpolation; a new session leaves the
+#cached results of the other sessions untouched.
+
+#Many sessions are run in one process, so libraries, the config and the tree cache (with its memory-mapped arrays)
+#are loaded once. With --workers sessions are shared out to worker processes, each keeping its own pipeline and tree
+#cache open for all of its sessions - the cache files are only read, so the workers share them through the page
+#cache. Only the main process writes the manifests. A report with the result and time of every session is printed
+#at the end.
+
+#With --metrics FILE the wall time, peak memory and row counts of every stage that runs are appended to FILE as JSON
+#lines (see instrument.py - python instrument.py FILE --baseline BASELINE.json flags stages slower than a baseline).
+
+#usage: python pipeline.py [SESSION ...] [--dir DIR] [--pair SENSOR_LOG GPX_FILE] [--workers 4] [--radii 5 10 20]
+#                          [--interp-limit 10] [--timezone Europe/London] [--tolerance 0] [--utc-offset 1]
+#                          [--trees TREE_CSV] [--backend python|postgis] [--metrics FILE]
+#SESSION is a 'YYYY-MM-DD_LL' prefix or glob pattern, all sessions found in data_path/gpx_path are run by default.
+#--dir pairs the sensor logs and gpx tracks in a directory, --pair gives the two files of a session.
+
+import os
+import time
+from sys import argv
+import argparse
+import fnmatch
+import glob
+import hashlib
+import json
+import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from import_data import decode_file, file_sha256, read_manifest, write_manifest
+from tree_cache import open_tree_cache
+from table_io import write_table, table_paths
+import air_tree
+import instrument
+
+#increase the version of a stage when its code changes the results, so cached results are not reused
+STAGE_VERSIONS = {'decode': 1, 'align': 3, 'interpolate': 2, 'match': 3, 'export': 3}
+HASHES_NAME = 'file_hashes.json'
+OUTPUTS_NAME = 'outputs.json'
+
+
+class Stage:
+    def __init__(self, pipeline, session, name, func, params=None, deps=(), files=(), outputs=()):
+        self.pipeline = pipeline
+        self.session = session
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.outputs = list(outputs)
+        self.key = pipeline.stage_key(name, params or {}, self.deps, files, self.outputs)
+        self.path = os.path.join(pipeline.cache_dir, name, self.key + '.pkl')
+        self._value = None
+        self._done = False
+
+    #True if the cached result and all csv outputs were produced with the current key
+    def is_current(self):
+        return os.path.exists(self.path) and all(self.pipeline.output_key(p) == self.key for p in self.outputs)
+
+    def value(self):
+        if self._done:
+            return self._value
+        if self.is_current():
+            with open(self.path, 'rb') as f:
+                self._value = pickle.load(f)
+            self.pipeline.record(self, 'cached')
+        else:
+            args = [dep.value() for dep in self.deps]
+            with instrument.stage(self.name, session=self.session):
+                self._value = self.func(*args)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + '.tmp', 'wb') as f:
+                pickle.dump(self._value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(self.path + '.tmp', self.path)
+            self.pipeline.stamp_outputs(self.outputs, self.key)
+            self.pipeline.record(self, 'run')
+        self._done = True
+        return self._value
+
+
+class Pipeline:
+    def __init__(self, import_config, tree_data_path, radii=(5, 10, 15, 20, 50), interp_limit=10,
+                 timezone='Europe/London', tolerance=0, utc_offset=None, backend='python'):
+        #arguments of the pipelines of worker processes
+        self.worker_args = (import_config, tree_data_path, radii, interp_limit, timezone, tolerance, utc_offset, backend)
+        self.config = import_config
+        self.cache_dir = import_config.get("pipeline_cache_path", import_config["cache_path"] + 'pipeline/')
+        self.tree_data_path = tree_data_path
+        self.radii = sorted(set(radii))
+        self.interp_limit = interp_limit
+        self.timezone = timezone
+        self.tolerance = tolerance
+        self.utc_offset = utc_offset
+        self.backend = backend
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.hashes = read_manifest(os.path.join(self.cache_dir, HASHES_NAME))
+        self.output_keys = read_manifest(os.path.join(self.cache_dir, OUTPUTS_NAME))
+        #worker processes don't write the manifests - their new entries are collected and merged by the main process
+        self.write_manifests = True
+        self.new_hashes = {}
+        self.new_output_keys = {}
+        self.log = []
+        self._tree_cache = None
+        self._conn = None
+        self._tree_stamp = None
+
+    #content hash of an input file - only recalculated when its size or modification time changes
+    def file_hash(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self.hashes.get(path)
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['sha256']
+        sha = file_sha256(path)
+        self.add_manifest_entries({path: {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha}}, {})
+        return sha
+
+    #output paths are part of the key, so stages writing files of different sessions never share a result
+    def stage_key(self, name, params, deps, files, outputs):
+        description = {'stage': name, 'version': STAGE_VERSIONS[name], 'params': params,
+                       'deps': [dep.key for dep in deps], 'files': [self.file_hash(p) for p in files],
+                       'outputs': [os.path.abspath(p) for p in outputs]}
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def output_key(self, path):
+        return self.output_keys.get(os.path.abspath(path)) if os.path.exists(path) else None
+
+    def stamp_outputs(self, paths, key):
+        if not paths:
+            return
+        self.add_manifest_entries({}, {os.path.abspath(path): key for path in paths})
+
+    def add_manifest_entries(self, hashes, output_keys):
+        self.hashes.update(hashes)
+        self.output_keys.update(output_keys)
+        if not self.write_manifests:
+            self.new_hashes.update(hashes)
+            self.new_output_keys.update(output_keys)
+            return
+        if hashes:
+            write_manifest(os.path.join(self.cache_dir, HASHES_NAME), self.hashes)
+        if output_keys:
+            write_manifest(os.path.join(self.cache_dir, OUTPUTS_NAME), self.output_keys)
+
+    def record(self, stage, action):
+        self.log.append((stage.session, stage.name, action))
+        print(f'{action:6} {stage.session} {stage.name}')
+
+    #tree cache is only opened (and rebuilt if the tree csv changed) when a match stage has to run
+    def tree_cache(self):
+        if self._tree_cache is None:
+            self._tree_cache = open_tree_cache(self.tree_data_path, self.config["tree_cache_path"])
+        return self._tree_cache
+
+    #database connection for the postgis matching backend (see db_matcher.py), opened when it is first needed
+    def connection(self):
+        if self._conn is None:
+            import db_matcher
+            self._conn = db_matcher.connect(self.config)
+        return self._conn
+
+    #stamp of sensor.trees for the postgis backend (see db_matcher.tree_table_stamp), read again after close()
+    def tree_table_stamp(self):
+        if self._tree_stamp is None:
+            import db_matcher
+            self._tree_stamp = db_matcher.tree_table_stamp(self.connection())
+        return self._tree_stamp
+
+    #stage graph of one session - returns the stages that write files (the targets of a run)
+    def session_stages(self, session, sensor_file, gpx_file):
+        config = self.config
+        output_stem = config["cache_path"] + os.path.basename(sensor_file)[:-4]
+        date = os.path.basename(sensor_file)[0:10]
+        chunk_lines = config.get("parse_chunk_lines", 100000)
+        output_format = config.get("output_format", "csv")
+
+        decode = Stage(self, session, 'decode',
+                       lambda: decode_file(sensor_file, output_stem, date, chunk_lines, output_format),
+                       files=[sensor_file],
+                       outputs=table_paths(output_stem + '_meteo.csv', output_format)
+                       + table_paths(output_stem + '_env.csv', output_format))
+
+        def run_align(decoded):
+            meteo_data_path, env_data_path = decoded
+            df_sens_comb = air_tree.read_sensor(env_data_path, meteo_data_path, self.tolerance)
+            df_gpx = air_tree.read_gpx(gpx_file, self.timezone, self.utc_offset)
+            instrument.count(rows=len(df_sens_comb), gpx_points=len(df_gpx))
+            return air_tree.align(df_sens_comb, df_gpx, self.tolerance)
+        align = Stage(self, session, 'align', run_align,
+                      params={'timezone': self.timezone, 'tolerance': self.tolerance, 'utc_offset': self.utc_offset},
+                      deps=[decode], files=[gpx_file])
+
+        interp_sensor_gpx_path = config["sens_gpx_path"] + session + '_interp_sensor_gpx.csv'
+
+        def run_interpolate(df_sens_gpx):
+            df_sens_gpx = air_tree.interpolate(df_sens_gpx, self.interp_limit)
+            instrument.count(rows=len(df_sens_gpx))
+            write_table(df_sens_gpx, interp_sensor_gpx_path, output_format) #creates csv including interpolated values
+            return df_sens_gpx
+        interpolate = Stage(self, session, 'interpolate', run_interpolate, params={'limit': self.interp_limit},
+                            deps=[align], outputs=table_paths(interp_sensor_gpx_path, output_format))
+
+        def run_match(df_sens_gpx):
+            df_sens_gpx = air_tree.located(df_sens_gpx)
+            if not len(df_sens_gpx):
+                raise ValueError('no air measurement has a gpx position (check the gpx file and --timezone)')
+            bbox = air_tree.sampling_area(df_sens_gpx)
+            df_trees = self.tree_cache().load_bbox(*bbox)
+            if self.backend == 'postgis':
+                import db_matcher
+                df_sens_gpx, pairs = db_matcher.match_trees_postgis(self.connection(), df_sens_gpx, df_trees,
+                                                                    max(self.radii), bbox)
+            else:
+                df_sens_gpx, pairs = air_tree.match_trees(df_sens_gpx, df_trees, max(self.radii))
+            instrument.count(rows=len(df_sens_gpx), trees=len(df_trees), pairs=len(pairs[0]))
+            return df_sens_gpx, df_trees, pairs
+        #matches of the postgis backend also depend on the trees in the database
+        match_params = {'max_radius': max(self.radii), 'backend': self.backend}
+        if self.backend == 'postgis':
+            match_params['trees'] = self.tree_table_stamp()
+        match = Stage(self, session, 'match', run_match, params=match_params,
+                      deps=[interpolate], files=[self.tree_data_path])
+
+        exports = []
+        for d in self.radii:
+            air_tree_output = config["air_tree_path"] + session + f'_{d}m_air_tree_matched.csv'
+            sens_gpx_tree_output = config["sens_gpx_tree_path"] + session + f'_{d}m_all_air_tree_data.csv'
+
+            def run_export(matched, d=d, air_tree_output=air_tree_output, sens_gpx_tree_output=sens_gpx_tree_output):
+                df_sens_gpx, df_trees, pairs = matched
+                df_air_tree, sens_gpx_tree = air_tree.air_tree_products(df_sens_gpx, df_trees, pairs, d)
+                instrument.count(rows=len(sens_gpx_tree), matches=len(df_air_tree))
+                return (write_table(df_air_tree, air_tree_output, output_format)
+                        + write_table(sens_gpx_tree, sens_gpx_tree_output, output_format))
+            exports.append(Stage(self, f'{session} {d}m', 'export', run_export, params={'radius': d},
+                                 deps=[match], outputs=table_paths(air_tree_output, output_format)
+                                 + table_paths(sens_gpx_tree_output, output_format)))
+        return [decode, interpolate] + exports
+
+    #runs (or loads from the cache) everything needed for the outputs of one session - returns its result for the
+    #report (see print_report)
+    def run_session(self, session, sensor_file, gpx_file):
+        start = time.perf_counter()
+        logged = len(self.log)
+        error = None
+        try:
+            for target in self.session_stages(session, sensor_file, gpx_file):
+                target.value()
+        except Exception as e:
+            print(f'Error in pipeline ---> {e} {session}')
+            error = f'{type(e).__name__}: {e}'
+        actions = [entry[2] for entry in self.log[logged:]]
+        return {'session': session, 'error': error, 'seconds': time.perf_counter() - start,
+                'run': actions.count('run'), 'cached': actions.count('cached')}
+
+    def close(self):
+        self._tree_stamp = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    #runs the sessions {prefix: (sensor, gpx)} in this process, or in 'workers' processes - returns the failed ones
+    def run(self, sessions, workers=1):
+        if workers > 1 and len(sessions) > 1:
+            results = self._run_workers(sessions, workers)
+        else:
+            results = [self.run_session(session, *files) for session, files in sorted(sessions.items())]
+            self.close()
+        print_report(results)
+        return [r['session'] for r in results if r['error']]
+
+    def _run_workers(self, sessions, workers):
+        #the tree cache is (re)built and the input files are hashed once here, before the workers start
+        self.tree_cache()
+        self.file_hash(self.tree_data_path)
+        results = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=_start_worker, initargs=(self.worker_args,)) as pool:
+            futures = {pool.submit(_run_worker_session, session, *files): session
+                       for session, files in sorted(sessions.items())}
+            for future in as_completed(futures):
+                try:
+                    result, hashes, output_keys = future.result()
+                except Exception as e:
+                    result = {'session': futures[future], 'error': f'{type(e).__name__}: {e}', 'seconds': 0,
+                              'run': 0, 'cached': 0}
+                    hashes, output_keys = {}, {}
+                self.add_manifest_entries(hashes, output_keys)
+                results.append(result)
+        return sorted(results, key=lambda r: r['session'])
+
+
+#pipeline of a worker process, kept for all sessions the worker runs
+_worker = None
+
+
+def _start_worker(args):
+    global _worker
+    _worker = Pipeline(*args)
+    _worker.write_manifests = False
+
+
+def _run_worker_session(session, sensor_file, gpx_file):
+    result = _worker.run_session(session, sensor_file, gpx_file)
+    _worker.close()
+    hashes, output_keys = _worker.new_hashes, _worker.new_output_keys
+    _worker.new_hashes, _worker.new_output_keys = {}, {}
+    return result, hashes, output_keys
+
+
+#one line per session (time, stages run / loaded from the cache, error) and the totals
+def print_report(results):
+    for r in results:
+        status = 'FAILED' if r['error'] else 'ok'
+        print(f'{status:6} {r["session"]}  {r["seconds"]:7.1f}s  {r["run"]} run, {r["cached"]} cached'
+              + (f'  {r["error"]}' if r['error'] else ''))
+    failed = sum(1 for r in results if r['error'])
+    ran = sum(r['run'] for r in results)
+    cached = sum(r['cached'] for r in results)
+    print(f'{len(results) - failed} sessions done ({ran} stages run, {cached} cached), {failed} failed')
+
+
+#pairs sensor logs (.txt) and gpx tracks (.gpx) by their 'YYYY-MM-DD_LL' prefix - {prefix: (sensor, gpx)}
+def pair_files(sensor_files, gpx_files, patterns=()):
+    sensor_files = {os.path.basename(p)[:13]: p for p in sorted(sensor_files)}
+    gpx_files = {os.path.basename(p)[:13]: p for p in sorted(gpx_files)}
+    sessions = {}
+    for session, sensor_file in sensor_files.items():
+        if patterns and not any(fnmatch.fnmatch(session, p) for p in patterns):
+            continue
+        if session not in gpx_files:
+            print(f'skip {session} (no gpx file)')
+            continue
+        sessions[session] = (sensor_file, gpx_files[session])
+    return sessions
+
+
+#sessions of the sensor logs in data_path and gpx tracks in gpx_path (or both in 'directory')
+def find_sessions(import_config, patterns=(), directory=None):
+    sensor_path = os.path.join(directory, '') if directory else import_config["data_path"]
+    gpx_path = os.path.join(directory, '') if directory else import_config["gpx_path"]
+    return pair_files(glob.glob(sensor_path + '*.txt'), glob.glob(gpx_path + '*.gpx'), patterns)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Run decode -> align -> interpolate -> match -> export for '
+                                                 'sessions, only recomputing stages whose inputs changed.')
+    parser.add_argument('sessions', nargs='*', help="session prefixes or glob patterns, e.g. 2024-05-27_LL '2024-06-*' "
+                                                    '(default: all sessions with a sensor log and a gpx file)')
+    parser.add_argument('--radii', type=float, nargs='+', default=[5, 10, 15, 20, 50], help='radii (m) to match trees within')
+    parser.add_argument('--interp-limit', type=int, default=10, help='max number of values interpolated between gpx points')
+    parser.add_argument('--timezone', default='Europe/London', help='timezone of the sensor clock - gpx times (UTC) are '
+                                                                    "converted with the offset of each point's date")
+    parser.add_argument('--tolerance', type=float, default=0, help='max age (s) of the meteo/gpx values joined to an air '
+                                                                   'measurement (default 0: same time only)')
+    parser.add_argument('--utc-offset', type=float, help='fixed hours added to gpx times instead of --timezone')
+    parser.add_argument('--backend', choices=['python', 'postgis'], default='python',
+                        help='tree matching in python (default) or in the database (see db_matcher.py)')
+    parser.add_argument('--trees', help="tree database csv (default: 'tree_data_path' in import.config.json)")
+    parser.add_argument('--dir', help='directory with the sensor logs and gpx tracks (default: data_path and gpx_path '
+                                      'in import.config.json)')
+    parser.add_argument('--pair', nargs=2, action='append', metavar=('SENSOR_LOG', 'GPX_FILE'),
+                        help='sensor log and gpx track of a session (can be repeated) instead of searching for them')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes sessions are shared out to')
+    parser.add_argument('--metrics', help='append the time, peak memory and rows of every stage run to this file '
+                                          '(JSON lines, see instrument.py)')
+    args = parser.parse_args(argv[1:])
+    if args.metrics:
+        instrument.enable(args.metrics)
+
+    #must specify data path in import.config.json
+    with open("import.config.json", "r") as jsonfile:
+        import_config = json.load(jsonfile)
+
+    tree_data_path = args.trees or import_config.get("tree_data_path")
+    if not tree_data_path:
+        parser.error("specify the tree database csv with --trees or 'tree_data_path' in import.config.json")
+    #whole numbers are kept as int so output file names match sens.tree.comb.py (e.g. '_5m_')
+    radii = [int(d) if float(d).is_integer() else d for d in args.radii]
+    utc_offset = args.utc_offset
+    if utc_offset is not None and float(utc_offset).is_integer():
+        utc_offset = int(utc_offset)
+    tolerance = int(args.tolerance) if float(args.tolerance).is_integer() else args.tolerance
+
+    pipeline = Pipeline(import_config, tree_data_path, radii, args.interp_limit, args.timezone, tolerance, utc_offset,
+                        args.backend)
+    if args.pair:
+        sessions = pair_files([sensor for sensor, _ in args.pair], [gpx for _, gpx in args.pair], args.sessions)
+    else:
+        sessions = find_sessions(import_config, args.sessions, args.dir)
+    failed = pipeline.run(sessions, args.workers)
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main(argv)
@@ -0,0 +1,189 @@
+#Tree / no-tree segments of the sessions in the database and the closest (previous, next) no-tree segment of every
+#tree segment - the aggregate table used by 'Data analysis/t-test_tree_no_tree.R'. Measurements of the view
+#sensor.dist_[d] are prepared as in the R scripts (temperature2 interpolated, pm outliers removed, tree names
+#standardised as in process_data.R), split into segments of consecutive rows near / not near a tree and averaged
+#per segment (and tree name) for all pollutants at once. The result is stored in sensor.tree_segments, one row per
+#session, tree segment, tree name and pollutant.
+
+#Segments don't continue across sessions. area 'street' leaves out the measurements in parks (in_park, see
+#sensor.green_spaces) before segments are built (as the street analysis), 'all' keeps them.
+
+#usage: python segments.py --radius 10 [15 ...] [--area street|all]
+
+import io
+import json
+import time
+import argparse
+from sys import argv
+import numpy as np
+import pandas as pd
+from alignment import interpolate_inside
+from db_matcher import connect
+
+POLLUTANTS = ['pm_1', 'pm_25', 'pm_4', 'pm_10', 'temperature2']
+
+#measurements with any pm value above this are left out (process_data.R)
+MAX_PM = 75
+#tree diameters above this (cm) are not used for the average dbh of a segment
+MAX_DBH = 75
+
+#tree names (lower case) grouped in the analysis, as standardise_tree_name in process_data.R
+ANALYSIS_TREE_NAMES = {
+    'fraxinus excelsior': 'ash',
+    'common ash': 'ash',
+    'maples': 'maple',
+    'evergreen oak': 'oak',
+    'acorn': 'oak',
+    'tree of heaven': 'tree-of-heaven',
+    'june berry': 'juneberry',
+    'shadbush': 'juneberry',
+    'tilia sp.': 'lime',
+    'deal': 'scots pine',
+    'large-leaved lime': 'lime',
+    'birch sp.': 'birch',
+    'oak sp.': 'oak',
+    'hybrid cockspurthorn': 'cockspurthorn',
+    'tulip-tree': 'tulip tree',
+    'wild cherry': 'bird cherry',
+    'red horse-chestnut': 'horse-chestnut',
+}
+
+ROWS_SQL = ('select session, location, pm_1, pm_25, pm_4, pm_10, temperature2, tree_name, '
+            'diameter_at_breast_height_cm from sensor.dist_{d} {where} order by session, time, id, objectid')
+
+SEGMENT_COLUMNS = ['dist', 'area', 'session', 'location', 'segment_id', 'tree_name', 'pollutant', 'n_rows',
+                   'avg_dbh_tree', 'avg_tree', 'prev_segment_id', 'avg_prev_no_tree', 'next_segment_id',
+                   'avg_next_no_tree']
+
+
+#rows of sensor.dist_[d] (one per measurement and tree within d) ordered by session and time
+def read_rows(conn, d, area='street'):
+    where = 'where not in_park' if area == 'street' else ''
+    text = io.StringIO()
+    with conn.cursor() as cur:
+        cur.copy_expert(f'copy ({ROWS_SQL.format(d=int(d), where=where)}) to stdout with (format csv, header true)',
+                        text)
+    conn.rollback()
+    text.seek(0)
+    return pd.read_csv(text, dtype={'session': str, 'location': str, 'tree_name': str})
+
+
+def analysis_tree_name(name):
+    if not isinstance(name, str):
+        return None
+    name = name.lower().strip()
+    return ANALYSIS_TREE_NAMES.get(name, name)
+
+
+#rows as used in the R analysis: temperature2 interpolated within each session, measurements with pm outliers
+#(or without pm values) left out and tree names standardised (empty for rows without a tree)
+def prepare_rows(df):
+    df = df.reset_index(drop=True)
+    temperature2 = df['temperature2'].to_numpy(dtype=float, copy=True)
+    session = df['session'].to_numpy()
+    starts = np.flatnonzero(np.r_[True, session[1:] != session[:-1]])
+    for start, end in zip(starts, np.r_[starts[1:], len(df)]):
+        temperature2[start:end] = interpolate_inside(temperature2[start:end, None], end - start)[:, 0]
+    df['temperature2'] = temperature2
+
+    pm = df[['pm_1', 'pm_25', 'pm_4', 'pm_10']].to_numpy(dtype=float)
+    df = df[(pm <= MAX_PM).all(axis=1)].reset_index(drop=True)
+    names = pd.Categorical(df['tree_name'])
+    mapped = np.array([analysis_tree_name(c) for c in names.categories] + [None], dtype=object)
+    df['tree_name'] = mapped[names.codes]
+    return df
+
+
+#Segments of consecutive rows near a tree (tree_name set) or not near a tree in each session, numbered from 1.
+#Returns one row per tree segment, tree name and pollutant with the averages of the segment and of the closest
+#previous and next no-tree segments of the same session (empty if there is none).
+def tree_segments(df, pollutants=POLLUTANTS):
+    session = df['session'].to_numpy()
+    is_tree = df['tree_name'].notna().to_numpy()
+    new_session = np.r_[True, session[1:] != session[:-1]]
+    #segment number over all sessions (seg) - first row, session, location and number within the session of each
+    seg = np.cumsum(new_session | np.r_[True, is_tree[1:] != is_tree[:-1]]) - 1
+    first = np.flatnonzero(np.r_[True, seg[1:] != seg[:-1]])
+    seg_session = session[first]
+    seg_location = df['location'].to_numpy()[first]
+    seg_number = seg[first] - seg[new_session][np.cumsum(new_session)[first] - 1] + 1
+
+    values = pd.DataFrame(df[pollutants].to_numpy(dtype=float), columns=pollutants)
+    dbh = df['diameter_at_breast_height_cm'].astype(float)
+    values['dbh'] = dbh.where(dbh <= MAX_DBH).to_numpy()
+    values['seg'] = seg
+
+    #averages of all pollutants in one pass: tree segments by tree name, no-tree segments
+    trees = values[is_tree].assign(tree_name=df['tree_name'].to_numpy()[is_tree])
+    grouped = trees.groupby(['seg', 'tree_name'], sort=True)
+    tree_avg = grouped[pollutants + ['dbh']].mean()
+    n_rows = grouped.size().to_numpy()
+    no_tree_avg = values[~is_tree].groupby('seg', sort=True)[pollutants].mean()
+
+    #closest no-tree segments before and after each tree segment (sorted segment numbers), within the session -
+    #position -1 is an empty row for tree segments without one
+    group_seg = tree_avg.index.get_level_values('seg').to_numpy()
+    no_tree_seg = no_tree_avg.index.to_numpy()
+    prev_pos = np.searchsorted(no_tree_seg, group_seg) - 1
+    next_pos = np.searchsorted(no_tree_seg, group_seg, side='right')
+    next_pos[next_pos == len(no_tree_seg)] = -1
+    no_tree_session = np.append(seg_session[no_tree_seg], None)
+    prev_pos[no_tree_session[prev_pos] != seg_session[group_seg]] = -1
+    next_pos[no_tree_session[next_pos] != seg_session[group_seg]] = -1
+    no_tree_number = np.r_[seg_number[no_tree_seg], 0]
+    no_tree_values = np.vstack([no_tree_avg.to_numpy(), np.full(len(pollutants), np.nan)])
+
+    segments = pd.DataFrame({
+        'session': seg_session[group_seg],
+        'location': seg_location[group_seg],
+        'segment_id': seg_number[group_seg],
+        'tree_name': tree_avg.index.get_level_values('tree_name').to_numpy(),
+        'n_rows': n_rows,
+        'avg_dbh_tree': tree_avg['dbh'].to_numpy(),
+        'prev_segment_id': pd.Series(no_tree_number[prev_pos], dtype='Int64').where(prev_pos >= 0),
+        'next_segment_id': pd.Series(no_tree_number[next_pos], dtype='Int64').where(next_pos >= 0),
+    })
+    frames = [segments.assign(pollutant=pollutant, avg_tree=tree_avg[pollutant].to_numpy(),
+                              avg_prev_no_tree=no_tree_values[prev_pos, i],
+                              avg_next_no_tree=no_tree_values[next_pos, i])
+              for i, pollutant in enumerate(pollutants)]
+    return pd.concat(frames, ignore_index=True)
+
+
+#replaces the segments of radius d and area in sensor.tree_segments
+def write_segments(conn, segments, d, area):
+    text = io.StringIO()
+    segments.assign(dist=int(d), area=area)[SEGMENT_COLUMNS].to_csv(text, index=False, header=False)
+    text.seek(0)
+    with conn.cursor() as cur:
+        cur.execute('delete from sensor.tree_segments where dist = %s and area = %s', (int(d), area))
+        cur.copy_expert(f'copy sensor.tree_segments ({", ".join(SEGMENT_COLUMNS)}) from stdin with (format csv)', text)
+    conn.commit()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Build tree / no-tree segments of the sessions in the database '
+                                                 '(sensor.tree_segments).')
+    parser.add_argument('--radius', type=int, nargs='+', required=True, help='radii (m) of the sensor.dist_[d] views')
+    parser.add_argument('--area', choices=['street', 'all'], default='street',
+                        help="'street' leaves out measurements in the parks (default), 'all' keeps them")
+    args = parser.parse_args(argv[1:])
+
+    with open("import.config.json", "r") as jsonfile:
+        import_config = json.load(jsonfile)
+
+    conn = connect(import_config)
+    try:
+        for d in args.radius:
+            start = time.perf_counter()
+            df = prepare_rows(read_rows(conn, d, args.area))
+            segments = tree_segments(df)
+            write_segments(conn, segments, d, args.area)
+            print(f'dist_{d} ({args.area}): {len(df)} rows, {len(segments) // len(POLLUTANTS)} tree segments '
+                  f'in {time.perf_counter() - start:.2f}s')
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main(argv)
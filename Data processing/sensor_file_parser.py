@@ -2,9 +2,41 @@
 #Data format is provided by Atmotube here: https://atmotube.com/atmotube-support/bluetooth-api
 
 import binascii
+from itertools import islice
 from datetime import datetime
+import numpy as np
 import pandas as pd
 
+#characters removed by str.strip() (ascii only - lines with other characters are decoded line by line)
+_WHITESPACE = np.zeros(256, dtype=bool)
+_WHITESPACE[list(b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f')] = True
+
+#value of each ascii character as hex digit (255 if it is not a hex digit)
+_HEX_VALUES = np.full(256, 255, dtype=np.int64)
+_HEX_VALUES[list(b'0123456789')] = np.arange(10)
+_HEX_VALUES[list(b'abcdef')] = np.arange(10, 16)
+_HEX_VALUES[list(b'ABCDEF')] = np.arange(10, 16)
+
+_CHARACTERISTIC = np.frombuffer(b'Updated Value of Characteristic', dtype=np.uint8)
+
+#hex values decoded from each line type: column -> ((word, start, stop) slices of the words that are joined together,
+#divisor or None for integer columns) - same slices as in decode_line
+_METEO_FIELDS = {
+    'temperature': ([(6, 2, 4)], None),
+    'humidity': ([(6, 0, 2)], None),
+    'pressure': ([(7, 0, None), (8, 0, None)], 100),
+    'temperature2': ([(9, 0, 4)], 100),
+}
+_ENV_FIELDS = {
+    'pm_1': ([(6, 0, None), (7, 0, 2)], 100),
+    'pm_25': ([(7, 2, 4), (8, 0, None)], 100),
+    'pm_10': ([(9, 0, None), (10, 0, 2)], 100),
+    'pm_4': ([(10, 2, 4), (11, 0, 4)], 100),
+}
+
+#resolution pandas uses for columns built from datetime objects (as the line by line decoder does)
+_TIME_DTYPE = pd.Series([datetime(2000, 1, 1)]).dtype
+
 #Creates columns for meteorological and environmental (pollution) dataframes. Specify date-time format to be read.
 class SensorFileParser:
     def __init__(self):
@@ -14,58 +46,233 @@ class SensorFileParser:
         #self.cols_voc = ['time', 'voc'] #edit
 
     def parse_file(self, filepath, date) -> (pd.DataFrame, pd.DataFrame, pd.DataFrame):
-        f = open(filepath)
-        lines = f.readlines()
+        with open(filepath) as f:
+            lines = f.readlines()
         if not lines:
             return
+        return self.decode_lines(lines, date)
+
+    #Streaming version of parse_file: reads and decodes the file chunk_size lines at a time and yields a
+    #(meteo, env) pair of dataframes per chunk, so memory stays the same however long the log is.
+    def iter_chunks(self, filepath, date, chunk_size=100000):
+        with open(filepath) as f:
+            while True:
+                lines = list(islice(f, chunk_size))
+                if not lines:
+                    return
+                yield self.decode_lines(lines, date)
+
+    #Decodes a single line. Returns ('meteo', row), ('env', row) or None if the line holds no data.
+    def decode_line(self, ln, date):
+        ln = ln.strip()
+        line_data = ln.split(",")
+        #must use a try/exception because sometimes there is other data in the text file.
+        #If the first entry is not a timestamp- the line is not read
+        try:
+            timestamp = datetime.strptime(date + line_data[0], self.date_format)
+        except:
+            return None
+
+        if len(line_data) == 4 and line_data[3].startswith("Updated Value of Characteristic"):
+            char_line = line_data[3].split(" ")
+            if len(char_line) > 6:
+              #  if len(char_line) == 8: #voc values edit
+               #     voc = self.byteInt1(char_line[6][0:4])/1000 #edit
+                #    list_voc.append([voc]) #edit
+    #Decode byte strings
+                if len(char_line) == 10:  #short data line (humidity,temp,pressure,temp precision)
+                    temp = self.byteInt1(char_line[6][0:2])
+                    hum = self.byteInt1(char_line[6][2:4])
+                    pressure = self.byteInt1(char_line[7] + char_line[8])/100
+                    temp_prec = self.byteInt1(char_line[9][0:4])/100
+                    return 'meteo', [timestamp, hum, temp, pressure, temp_prec]
+                if len(char_line) == 12: #long data line (pm values)
+                    pm1 = self.byteInt1(char_line[6] + char_line[7][0:2])/100
+                    pm25 = self.byteInt1(char_line[7][2:4] + char_line[8])/100
+                    pm10 = self.byteInt1(char_line[9] + char_line[10][0:2])/100
+                    pm4 = self.byteInt1(char_line[10][2:4] + char_line[11][0:4])/100
+                    return 'env', [timestamp, pm1, pm25, pm10, pm4]
+        return None
+
+    #Line by line decoder
+    def decode_lines_loop(self, lines, date) -> (pd.DataFrame, pd.DataFrame):
 #lists to be filled by decoded data before being joined in dataframe
-        line_iter = iter(lines)  # here
         list_meteo = []
         list_env = []
        # list_voc = [] #edit
-        for ln in line_iter:
-            ln = ln.strip()
-            line_data = ln.split(",")
-            #must use a try/exception because sometimes there is other data in the text file.
-            #If the first entry is not a timestamp- the line is not read
-            try:
-                timestamp = datetime.strptime(date + line_data[0], self.date_format)
-            except:
+        for ln in lines:
+            decoded = self.decode_line(ln, date)
+            if decoded is None:
                 continue
-
-            if len(line_data) == 4 and line_data[3].startswith("Updated Value of Characteristic"):
-                char_line = line_data[3].split(" ")
-                if len(char_line) > 6:
-                  #  if len(char_line) == 8: #voc values edit
-                   #     voc = self.byteInt1(char_line[6][0:4])/1000 #edit
-                    #    list_voc.append([voc]) #edit
-        #Decode byte strings and append to lists
-                    if len(char_line) == 10:  #short data line (humidity,temp,pressure,temp precision)
-                        temp = self.byteInt1(char_line[6][0:2])
-                        hum = self.byteInt1(char_line[6][2:4])
-                        pressure = self.byteInt1(char_line[7] + char_line[8])/100
-                        temp_prec = self.byteInt1(char_line[9][0:4])/100
-                        list_meteo.append([timestamp, hum, temp, pressure, temp_prec])
-                    if len(char_line) == 12: #long data line (pm values)
-                        pm1 = self.byteInt1(char_line[6] + char_line[7][0:2])/100
-                        pm25 = self.byteInt1(char_line[7][2:4] + char_line[8])/100
-                        pm10 = self.byteInt1(char_line[9] + char_line[10][0:2])/100
-                        pm4 = self.byteInt1(char_line[10][2:4] + char_line[11][0:4])/100
-                        list_env.append([timestamp, pm1, pm25, pm10, pm4])
+            if decoded[0] == 'meteo':
+                list_meteo.append(decoded[1])
+            else:
+                list_env.append(decoded[1])
 #connect lists into dataframes
         df_meteo = pd.DataFrame(list_meteo, columns=self.cols_meteo)
         df_env = pd.DataFrame(list_env, columns=self.cols_env)
       #  df_voc = pd.DataFrame(list_voc, columns=self.cols_voc) #edit
-        
 
         return df_meteo, df_env#, df_voc #edit
 
-    
+    #Bulk decoder - gives the same dataframes as decode_lines_loop, but works on the whole block of lines at once.
+    #Line boundaries, commas and spaces are located with numpy, lines are classified by their number of fields and
+    #words, timestamps are converted with integer arithmetic and hex payloads are turned into little-endian integer
+    #columns. Lines that don't have the plain layout (non-ascii characters, unusual timestamps, payloads that are not
+    #clean hex) are passed to decode_line, so odd lines are handled (or raise) exactly like before.
+    def decode_lines(self, lines, date) -> (pd.DataFrame, pd.DataFrame):
+        text = ''.join(lines)
+        if text.count('\n') + (not text.endswith('\n')) != len(lines):
+            text = ''.join(ln.rstrip('\n') + '\n' for ln in lines)
+        buf = np.frombuffer(text.encode('utf-8', 'surrogateescape'), dtype=np.uint8)
+
+        #line boundaries (end excludes the newline)
+        newlines = np.flatnonzero(buf == ord('\n'))
+        starts = np.concatenate(([0], newlines + 1))[:len(lines)]
+        ends = np.concatenate((newlines, [len(buf)]))[:len(lines)]
+
+        #lines with characters outside ascii can't be handled byte-wise
+        odd = np.zeros(len(lines), dtype=bool)
+        odd[np.searchsorted(newlines, np.flatnonzero(buf >= 128))] = True
+
+        #strip(): first and last character that is not whitespace
+        text_pos = np.flatnonzero(~_WHITESPACE[buf])
+        first = np.searchsorted(text_pos, starts)
+        last = np.searchsorted(text_pos, ends) - 1
+        has_text = (first < len(text_pos)) & (first <= last)
+        first_safe = np.minimum(first, max(len(text_pos) - 1, 0))
+        s_start = np.where(has_text, text_pos[first_safe] if len(text_pos) else 0, starts)
+        s_end = np.where(has_text, text_pos[np.maximum(last, 0)] + 1 if len(text_pos) else 0, starts)
+
+        #exactly 4 comma separated fields
+        commas = np.flatnonzero(buf == ord(','))
+        comma_first = np.searchsorted(commas, s_start)
+        n_commas = np.searchsorted(commas, s_end) - comma_first
+        candidate = np.flatnonzero((n_commas == 3) & ~odd)
+        comma_first = comma_first[candidate]
+        time_start, time_end = s_start[candidate], commas[comma_first]
+        field_start, field_end = commas[comma_first + 2] + 1, s_end[candidate]
+
+        #4th field has to start with 'Updated Value of Characteristic'
+        long_enough = field_end - field_start >= len(_CHARACTERISTIC)
+        keep = np.flatnonzero(long_enough)
+        head = buf[field_start[keep, None] + np.arange(len(_CHARACTERISTIC))]
+        keep = keep[(head == _CHARACTERISTIC).all(axis=1)]
+        candidate, time_start, time_end = candidate[keep], time_start[keep], time_end[keep]
+        field_start, field_end = field_start[keep], field_end[keep]
+
+        #words of the 4th field: word k starts after the k-th space
+        spaces = np.flatnonzero(buf == ord(' '))
+        space_first = np.searchsorted(spaces, field_start)
+        n_words = np.searchsorted(spaces, field_end) - space_first + 1
+
+        #timestamps - 'HH:MM:SS' is converted directly, other formats are left to decode_line
+        times, time_ok = self._bulkTimes(buf, time_start, time_end, date)
+
+        columns = {}
+        decoded_rows = []
+        for kind, n, fields in (('meteo', 10, _METEO_FIELDS), ('env', 12, _ENV_FIELDS)):
+            rows = np.flatnonzero(n_words == n)
+            #word boundaries for every line of this kind
+            word_start = np.concatenate((field_start[rows, None], spaces[space_first[rows, None] + np.arange(n - 1)] + 1), axis=1)
+            word_end = np.concatenate((spaces[space_first[rows, None] + np.arange(n - 1)], field_end[rows, None]), axis=1)
+            values = {}
+            hex_ok = np.ones(len(rows), dtype=bool)
+            for name, (parts, divisor) in fields.items():
+                values[name], ok = self._bulkHex(buf, word_start, word_end, parts)
+                if divisor is not None:
+                    values[name] = values[name]/divisor
+                hex_ok &= ok
+            plain = time_ok[rows] & hex_ok
+            #invalid timestamps are skipped, so only lines with a plain layout and a valid time are kept here
+            valid = plain & ~np.isnat(times[rows])
+            columns[kind] = dict(line=candidate[rows[valid]], time=times[rows[valid]],
+                                 **{name: value[valid] for name, value in values.items()})
+            odd[candidate[rows[~plain]]] = True
+
+        #everything that couldn't be decoded in bulk goes through decode_line, in line order
+        for i in np.flatnonzero(odd):
+            decoded = self.decode_line(lines[i], date)
+            if decoded is not None:
+                decoded_rows.append((i,) + decoded)
+
+        return (self._bulkFrame(columns['meteo'], [r for r in decoded_rows if r[1] == 'meteo'], self.cols_meteo),
+                self._bulkFrame(columns['env'], [r for r in decoded_rows if r[1] == 'env'], self.cols_env))
+
+    #Timestamps (date + time field) for the bulk decoder. Returns the times and a mask of the fields that could be
+    #checked here - NaT with ok=True means the time is invalid and the line is skipped, like in decode_line.
+    def _bulkTimes(self, buf, start, end, date):
+        times = np.full(len(start), np.datetime64('NaT'), dtype=_TIME_DTYPE)
+        ok = np.zeros(len(start), dtype=bool)
+        try:
+            day = np.datetime64(datetime.strptime(date, '%Y-%m-%d').date())
+        except ValueError:
+            return times, ok
+        #'%Y-%m-%d%H:%M:%S' only splits unambiguously for a 10 character date
+        if len(date) != 10:
+            return times, ok
+        eight = np.flatnonzero(end - start == 8)
+        chars = buf[start[eight, None] + np.arange(8)].astype(np.int64)
+        digits = chars[:, [0, 1, 3, 4, 6, 7]] - ord('0')
+        plain = ((digits >= 0) & (digits <= 9)).all(axis=1) & (chars[:, 2] == ord(':')) & (chars[:, 5] == ord(':'))
+        eight, digits = eight[plain], digits[plain]
+        hour = digits[:, 0]*10 + digits[:, 1]
+        minute = digits[:, 2]*10 + digits[:, 3]
+        second = digits[:, 4]*10 + digits[:, 5]
+        valid = (hour < 24) & (minute < 60) & (second < 60)
+        seconds = hour*3600 + minute*60 + second
+        times[eight[valid]] = (day + seconds[valid].astype('timedelta64[s]')).astype(_TIME_DTYPE)
+        ok[eight] = True
+        return times, ok
+
+    #Little-endian integers of hex slices for the bulk decoder (see byteInt1). parts are (word, start, stop) slices
+    #that are joined together. Returns the values and a mask of the rows that are clean hex of up to 7 bytes.
+    @staticmethod
+    def _bulkHex(buf, word_start, word_end, parts):
+        value = np.zeros(len(word_start), dtype=np.int64)
+        ok = np.ones(len(word_start), dtype=bool)
+        shift = np.zeros(len(word_start), dtype=np.int64)
+        for word, a, b in parts:
+            length = word_end[:, word] - word_start[:, word]
+            lo = np.minimum(a, length)
+            hi = length if b is None else np.minimum(b, length)
+            n_chars = np.maximum(hi - lo, 0)
+            width = int(n_chars.max()) if len(n_chars) else 0
+            #only up to 14 hex characters (7 bytes) fit into int64. Words with an odd number of characters are not
+            #clean hex (decode_line decides about them) - the block is padded to full bytes so they can't break it
+            ok &= (n_chars % 2 == 0) & (shift + 4*n_chars <= 56)
+            width = min(width + width % 2, 14)
+            pos = word_start[:, word, None] + lo[:, None] + np.arange(width)
+            inside = np.arange(width) < n_chars[:, None]
+            nibbles = _HEX_VALUES[buf[np.where(inside, pos, 0)]]
+            nibbles[~inside] = 0
+            ok &= ~(nibbles > 15).any(axis=1)
+            nibbles = np.where(nibbles > 15, 0, nibbles)
+            byte_values = (nibbles[:, 0::2] << 4) | nibbles[:, 1::2]
+            #first byte is the least significant
+            part_value = (byte_values << (8 * np.arange(byte_values.shape[1], dtype=np.int64))).sum(axis=1)
+            value |= np.where(ok, part_value << np.minimum(shift, 56), 0)
+            shift += 4*n_chars
+        return value, ok
+
+    #Dataframe from bulk decoded columns plus rows decoded line by line, in line order
+    @staticmethod
+    def _bulkFrame(columns, decoded_rows, cols):
+        if not len(columns['line']) and not decoded_rows:
+            return pd.DataFrame([], columns=cols)
+        if not decoded_rows:
+            return pd.DataFrame({col: columns[col] for col in cols}, columns=cols)
+        rows = pd.DataFrame([row[2] for row in decoded_rows], columns=cols)
+        line = np.concatenate((columns['line'], [row[0] for row in decoded_rows]))
+        frame = pd.concat([pd.DataFrame({col: columns[col] for col in cols}, columns=cols), rows], ignore_index=True)
+        return frame.iloc[np.argsort(line, kind='stable')].reset_index(drop=True)
+
+
   #this is method used - considers little-endian encoding
     @staticmethod
     def byteInt1(x):
         return int.from_bytes(bytes.fromhex(x), byteorder="little")
-    
+
 #alternative methods below - tested but didn't seem to match
     @staticmethod
     def byteToInt(x: str) -> int:
@@ -0,0 +1,123 @@
+#Reading and writing of the tables produced by the processing scripts (decoded sensor data, sens+gpx and air-tree
+#outputs) as csv, parquet or both - set with 'output_format' in import.config.json (default: csv).
+#Parquet files have typed columns (times as timestamps), repeated text (tree names, boroughs, ...) is stored
+#dictionary encoded and the files are zstd compressed. They can be read in R with arrow::read_parquet (see
+#Data analysis/read_output.R). Writing parquet needs pyarrow.
+
+import os
+import pandas as pd
+from pandas.api.types import infer_dtype
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+OUTPUT_FORMATS = ('csv', 'parquet', 'both')
+PARQUET_COMPRESSION = 'zstd'
+#name of the pandas index column in parquet files (the unnamed first column of the csv files)
+INDEX_NAME = 'row'
+
+
+def _check_format(output_format):
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"output_format must be one of {', '.join(OUTPUT_FORMATS)}, not '{output_format}'")
+    if output_format != 'csv' and pa is None:
+        raise ImportError(f"pyarrow is needed for output_format '{output_format}'")
+
+
+def parquet_path(csv_path):
+    return os.path.splitext(csv_path)[0] + '.parquet'
+
+
+#all files written for csv_path (e.g. 'X_env.csv') in output_format
+def table_paths(csv_path, output_format='csv'):
+    return {'csv': [csv_path], 'parquet': [parquet_path(csv_path)],
+            'both': [csv_path, parquet_path(csv_path)]}[output_format]
+
+
+#the file that is read back - parquet if it is written
+def preferred_path(csv_path, output_format='csv'):
+    return table_paths(csv_path, output_format)[-1]
+
+
+#text columns with repeated values are converted to categoricals, which are written as dictionary columns
+def _dictionary_encode(df):
+    df = df.copy(deep=False)
+    for name in df.columns:
+        column = df[name]
+        if infer_dtype(column, skipna=True) == 'string' and column.nunique() <= len(column) // 2:
+            df[name] = column.astype('category')
+    return df
+
+
+def _write_parquet(df, path, index=True):
+    df = _dictionary_encode(df)
+    if index:
+        df = df.rename_axis(INDEX_NAME)
+    df.to_parquet(path, engine='pyarrow', compression=PARQUET_COMPRESSION, index=index)
+
+
+#write df to csv_path and/or the parquet file next to it - returns the paths written
+def write_table(df, csv_path, output_format='csv', index=True):
+    _check_format(output_format)
+    paths = table_paths(csv_path, output_format)
+    for path in paths:
+        if path.endswith('.parquet'):
+            _write_parquet(df, path, index)
+        else:
+            df.to_csv(path, index=index)
+    return paths
+
+
+#read a table written by write_table (csv or parquet, by extension)
+def read_table(path, **kwargs):
+    if str(path).endswith('.parquet'):
+        return pd.read_parquet(path, engine='pyarrow', **kwargs)
+    return pd.read_csv(path, **kwargs)
+
+
+#Writes a table chunk by chunk (decoded sensor data). Parquet chunks are added as row groups with the column types
+#of the first chunk with rows (integer columns of later chunks may contain missing values) - empty chunks have no
+#column types, so they are skipped, and a table without any rows is written from the first (empty) chunk on close.
+class TableWriter:
+    def __init__(self, csv_path, output_format='csv'):
+        _check_format(output_format)
+        self.paths = table_paths(csv_path, output_format)
+        self.csv_path = csv_path if output_format != 'parquet' else None
+        self.parquet_path = parquet_path(csv_path) if output_format != 'csv' else None
+        self._parquet = None
+        self._schema = None
+        self._empty = None
+        self._first = True
+
+    def write(self, df):
+        if self.csv_path:
+            df.to_csv(self.csv_path, index=False, mode='w' if self._first else 'a', header=self._first)
+        if self.parquet_path and not len(df):
+            if self._empty is None:
+                self._empty = df
+        elif self.parquet_path:
+            if self._parquet is None:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                self._schema = table.schema
+                self._parquet = pq.ParquetWriter(self.parquet_path, self._schema, compression=PARQUET_COMPRESSION)
+            else:
+                table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+            self._parquet.write_table(table)
+        self._first = False
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+            self._parquet = None
+        elif self.parquet_path and self._empty is not None:
+            self._empty.to_parquet(self.parquet_path, engine='pyarrow', compression=PARQUET_COMPRESSION, index=False)
+            self._empty = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
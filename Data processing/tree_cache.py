@@ -0,0 +1,158 @@
+#Builds and reads a compact on-disk cache of the tree database (GLA London tree inventory format).
+#The tree csv is parsed once; coordinates are stored as numpy arrays sorted by spatial tile and text columns
+#are stored as categorical codes. Tree names and the other categorical attributes are normalised while the cache is
+#built (see tree_species.py) and a species code table is written to species.csv. Sessions memory-map the cache and only read the tiles overlapping their
+#bounding box, instead of parsing the whole csv on every run.
+
+#The cache is rebuilt automatically when the size or modification time of the source csv changes.
+#To build it up front run: python tree_cache.py TREE_CSV [CACHE_DIR]
+
+import json
+import os
+from sys import argv
+import numpy as np
+import pandas as pd
+from tree_species import CATEGORICAL_COLUMNS, normalize_trees, species_table
+
+#tile size in degrees (about 1.1km north-south, 0.7km east-west in London)
+TILE_DEG = 0.01
+#number of tiles around the globe in east-west direction, used to build a single integer key per tile
+TILES_PER_ROW = int(round(360 / TILE_DEG))
+CACHE_VERSION = 2
+
+
+def _tile_rows(lat):
+    return np.floor((np.asarray(lat) + 90) / TILE_DEG).astype(np.int64)
+
+
+def _tile_cols(lon):
+    return np.floor((np.asarray(lon) + 180) / TILE_DEG).astype(np.int64)
+
+
+def _source_stamp(csv_path):
+    stat = os.stat(csv_path)
+    return {'source': os.path.abspath(csv_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _read_meta(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'meta.json'), 'r') as jsonfile:
+            return json.load(jsonfile)
+    except (OSError, ValueError):
+        return None
+
+
+#True if the cache in cache_dir was built from the current version of csv_path
+def cache_is_current(csv_path, cache_dir):
+    meta = _read_meta(cache_dir)
+    if meta is None or meta.get('version') != CACHE_VERSION:
+        return False
+    return all(meta.get(key) == value for key, value in _source_stamp(csv_path).items())
+
+
+def build_tree_cache(csv_path, cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    stamp = _source_stamp(csv_path)
+    df = normalize_trees(pd.read_csv(csv_path, low_memory=False))
+
+    #drop trees without coordinates - they can never be matched
+    df = df[df['lat'].notna() & df['lon'].notna()]
+    rows = df.index.to_numpy(dtype=np.int64)
+    lat = df['lat'].to_numpy(dtype=float)
+    lon = df['lon'].to_numpy(dtype=float)
+
+    #sort by tile so every tile is one contiguous block
+    keys = _tile_rows(lat) * TILES_PER_ROW + _tile_cols(lon)
+    order = np.lexsort((rows, keys))
+    np.save(os.path.join(cache_dir, 'tile_keys.npy'), keys[order])
+    np.save(os.path.join(cache_dir, 'rows.npy'), rows[order])
+
+    columns = []
+    for name in df.columns:
+        col = df[name]
+        file_name = 'col_%d.npy' % len(columns)
+        if pd.api.types.is_numeric_dtype(col) or pd.api.types.is_bool_dtype(col):
+            np.save(os.path.join(cache_dir, file_name), col.to_numpy()[order])
+            columns.append({'name': name, 'file': file_name, 'kind': 'numeric'})
+        else:
+            #text columns are stored as integer codes into a list of categories (-1 for missing)
+            values = col.where(col.isna(), col.astype(str))
+            cat = pd.Categorical(values)
+            codes = cat.codes.astype(np.int32) if len(cat.categories) > 32767 else cat.codes.astype(np.int16)
+            np.save(os.path.join(cache_dir, file_name), codes[order])
+            columns.append({'name': name, 'file': file_name, 'kind': 'category',
+                            'categories': [str(c) for c in cat.categories], 'categorical': name in CATEGORICAL_COLUMNS})
+            if name == 'tree_name':
+                species_table(cat, df['taxon_name'] if 'taxon_name' in df.columns else None).to_csv(
+                    os.path.join(cache_dir, 'species.csv'), index=False)
+
+    #meta.json is written last so an interrupted build is never seen as a valid cache
+    meta = dict(stamp, version=CACHE_VERSION, tile_deg=TILE_DEG, n_trees=int(len(rows)), columns=columns)
+    with open(os.path.join(cache_dir, 'meta.json'), 'w') as jsonfile:
+        json.dump(meta, jsonfile)
+    return meta
+
+
+class TreeCache:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.meta = _read_meta(cache_dir)
+        #arrays are memory-mapped, only the pages of the selected tiles are read from disk
+        self.tile_keys = np.load(os.path.join(cache_dir, 'tile_keys.npy'), mmap_mode='r')
+        self.rows = np.load(os.path.join(cache_dir, 'rows.npy'), mmap_mode='r')
+        self.columns = {c['name']: c for c in self.meta['columns']}
+
+    def _column(self, name):
+        return np.load(os.path.join(self.cache_dir, self.columns[name]['file']), mmap_mode='r')
+
+    #positions (in cache order) of all trees inside the bounding box, ordered as in the source csv
+    def bbox_positions(self, min_lat, max_lat, min_lon, max_lon):
+        col_min, col_max = _tile_cols(min_lon), _tile_cols(max_lon)
+        parts = []
+        for tile_row in range(_tile_rows(min_lat), _tile_rows(max_lat) + 1):
+            start = np.searchsorted(self.tile_keys, tile_row * TILES_PER_ROW + col_min, side='left')
+            stop = np.searchsorted(self.tile_keys, tile_row * TILES_PER_ROW + col_max, side='right')
+            parts.append(np.arange(start, stop))
+        pos = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+        lat = self._column('lat')[pos]
+        lon = self._column('lon')[pos]
+        pos = pos[(lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)]
+        return pos[np.argsort(self.rows[pos], kind='stable')]
+
+    #DataFrame of the trees inside the bounding box - same rows, order and index as filtering the csv directly
+    def load_bbox(self, min_lat, max_lat, min_lon, max_lon):
+        pos = self.bbox_positions(min_lat, max_lat, min_lon, max_lon)
+        data = {}
+        for name, col in self.columns.items():
+            values = self._column(name)[pos]
+            if col['kind'] == 'category':
+                #categorical attributes keep their codes (the same in every session), other text is returned as str
+                values = pd.Categorical.from_codes(values, categories=col['categories'])
+                if not col.get('categorical'):
+                    values = values.astype(object)
+            data[name] = values
+        return pd.DataFrame(data, index=pd.Index(np.asarray(self.rows[pos]), dtype=np.int64))
+
+
+#Open the cache for csv_path, (re)building it first if it is missing or out of date
+def open_tree_cache(csv_path, cache_dir):
+    if not cache_is_current(csv_path, cache_dir):
+        print(f'build tree cache {cache_dir} from {csv_path}')
+        build_tree_cache(csv_path, cache_dir)
+    return TreeCache(cache_dir)
+
+
+def main(argv):
+    csv_path = argv[1]
+    if len(argv) > 2:
+        cache_dir = argv[2]
+    else:
+        with open("import.config.json", "r") as jsonfile:
+            cache_dir = json.load(jsonfile)["tree_cache_path"]
+    meta = build_tree_cache(csv_path, cache_dir)
+    print(f'tree cache {cache_dir}: {meta["n_trees"]} trees')
+
+
+if __name__ == "__main__":
+    main(argv)
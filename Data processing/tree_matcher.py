@@ -0,0 +1,150 @@
+#Spatial index used to match air measurement points with trees from the tree database.
+#Trees are projected onto a local metric plane and bucketed into square grid cells. Only trees in the cells
+#around each air measurement are checked, so memory scales with the number of matches instead of
+#(number of air points x number of trees).
+
+#Distances are still calculated with the haversine formula used in sens.tree.comb.py, so the values for
+#'Distance_to_tree' and 'Dist_to_closest_tree' are the same as the full distance matrix.
+
+import numpy as np
+
+# Approximate radius of earth in km (same as sens.tree.comb.py)
+R = 6378.1
+
+
+#haversine distance in metres between points given in radians - arrays must have matching shapes
+def haversine(lat_air, lon_air, lat_trees, lon_trees):
+    dlat = lat_air - lat_trees
+    dlon = lon_air - lon_trees
+    a = np.sin(dlat / 2)**2 + np.cos(lat_trees) * np.cos(lat_air) * np.sin(dlon / 2)**2
+    c = 2 * np.arcsin(np.sqrt(a))
+    return (R * c) * 1000 #'*1000' converts distance from km to m
+
+
+#cell offsets (dx, dy) on the square ring at distance 'ring' from the centre cell
+def _ring_offsets(ring):
+    if ring == 0:
+        return [(0, 0)]
+    offsets = [(dx, dy) for dx in range(-ring, ring + 1) for dy in (-ring, ring)]
+    offsets += [(dx, dy) for dx in (-ring, ring) for dy in range(-ring + 1, ring)]
+    return offsets
+
+
+class TreeMatcher:
+    #tree_lat/tree_lon in degrees. cell_size (m) should be close to the search radius d.
+    def __init__(self, tree_lat, tree_lon, cell_size=20.0):
+        self.tree_lat = np.radians(np.asarray(tree_lat, dtype=float))
+        self.tree_lon = np.radians(np.asarray(tree_lon, dtype=float))
+        self.n_trees = len(self.tree_lat)
+        #cells are made slightly bigger than requested so the small error of the flat projection can never
+        #push a tree that is within d out of the neighbouring cells
+        self.cell_size = float(cell_size) * 1.01 + 0.5
+
+        #local equirectangular projection around the centre of the tree area
+        if self.n_trees:
+            self.lat0 = float(np.mean(self.tree_lat))
+            self.lon0 = float(np.mean(self.tree_lon))
+        else:
+            self.lat0 = self.lon0 = 0.0
+        self._cos_lat0 = np.cos(self.lat0)
+
+        cx, cy = self._cells(self.tree_lat, self.tree_lon)
+        self._cx_min = cx.min() if self.n_trees else 0
+        self._cy_min = cy.min() if self.n_trees else 0
+        self._nx = int(cx.max() - self._cx_min) + 1 if self.n_trees else 1
+        self._ny = int(cy.max() - self._cy_min) + 1 if self.n_trees else 1
+
+        #sort trees by cell key so every cell is one contiguous block of the sorted order
+        keys = self._key(cx, cy)
+        self._order = np.argsort(keys, kind='stable')
+        self._sorted_keys = keys[self._order]
+
+    def _cells(self, lat, lon):
+        x = (lon - self.lon0) * self._cos_lat0 * R * 1000
+        y = (lat - self.lat0) * R * 1000
+        return np.floor(x / self.cell_size).astype(np.int64), np.floor(y / self.cell_size).astype(np.int64)
+
+    def _key(self, cx, cy):
+        return (cy - self._cy_min) * self._nx + (cx - self._cx_min)
+
+    #(air index, tree index) candidate pairs for all trees in the cells at offset (dx, dy) from each air point
+    def _candidates(self, cx, cy, dx, dy):
+        ncx = cx + dx
+        ncy = cy + dy
+        inside = (ncx >= self._cx_min) & (ncx < self._cx_min + self._nx) & \
+                 (ncy >= self._cy_min) & (ncy < self._cy_min + self._ny)
+        air = np.flatnonzero(inside)
+        keys = self._key(ncx[air], ncy[air])
+        start = np.searchsorted(self._sorted_keys, keys, side='left')
+        stop = np.searchsorted(self._sorted_keys, keys, side='right')
+        counts = stop - start
+        has = counts > 0
+        air, start, counts = air[has], start[has], counts[has]
+        if not len(air):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        #expand each (start, count) run into the positions of the trees in that cell
+        total = counts.sum()
+        run_offsets = np.repeat(np.cumsum(counts) - counts, counts)
+        pos = np.repeat(start, counts) + (np.arange(total) - run_offsets)
+        return np.repeat(air, counts), self._order[pos]
+
+    #Find all trees within d (m) of each air point.
+    #Returns arrays (air index, tree index, distance) sorted by air index then tree index - the same order as
+    #np.where on the full distance matrix.
+    def query(self, air_lat, air_lon, d):
+        lat_air = np.radians(np.asarray(air_lat, dtype=float))
+        lon_air = np.radians(np.asarray(air_lon, dtype=float))
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=float))
+        if not self.n_trees or not len(lat_air):
+            return empty
+
+        cx, cy = self._cells(lat_air, lon_air)
+        reach = int(np.ceil(d * 1.01 / self.cell_size))
+        air_parts, tree_parts, dist_parts = [], [], []
+        for dy in range(-reach, reach + 1):
+            for dx in range(-reach, reach + 1):
+                air_idx, tree_idx = self._candidates(cx, cy, dx, dy)
+                if not len(air_idx):
+                    continue
+                dist = haversine(lat_air[air_idx], lon_air[air_idx], self.tree_lat[tree_idx], self.tree_lon[tree_idx])
+                keep = dist <= d
+                air_parts.append(air_idx[keep])
+                tree_parts.append(tree_idx[keep])
+                dist_parts.append(dist[keep])
+        if not air_parts:
+            return empty
+
+        air_idx = np.concatenate(air_parts)
+        tree_idx = np.concatenate(tree_parts)
+        dist = np.concatenate(dist_parts)
+        order = np.lexsort((tree_idx, air_idx))
+        return air_idx[order], tree_idx[order], dist[order]
+
+    #Distance (m) to the closest tree for each air point (NaN if there are no trees).
+    #Rings of cells are searched outwards until the closest tree found is nearer than anything in the next ring.
+    def nearest(self, air_lat, air_lon):
+        lat_air = np.radians(np.asarray(air_lat, dtype=float))
+        lon_air = np.radians(np.asarray(air_lon, dtype=float))
+        best = np.full(len(lat_air), np.inf)
+        if not self.n_trees or not len(lat_air):
+            return np.full(len(lat_air), np.nan)
+
+        cx, cy = self._cells(lat_air, lon_air)
+        #stop once every ring that could still contain a tree has been searched
+        max_ring = int(max(np.abs(cx - self._cx_min).max(), np.abs(cx - (self._cx_min + self._nx - 1)).max(),
+                           np.abs(cy - self._cy_min).max(), np.abs(cy - (self._cy_min + self._ny - 1)).max()))
+        todo = np.arange(len(lat_air))
+        ring = 0
+        while len(todo) and ring <= max_ring:
+            for dx, dy in _ring_offsets(ring):
+                air_idx, tree_idx = self._candidates(cx[todo], cy[todo], dx, dy)
+                if not len(air_idx):
+                    continue
+                air_idx = todo[air_idx]
+                dist = haversine(lat_air[air_idx], lon_air[air_idx], self.tree_lat[tree_idx], self.tree_lon[tree_idx])
+                np.minimum.at(best, air_idx, dist)
+            #everything within ring * cell_size (less a safety margin for the projection) has now been searched
+            done = best[todo] <= ring * self.cell_size / 1.01
+            todo = todo[~done]
+            ring += 1
+        return best
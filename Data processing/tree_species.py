@@ -0,0 +1,128 @@
+#Canonical tree names and categorical tree attributes. The tree database is normalised once when the tree cache is
+#built (see tree_cache.py): text is stripped, inner whitespace collapsed and typographic quotes replaced by plain
+#ones, then tree names are mapped to one canonical name per species. The categorical columns keep the same
+#categories (codes) in every session and output.
+
+import re
+import numpy as np
+import pandas as pd
+
+#tree attributes stored as categoricals (integer codes) through matching and export
+CATEGORICAL_COLUMNS = ['tree_name', 'taxon_name', 'borough', 'age_group', 'gla_tree_group']
+
+#tree names (after canonical_text) that are grouped under one species name
+TREE_NAME_MAPPING = {
+    'Common Whitebeam': 'Whitebeam',
+    'Swedish Whitebeam': 'Whitebeam',
+    'Common Hornbeam': 'Hornbeam',
+    'London Plane': 'Plane',
+    'False-acacia': 'False Acacia',
+    'Sycamore Maple': 'Sycamore',
+    'Snake-Bark Maple': 'Maple',
+    'Ashleaf Maple': 'Maple',
+    'Silver Maple': 'Maple',
+    'Variegated Norway Maple': 'Norway Maple',
+    'Purple Norway Maple': 'Norway Maple',
+    'Snowy Mespilus': 'Mespilus',
+    'Cardinal Royal Rowan': 'Rowan',
+    'Upright Rowan': 'Rowan',
+    'Chonosuki Crab': 'Crab Apple',
+    'Flowering Crab Apple Rudolph': 'Crab Apple',
+    'Mountain Ash': 'Ash',
+    'Raywood Ash': 'Ash',
+    'Common Ash': 'Ash',
+    'Manna Ash': 'Ash',
+    'Weeping Ash': 'Ash',
+    "Upright Sargent's Cherry": 'Cherry',
+    "Cherry 'Pandora'": 'Cherry',
+    'Hillieri Spire Cherry': 'Cherry',
+    "Rosebud Cherry 'Autumnalis'": 'Cherry',
+    'Sweet Cherry': 'Cherry',
+    'Tibetan Cherry': 'Cherry',
+    'Pink Flowering Cherry': 'Cherry',
+    'Japanese Cherry': 'Cherry',
+    "Cherry 'Kanzan'": 'Cherry',
+    'Flowering Cherry': 'Cherry',
+    'Spring Cherry': 'Cherry',
+    "Inermis' Black Locust": 'Black Locust',
+    'West Himalayan Birch': 'Birch',
+    'Moor Birch': 'Birch',
+    "Jacquemont's Birch": 'Birch',
+    'Silver Birch': 'Birch',
+    'Downy Birch': 'Birch',
+    'Paper Birch': 'Birch',
+    "'Edinburgh' Birch": 'Birch',
+    'Common Hawthorn': 'Hawthorn',
+    'Bastard Service Tree': 'Service Tree',
+    'Box Elder': 'Elder',
+    'Common Alder': 'Alder',
+    'Grey Alder': 'Alder',
+    'Red Alder': 'Alder',
+    'Common Lime': 'Lime',
+    'Lime Tree': 'Lime',
+    'Red Horse-Chestnut': 'Horse-Chestnut',
+    'Purple Leaved Plum': 'Plum',
+    'Portugal Laurel': 'Laurel',
+    'English Yew': 'Yew',
+    'Common Lilac': 'Lilac',
+    'Common Beech': 'Beech',
+    'Purple Beech': 'Beech',
+    'Variegated Holly': 'Holly',
+    'Common Holly': 'Holly',
+    'Turkey Oak': 'Oak',
+    'Holly Oak': 'Oak',
+    'English Oak': 'Oak',
+    'Black Walnut': 'Walnut',
+    'Hybrid Crack-willow': 'Willow',
+    'Giant Fir': 'Fir',
+    'Pyrus Species': 'Plum',
+    'Wild Plum': 'Plum',
+    'Cherry Plum': 'Plum',
+    'Linden': 'Lime',
+    'A Flowering Plant': 'Shadbush',
+}
+
+_QUOTES = str.maketrans({'‘': "'", '’': "'", '‛': "'", '′': "'", '`': "'",
+                         '“': '"', '”': '"', '‟': '"', '″': '"'})
+_WHITESPACE = re.compile(r'\s+')
+
+
+#text with plain quotes, single spaces and no leading/trailing whitespace (None for missing or empty values)
+def canonical_text(value):
+    if not isinstance(value, str):
+        return None
+    value = _WHITESPACE.sub(' ', value.translate(_QUOTES)).strip()
+    return value or None
+
+
+def canonical_tree_name(value):
+    value = canonical_text(value)
+    return TREE_NAME_MAPPING.get(value, value)
+
+
+#canonical values of a text column - every distinct value is only converted once
+def _canonical_column(col, func):
+    cat = pd.Categorical(col.where(col.isna(), col.astype(str)))
+    mapped = np.array([func(c) for c in cat.categories] + [None], dtype=object)
+    return pd.Series(mapped[cat.codes], index=col.index, dtype=object)
+
+
+#tree database with canonical text in the categorical columns and canonical tree names
+def normalize_trees(df):
+    df = df.copy()
+    for name in CATEGORICAL_COLUMNS:
+        if name in df.columns:
+            df[name] = _canonical_column(df[name], canonical_tree_name if name == 'tree_name' else canonical_text)
+    return df
+
+
+#species code table: code (category code of tree_name in the tree cache), tree name, most common taxon, number of trees
+def species_table(tree_names, taxon_names=None):
+    names = pd.Categorical(tree_names)
+    table = pd.DataFrame({'code': np.arange(len(names.categories)), 'tree_name': names.categories,
+                          'n_trees': np.bincount(names.codes[names.codes >= 0], minlength=len(names.categories))})
+    if taxon_names is not None:
+        pairs = pd.DataFrame({'tree_name': np.asarray(tree_names, dtype=object), 'taxon_name': taxon_names}).dropna()
+        taxon = pairs.groupby('tree_name')['taxon_name'].agg(lambda s: s.value_counts().index[0])
+        table.insert(2, 'taxon_name', table['tree_name'].map(taxon))
+    return table
@@ -29,233 +29,179 @@ echo "create tables for" "$POSTGRES_DB"
 psql --dbname="$POSTGRES_DB" <<-'EOSQL'
 create schema sensor;
 create schema import;
-create table sensor.dist_5
+
+-- all measurements are taken in London - dates in queries (e.g. time >= '2024-06-17') are London days
+do
+$$
+    begin
+        execute format('alter database %I set timezone to %L', current_database(), 'Europe/London');
+    end
+$$;
+set timezone to 'Europe/London';
+
+-- one row per session ('YYYY-MM-DD_LL'), max_radius is the largest radius (m) loaded for the session
+create table sensor.sessions
 (
-    id                           serial
+    session    text
         primary key,
-    time                         text,
-    location                     text,
-    pm_1                         double precision,
-    pm_25                        double precision,
-    pm_10                        double precision,
-    pm_4                         double precision,
-    temperature                  double precision,
-    humidity                     double precision,
-    pressure                     double precision,
-    temperature2                 double precision,
-    sensor_geom                  geometry(Point, 4326),
-    elevation                    double precision,
-    dist_to_closest_tree         double precision,
-    air_measurement              double precision,
-    tree_number_x                integer,
-    air_tree_id                  text,
-    distance_to_tree             double precision,
-    objectid                     integer,
-    tree_geom                    geometry(Point, 4326),
-    tree_within_d20              boolean,
-    borough                      text,
-    gla_tree_group               text,
-    tree_name                    text,
-    taxon_name                   text,
-    age                          text,
-    age_group                    text,
-    spread_m                     double precision,
-    height_m                     double precision,
-    diameter_at_breast_height_cm double precision,
-    gdb_geomattr_data            double precision,
-    load_date                    timestamp,
-    updated                      timestamp
+    location   text not null,
+    max_radius integer not null,
+    loaded_at  timestamp
 );
 
-alter table sensor.dist_5
+alter table sensor.sessions
     owner to postgres;
 
-create index sensor_loc5index
-    on sensor.dist_5 using gist (sensor_geom);
-
-create index tree_loc5_index
-    on sensor.dist_5 using gist (tree_geom);
+create index idx_sessions_location
+    on sensor.sessions (location);
 
-create index idx_loc5
-    on sensor.dist_5 (location);
-
-create table sensor.dist_15
+-- one row per located air measurement, partitioned by day (see sensor.add_measurement_partition)
+create table sensor.measurements
 (
-    id                           serial
-        primary key,
-    time                         text,
-    location                     text,
-    pm_1                         double precision,
-    pm_25                        double precision,
-    pm_10                        double precision,
-    pm_4                         double precision,
-    temperature                  double precision,
-    humidity                     double precision,
-    pressure                     double precision,
-    temperature2                 double precision,
-    sensor_geom                  geometry(Point, 4326),
-    elevation                    double precision,
-    dist_to_closest_tree         double precision,
-    air_measurement              double precision,
-    tree_number_x                integer,
-    air_tree_id                  text,
-    distance_to_tree             double precision,
-    objectid                     integer,
-    tree_geom                    geometry(Point, 4326),
-    tree_within_d20              boolean,
-    borough                      text,
-    gla_tree_group               text,
-    tree_name                    text,
-    taxon_name                   text,
-    age                          text,
-    age_group                    text,
-    spread_m                     double precision,
-    height_m                     double precision,
-    diameter_at_breast_height_cm double precision,
-    gdb_geomattr_data            double precision,
-    load_date                    timestamp,
-    updated                      timestamp
-);
-
-alter table sensor.dist_15
+    id                   bigserial,
+    session              text        not null
+        references sensor.sessions,
+    location             text        not null,
+    time                 timestamptz not null,
+    pm_1                 double precision,
+    pm_25                double precision,
+    pm_10                double precision,
+    pm_4                 double precision,
+    temperature          double precision,
+    humidity             double precision,
+    pressure             double precision,
+    temperature2         double precision,
+    sensor_geom          geometry(Point, 4326),
+    elevation            double precision,
+    dist_to_closest_tree double precision,
+    air_measurement      integer,
+    in_park              boolean     not null default false,
+    updated              timestamp,
+    primary key (id, time)
+) partition by range (time);
+
+alter table sensor.measurements
     owner to postgres;
 
-create index sensor_loc15index
-    on sensor.dist_15 using gist (sensor_geom);
+-- rows outside of the daily partitions
+create table sensor.measurements_default
+    partition of sensor.measurements default;
+
+create unique index measurements_key
+    on sensor.measurements (session, time, sensor_geom) nulls not distinct;
+
+create index sensor_loc_index
+    on sensor.measurements using gist (sensor_geom);
 
-create index tree_loc15_index
-    on sensor.dist_15 using gist (tree_geom);
+create index measurements_time_brin
+    on sensor.measurements using brin (time);
 
-create index idx_loc15
-    on sensor.dist_15(location);
+create index idx_measurements_location_time
+    on sensor.measurements (location, time);
 
-create table sensor.dist_10
+-- parks and other green spaces (polygons) - measurements within one are marked in_park when they are loaded (Data
+-- processing/load_data.py). New areas are added as rows; the measurements already loaded are classified again by the
+-- trigger below.
+create table sensor.green_spaces
 (
-    id                           serial
+    green_space_id integer generated always as identity
         primary key,
-    time                         text,
-    location                     text,
-    pm_1                         double precision,
-    pm_25                        double precision,
-    pm_10                        double precision,
-    pm_4                         double precision,
-    temperature                  double precision,
-    humidity                     double precision,
-    pressure                     double precision,
-    temperature2                 double precision,
-    sensor_geom                  geometry(Point, 4326),
-    elevation                    double precision,
-    dist_to_closest_tree         double precision,
-    air_measurement              double precision,
-    tree_number_x                integer,
-    air_tree_id                  text,
-    distance_to_tree             double precision,
-    objectid                     integer,
-    tree_geom                    geometry(Point, 4326),
-    tree_within_d20              boolean,
-    borough                      text,
-    gla_tree_group               text,
-    tree_name                    text,
-    taxon_name                   text,
-    age                          text,
-    age_group                    text,
-    spread_m                     double precision,
-    height_m                     double precision,
-    diameter_at_breast_height_cm double precision,
-    gdb_geomattr_data            double precision,
-    load_date                    timestamp,
-    updated                      timestamp
+    name           text not null
+        unique,
+    geom           geometry(MultiPolygon, 4326) not null
 );
 
-alter table sensor.dist_10
+alter table sensor.green_spaces
     owner to postgres;
 
-create index sensor_loc10index
-    on sensor.dist_10 using gist (sensor_geom);
-
-create index tree_loc10_index
-    on sensor.dist_10 using gist (tree_geom);
-
-create index idx_loc10
-    on sensor.dist_10(location);
-
-create table sensor.dist_20
+create index green_space_geom_index
+    on sensor.green_spaces using gist (geom);
+
+insert into sensor.green_spaces (name, geom)
+values ('park 1', st_multi(st_makeenvelope(-0.0156, 51.4627, -0.0131, 51.464, 4326))),
+       ('park 2', st_multi(st_makeenvelope(-0.0388, 51.4766, -0.03424, 51.4783, 4326))),
+       ('park 3', st_multi(st_makeenvelope(-0.0588, 51.4774, -0.0546, 51.4787, 4326)));
+
+-- measurements in parks (e.g. park / street comparisons select them with: and in_park)
+create index measurements_in_park
+    on sensor.measurements (location, time) where in_park;
+
+-- sets in_park of all measurements, only rows that change are written - returns the number of rows changed
+create or replace function sensor.classify_green_spaces() returns bigint
+    language plpgsql as
+$fn$
+declare
+    changed bigint;
+begin
+    update sensor.measurements m
+    set in_park = p.in_park
+    from (select m2.id,
+                 m2.time,
+                 exists (select 1 from sensor.green_spaces g where st_within(m2.sensor_geom, g.geom)) as in_park
+          from sensor.measurements m2) p
+    where m.id = p.id
+      and m.time = p.time
+      and m.in_park is distinct from p.in_park;
+    get diagnostics changed = row_count;
+    return changed;
+end
+$fn$;
+
+create or replace function sensor.green_spaces_changed() returns trigger
+    language plpgsql as
+$fn$
+begin
+    perform sensor.classify_green_spaces();
+    return null;
+end
+$fn$;
+
+create trigger green_spaces_classify
+    after insert or update or delete or truncate
+    on sensor.green_spaces
+    for each statement
+execute function sensor.green_spaces_changed();
+
+-- creates the partition of sensor.measurements holding one (London) day if it doesn't exist yet
+create or replace function sensor.add_measurement_partition(day date) returns void
+    language plpgsql as
+$fn$
+declare
+    name text := 'measurements_' || to_char(day, 'YYYYMMDD');
+begin
+    if to_regclass('sensor.' || name) is not null then
+        return;
+    end if;
+    -- loaders running at the same time wait for each other instead of creating the same partition twice
+    perform pg_advisory_xact_lock(hashtext('sensor.add_measurement_partition'));
+    execute format('create table if not exists sensor.%I partition of sensor.measurements '
+                   'for values from (%L) to (%L)', name,
+                   day::timestamp at time zone 'Europe/London', (day + 1)::timestamp at time zone 'Europe/London');
+end
+$fn$;
+
+-- canonical tree names (species, see Data processing/tree_species.py) - trees store the small species_id
+create table sensor.species
 (
-    id                           serial
+    species_id smallint generated always as identity
         primary key,
-    time                         text,
-    location                     text,
-    pm_1                         double precision,
-    pm_25                        double precision,
-    pm_10                        double precision,
-    pm_4                         double precision,
-    temperature                  double precision,
-    humidity                     double precision,
-    pressure                     double precision,
-    temperature2                 double precision,
-    sensor_geom                  geometry(Point, 4326),
-    elevation                    double precision,
-    dist_to_closest_tree         double precision,
-    air_measurement              double precision,
-    tree_number_x                integer,
-    air_tree_id                  text,
-    distance_to_tree             double precision,
-    objectid                     integer,
-    tree_geom                    geometry(Point, 4326),
-    tree_within_d20              boolean,
-    borough                      text,
-    gla_tree_group               text,
-    tree_name                    text,
-    taxon_name                   text,
-    age                          text,
-    age_group                    text,
-    spread_m                     double precision,
-    height_m                     double precision,
-    diameter_at_breast_height_cm double precision,
-    gdb_geomattr_data            double precision,
-    load_date                    timestamp,
-    updated                      timestamp
+    tree_name  text not null
+        unique
 );
 
-alter table sensor.dist_20
+alter table sensor.species
     owner to postgres;
 
-create index sensor_loc20index
-    on sensor.dist_20 using gist (sensor_geom);
-
-create index tree_loc20_index
-    on sensor.dist_20 using gist (tree_geom);
-
-create index idx_loc20
-    on sensor.dist_20 (location);
-
-create table sensor.dist_50
+-- one row per tree of the tree database (GLA London tree inventory)
+create table sensor.trees
 (
-    id                           serial
+    objectid                     integer
         primary key,
-    time                         text,
-    location                     text,
-    pm_1                         double precision,
-    pm_25                        double precision,
-    pm_10                        double precision,
-    pm_4                         double precision,
-    temperature                  double precision,
-    humidity                     double precision,
-    pressure                     double precision,
-    temperature2                 double precision,
-    sensor_geom                  geometry(Point, 4326),
-    elevation                    double precision,
-    dist_to_closest_tree         double precision,
-    air_measurement              double precision,
-    tree_number_x                integer,
-    air_tree_id                  text,
-    distance_to_tree             double precision,
-    objectid                     integer,
     tree_geom                    geometry(Point, 4326),
-    tree_within_d20              boolean,
     borough                      text,
     gla_tree_group               text,
-    tree_name                    text,
+    species_id                   smallint
+        references sensor.species,
     taxon_name                   text,
     age                          text,
     age_group                    text,
@@ -263,72 +209,210 @@ create table sensor.dist_50
     height_m                     double precision,
     diameter_at_breast_height_cm double precision,
     gdb_geomattr_data            double precision,
-    load_date                    timestamp,
+    -- row of the tree in the tree database csv (load_trees.py) - trees are numbered in this order in the outputs
+    tree_row                     integer,
     updated                      timestamp
 );
 
-alter table sensor.dist_50
+alter table sensor.trees
     owner to postgres;
 
-create index sensor_loc50index
-    on sensor.dist_50 using gist (sensor_geom);
-
-create index tree_loc50_index
-    on sensor.dist_50 using gist (tree_geom);
-
-create index idx_loc50
-    on sensor.dist_50 (location);
+create index tree_loc_index
+    on sensor.trees using gist (tree_geom);
 
-create table sensor.dist_100
+-- trees within max_radius of each measurement (measurement_id is sensor.measurements.id - there is no foreign key
+-- because the primary key of the partitioned measurements table includes the time)
+create table sensor.tree_matches
 (
-    id                           serial
-        primary key,
-    time                         text,
-    location                     text,
-    pm_1                         double precision,
-    pm_25                        double precision,
-    pm_10                        double precision,
-    pm_4                         double precision,
-    temperature                  double precision,
-    humidity                     double precision,
-    pressure                     double precision,
-    temperature2                 double precision,
-    sensor_geom                  geometry(Point, 4326),
-    elevation                    double precision,
-    dist_to_closest_tree         double precision,
-    air_measurement              double precision,
-    tree_number_x                integer,
-    air_tree_id                  text,
-    distance_to_tree             double precision,
-    objectid                     integer,
-    tree_geom                    geometry(Point, 4326),
-    tree_within_d20              boolean,
-    borough                      text,
-    gla_tree_group               text,
-    tree_name                    text,
-    taxon_name                   text,
-    age                          text,
-    age_group                    text,
-    spread_m                     double precision,
-    height_m                     double precision,
-    diameter_at_breast_height_cm double precision,
-    gdb_geomattr_data            double precision,
-    load_date                    timestamp,
-    updated                      timestamp
+    measurement_id bigint not null,
+    objectid       integer not null
+        references sensor.trees,
+    distance       double precision not null,
+    tree_number    integer,
+    primary key (measurement_id, objectid)
 );
 
-alter table sensor.dist_100
+alter table sensor.tree_matches
     owner to postgres;
 
-create index sensor_loc100index
-    on sensor.dist_100 using gist (sensor_geom);
-
-create index tree_loc100_index
-    on sensor.dist_100 using gist (tree_geom);
+create index idx_tree_matches_tree
+    on sensor.tree_matches (objectid);
+
+-- haversine distance (m) with the earth radius of the python matcher (Data processing/tree_matcher.py), so distances
+-- calculated in the database are the same as in the outputs
+create or replace function sensor.haversine_m(lat1 double precision, lon1 double precision,
+                                              lat2 double precision, lon2 double precision) returns double precision
+    language sql
+    immutable
+    parallel safe as
+$fn$
+select 6378.1 * (2 * asin(sqrt(power(sin((radians(lat1) - radians(lat2)) / 2), 2)
+    + cos(radians(lat2)) * cos(radians(lat1)) * power(sin((radians(lon1) - radians(lon2)) / 2), 2)))) * 1000
+$fn$;
+
+-- trees within a distance (m) of a point are found with st_dwithin on geography using this index
+create index tree_geog_index
+    on sensor.trees using gist ((tree_geom::geography));
+
+-- adds the tree matches of all measurements of a session up to d metres. Candidates are found with st_dwithin (1%
+-- wider) and kept if their haversine distance is at most d, as in the python matcher, and numbered as in the python
+-- outputs (tree_row). Needs the whole tree database in sensor.trees (Data processing/load_trees.py). Returns the
+-- number of matches added.
+create or replace function sensor.match_trees(p_session text, d integer) returns bigint
+    language plpgsql as
+$fn$
+declare
+    added bigint;
+begin
+    -- sampling area of the session (air_tree.sampling_area)
+    with area as (select min(st_y(sensor_geom)) - 0.001  as min_lat,
+                         max(st_y(sensor_geom)) + 0.001  as max_lat,
+                         min(st_x(sensor_geom)) - 0.0015 as min_lon,
+                         max(st_x(sensor_geom)) + 0.0015 as max_lon
+                  from sensor.measurements
+                  where session = p_session),
+         -- trees of the sampling area numbered from 0 in the order of the tree database csv, as the tree numbers
+         -- (Tree number_x) of the python outputs
+         numbered as (select t.objectid, (row_number() over (order by t.tree_row) - 1)::integer as tree_number
+                      from sensor.trees t,
+                           area a
+                      where t.tree_geom && st_makeenvelope(a.min_lon, a.min_lat, a.max_lon, a.max_lat, 4326)
+                        and st_y(t.tree_geom) between a.min_lat and a.max_lat
+                        and st_x(t.tree_geom) between a.min_lon and a.max_lon)
+    insert
+    into sensor.tree_matches (measurement_id, objectid, distance, tree_number)
+    select m.id, c.objectid, c.distance, n.tree_number
+    from sensor.measurements m
+             cross join lateral (
+        select t.objectid,
+               sensor.haversine_m(st_y(m.sensor_geom), st_x(m.sensor_geom), st_y(t.tree_geom), st_x(t.tree_geom))
+                   as distance
+        from sensor.trees t
+        where st_dwithin(t.tree_geom::geography, m.sensor_geom::geography, d * 1.01)
+        ) c
+             left join numbered n on n.objectid = c.objectid
+    where m.session = p_session
+      and c.distance <= d
+    on conflict (measurement_id, objectid) do nothing;
+    get diagnostics added = row_count;
+
+    update sensor.sessions
+    set max_radius = greatest(max_radius, d)
+    where session = p_session;
+    return added;
+end
+$fn$;
+
+-- matches the sessions loaded with a smaller radius up to d metres and creates the view sensor.dist_[d], e.g.
+-- select sensor.add_radius(25); - returns the number of matches added
+create or replace function sensor.add_radius(d integer) returns bigint
+    language plpgsql as
+$fn$
+declare
+    added bigint := 0;
+    s     text;
+begin
+    for s in select session from sensor.sessions where max_radius < d order by session
+        loop
+            added := added + sensor.match_trees(s, d);
+        end loop;
+    perform sensor.create_dist_view(d);
+    return added;
+end
+$fn$;
+
+-- sensor.dist_[d]: measurements with every tree within d metres (one row per measurement and tree, a single row
+-- with empty tree columns if there is none), same columns as the former dist_[d] tables.
+-- Only sessions loaded with a radius of at least d are included.
+create or replace function sensor.create_dist_view(d integer) returns void
+    language plpgsql as
+$fn$
+begin
+    execute format($view$
+        create or replace view sensor.dist_%1$s as
+        select m.id,
+               m.session,
+               m.time,
+               m.location,
+               m.pm_1,
+               m.pm_25,
+               m.pm_10,
+               m.pm_4,
+               m.temperature,
+               m.humidity,
+               m.pressure,
+               m.temperature2,
+               m.sensor_geom,
+               m.elevation,
+               m.dist_to_closest_tree,
+               case when tm.objectid is not null then m.air_measurement end::double precision as air_measurement,
+               tm.tree_number                                   as tree_number_x,
+               m.air_measurement || '_' || tm.tree_number       as air_tree_id,
+               tm.distance                                      as distance_to_tree,
+               t.objectid,
+               t.tree_geom,
+               case when tm.objectid is not null then true end  as tree_within_d20,
+               t.borough,
+               t.gla_tree_group,
+               sp.tree_name,
+               t.taxon_name,
+               t.age,
+               t.age_group,
+               t.spread_m,
+               t.height_m,
+               t.diameter_at_breast_height_cm,
+               t.gdb_geomattr_data,
+               null::timestamp                                  as load_date,
+               m.updated,
+               m.in_park
+        from sensor.measurements m
+                 join sensor.sessions s on s.session = m.session
+                 left join sensor.tree_matches tm on tm.measurement_id = m.id and tm.distance <= %1$s
+                 left join sensor.trees t on t.objectid = tm.objectid
+                 left join sensor.species sp on sp.species_id = t.species_id
+        where s.max_radius >= %1$s
+    $view$, d);
+end
+$fn$;
+
+select sensor.create_dist_view(d)
+from unnest(array [5, 10, 15, 20, 50, 100]) d;
+
+-- tree segments of the sessions (consecutive measurements within d of a tree) with the averages of the closest
+-- previous and next no-tree segments, one row per segment, tree name and pollutant - built by
+-- Data processing/segments.py for a radius (dist) and area ('street' without the parks or 'all')
+create table sensor.tree_segments
+(
+    dist             integer not null,
+    area             text    not null,
+    session          text    not null,
+    location         text,
+    segment_id       integer not null,
+    tree_name        text    not null,
+    pollutant        text    not null,
+    n_rows           integer,
+    avg_dbh_tree     double precision,
+    avg_tree         double precision,
+    prev_segment_id  integer,
+    avg_prev_no_tree double precision,
+    next_segment_id  integer,
+    avg_next_no_tree double precision,
+    primary key (dist, area, session, segment_id, tree_name, pollutant)
+);
 
-create index idx_loc100
-    on sensor.dist_100(location);
+alter table sensor.tree_segments
+    owner to postgres;
 
+create table import.loaded_files
+(
+    file_name text
+        primary key,
+    sha256    text not null,
+    session   text,
+    dist      integer,
+    rows      bigint,
+    loaded_at timestamp
+);
 
 EOSQL
 
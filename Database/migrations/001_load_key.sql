@@ -0,0 +1,43 @@
+-- Adds the session column and the unique load key used by load_data.py to an existing airquality_db
+-- (databases created with the current initdb-postgis.sh already have them).
+-- Run with: psql -U postgres -d airquality_db -f 001_load_key.sql
+
+begin;
+
+do
+$$
+    declare
+        d integer;
+    begin
+        foreach d in array array [5, 10, 15, 20, 50, 100]
+            loop
+                execute format('alter table sensor.dist_%s add column if not exists session text', d);
+
+                -- sessions loaded before were named by date and location ('YYYY-MM-DD_LL')
+                execute format('update sensor.dist_%s set session = left(time, 10) || ''_'' || location '
+                               'where session is null', d);
+
+                -- keep the first copy of rows loaded more than once
+                execute format('delete from sensor.dist_%1$s a using sensor.dist_%1$s b '
+                               'where a.id > b.id and a.session = b.session and a.time = b.time '
+                               'and a.sensor_geom = b.sensor_geom '
+                               'and a.objectid is not distinct from b.objectid', d);
+
+                execute format('create unique index if not exists dist%1$s_key on sensor.dist_%1$s '
+                               '(session, time, sensor_geom, objectid) nulls not distinct', d);
+            end loop;
+    end
+$$;
+
+create table if not exists import.loaded_files
+(
+    file_name text
+        primary key,
+    sha256    text not null,
+    session   text,
+    dist      integer,
+    rows      bigint,
+    loaded_at timestamp
+);
+
+commit;
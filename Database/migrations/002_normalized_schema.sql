@@ -0,0 +1,207 @@
+-- Replaces the wide sensor.dist_[d] tables with the normalized tables sensor.sessions, sensor.measurements,
+-- sensor.trees and sensor.tree_matches, and recreates sensor.dist_[d] as views over them. Data in the old tables is
+-- moved into the new ones. Apply 001_load_key.sql first.
+-- Run with: psql -U postgres -d airquality_db -f 002_normalized_schema.sql
+
+begin;
+
+-- one row per session ('YYYY-MM-DD_LL'), max_radius is the largest radius (m) loaded for the session
+create table if not exists sensor.sessions
+(
+    session    text
+        primary key,
+    location   text not null,
+    max_radius integer not null,
+    loaded_at  timestamp
+);
+
+alter table sensor.sessions
+    owner to postgres;
+
+create index if not exists idx_sessions_location
+    on sensor.sessions (location);
+
+-- one row per located air measurement
+create table if not exists sensor.measurements
+(
+    id                   bigserial
+        primary key,
+    session              text not null
+        references sensor.sessions,
+    time                 text,
+    pm_1                 double precision,
+    pm_25                double precision,
+    pm_10                double precision,
+    pm_4                 double precision,
+    temperature          double precision,
+    humidity             double precision,
+    pressure             double precision,
+    temperature2         double precision,
+    sensor_geom          geometry(Point, 4326),
+    elevation            double precision,
+    dist_to_closest_tree double precision,
+    air_measurement      integer,
+    updated              timestamp
+);
+
+alter table sensor.measurements
+    owner to postgres;
+
+create unique index if not exists measurements_key
+    on sensor.measurements (session, time, sensor_geom) nulls not distinct;
+
+create index if not exists sensor_loc_index
+    on sensor.measurements using gist (sensor_geom);
+
+-- one row per tree of the tree database (GLA London tree inventory)
+create table if not exists sensor.trees
+(
+    objectid                     integer
+        primary key,
+    tree_geom                    geometry(Point, 4326),
+    borough                      text,
+    gla_tree_group               text,
+    tree_name                    text,
+    taxon_name                   text,
+    age                          text,
+    age_group                    text,
+    spread_m                     double precision,
+    height_m                     double precision,
+    diameter_at_breast_height_cm double precision,
+    gdb_geomattr_data            double precision,
+    updated                      timestamp
+);
+
+alter table sensor.trees
+    owner to postgres;
+
+create index if not exists tree_loc_index
+    on sensor.trees using gist (tree_geom);
+
+-- trees within max_radius of each measurement
+create table if not exists sensor.tree_matches
+(
+    measurement_id bigint not null
+        references sensor.measurements
+            on delete cascade,
+    objectid       integer not null
+        references sensor.trees,
+    distance       double precision not null,
+    tree_number    integer,
+    primary key (measurement_id, objectid)
+);
+
+alter table sensor.tree_matches
+    owner to postgres;
+
+create index if not exists idx_tree_matches_tree
+    on sensor.tree_matches (objectid);
+
+-- sensor.dist_[d]: measurements with every tree within d metres (one row per measurement and tree, a single row
+-- with empty tree columns if there is none), same columns as the former dist_[d] tables.
+-- Only sessions loaded with a radius of at least d are included.
+create or replace function sensor.create_dist_view(d integer) returns void
+    language plpgsql as
+$fn$
+begin
+    execute format($view$
+        create or replace view sensor.dist_%1$s as
+        select m.id,
+               m.session,
+               m.time,
+               s.location,
+               m.pm_1,
+               m.pm_25,
+               m.pm_10,
+               m.pm_4,
+               m.temperature,
+               m.humidity,
+               m.pressure,
+               m.temperature2,
+               m.sensor_geom,
+               m.elevation,
+               m.dist_to_closest_tree,
+               case when tm.objectid is not null then m.air_measurement end::double precision as air_measurement,
+               tm.tree_number                                   as tree_number_x,
+               m.air_measurement || '_' || tm.tree_number       as air_tree_id,
+               tm.distance                                      as distance_to_tree,
+               t.objectid,
+               t.tree_geom,
+               case when tm.objectid is not null then true end  as tree_within_d20,
+               t.borough,
+               t.gla_tree_group,
+               t.tree_name,
+               t.taxon_name,
+               t.age,
+               t.age_group,
+               t.spread_m,
+               t.height_m,
+               t.diameter_at_breast_height_cm,
+               t.gdb_geomattr_data,
+               null::timestamp                                  as load_date,
+               m.updated
+        from sensor.measurements m
+                 join sensor.sessions s on s.session = m.session
+                 left join sensor.tree_matches tm on tm.measurement_id = m.id and tm.distance <= %1$s
+                 left join sensor.trees t on t.objectid = tm.objectid
+        where s.max_radius >= %1$s
+    $view$, d);
+end
+$fn$;
+
+do
+$$
+    declare
+        d integer;
+    begin
+        -- largest radius first, so every measurement and tree match is taken from the table holding the most trees
+        foreach d in array array [100, 50, 20, 15, 10, 5]
+            loop
+                if not exists(select 1
+                              from pg_tables
+                              where schemaname = 'sensor' and tablename = 'dist_' || d) then
+                    continue;
+                end if;
+
+                execute format('insert into sensor.sessions (session, location, max_radius, loaded_at) '
+                               'select session, min(location), %1$s, max(updated) from sensor.dist_%1$s '
+                               'where session is not null group by session '
+                               'on conflict (session) do update set '
+                               'max_radius = greatest(sessions.max_radius, excluded.max_radius)', d);
+
+                execute format('insert into sensor.measurements (session, time, pm_1, pm_25, pm_10, pm_4, temperature, '
+                               'humidity, pressure, temperature2, sensor_geom, elevation, dist_to_closest_tree, '
+                               'air_measurement, updated) '
+                               'select distinct on (session, time, sensor_geom) session, time, pm_1, pm_25, pm_10, '
+                               'pm_4, temperature, humidity, pressure, temperature2, sensor_geom, elevation, '
+                               'dist_to_closest_tree, air_measurement, updated from sensor.dist_%1$s '
+                               'where session is not null order by session, time, sensor_geom, air_measurement nulls last '
+                               'on conflict (session, time, sensor_geom) do update set '
+                               'air_measurement = coalesce(measurements.air_measurement, excluded.air_measurement)', d);
+
+                execute format('insert into sensor.trees (objectid, tree_geom, borough, gla_tree_group, tree_name, '
+                               'taxon_name, age, age_group, spread_m, height_m, diameter_at_breast_height_cm, '
+                               'gdb_geomattr_data, updated) '
+                               'select distinct on (objectid) objectid, tree_geom, borough, gla_tree_group, tree_name, '
+                               'taxon_name, age, age_group, spread_m, height_m, diameter_at_breast_height_cm, '
+                               'gdb_geomattr_data, updated from sensor.dist_%1$s where objectid is not null '
+                               'order by objectid, updated desc '
+                               'on conflict (objectid) do nothing', d);
+
+                execute format('insert into sensor.tree_matches (measurement_id, objectid, distance, tree_number) '
+                               'select distinct on (m.id, o.objectid) m.id, o.objectid, o.distance_to_tree, '
+                               'o.tree_number_x from sensor.dist_%1$s o join sensor.measurements m '
+                               'on m.session = o.session and m.time = o.time and m.sensor_geom = o.sensor_geom '
+                               'where o.objectid is not null and o.distance_to_tree is not null '
+                               'order by m.id, o.objectid, o.tree_number_x '
+                               'on conflict (measurement_id, objectid) do nothing', d);
+
+                execute format('drop table sensor.dist_%s', d);
+            end loop;
+    end
+$$;
+
+select sensor.create_dist_view(d)
+from unnest(array [5, 10, 15, 20, 50, 100]) d;
+
+commit;
@@ -0,0 +1,200 @@
+-- Converts sensor.measurements to a table partitioned by day with a timestamptz time column (London local time),
+-- a location column and BRIN (time) / (location, time) indexes. The data is copied in the same transaction and the
+-- sensor.dist_[d] views are recreated. Apply 001_load_key.sql and 002_normalized_schema.sql first.
+-- Run with: psql -U postgres -d airquality_db -f 003_partition_measurements.sql
+
+begin;
+
+-- all measurements are taken in London - dates in queries (e.g. time >= '2024-06-17') are London days
+do
+$$
+    begin
+        execute format('alter database %I set timezone to %L', current_database(), 'Europe/London');
+    end
+$$;
+set timezone to 'Europe/London';
+
+-- the views are recreated at the end for the same radii
+create temporary table dist_views on commit drop as
+select substr(viewname, 6)::integer as d
+from pg_views
+where schemaname = 'sensor'
+  and viewname ~ '^dist_[0-9]+$';
+
+do
+$$
+    declare
+        d integer;
+    begin
+        for d in select * from dist_views
+            loop
+                execute format('drop view sensor.dist_%s', d);
+            end loop;
+    end
+$$;
+
+alter table sensor.tree_matches
+    drop constraint if exists tree_matches_measurement_id_fkey;
+
+alter table sensor.measurements
+    rename to measurements_old;
+alter index sensor.measurements_pkey
+    rename to measurements_old_pkey;
+alter index sensor.measurements_key
+    rename to measurements_old_key;
+alter index sensor.sensor_loc_index
+    rename to measurements_old_loc_index;
+alter sequence sensor.measurements_id_seq
+    rename to measurements_old_id_seq;
+
+-- one row per located air measurement, partitioned by day (see sensor.add_measurement_partition)
+create table sensor.measurements
+(
+    id                   bigserial,
+    session              text        not null
+        references sensor.sessions,
+    location             text        not null,
+    time                 timestamptz not null,
+    pm_1                 double precision,
+    pm_25                double precision,
+    pm_10                double precision,
+    pm_4                 double precision,
+    temperature          double precision,
+    humidity             double precision,
+    pressure             double precision,
+    temperature2         double precision,
+    sensor_geom          geometry(Point, 4326),
+    elevation            double precision,
+    dist_to_closest_tree double precision,
+    air_measurement      integer,
+    updated              timestamp,
+    primary key (id, time)
+) partition by range (time);
+
+alter table sensor.measurements
+    owner to postgres;
+
+-- rows outside of the daily partitions
+create table sensor.measurements_default
+    partition of sensor.measurements default;
+
+-- creates the partition of sensor.measurements holding one (London) day if it doesn't exist yet
+create or replace function sensor.add_measurement_partition(day date) returns void
+    language plpgsql as
+$fn$
+declare
+    name text := 'measurements_' || to_char(day, 'YYYYMMDD');
+begin
+    if to_regclass('sensor.' || name) is not null then
+        return;
+    end if;
+    -- loaders running at the same time wait for each other instead of creating the same partition twice
+    perform pg_advisory_xact_lock(hashtext('sensor.add_measurement_partition'));
+    execute format('create table if not exists sensor.%I partition of sensor.measurements '
+                   'for values from (%L) to (%L)', name,
+                   day::timestamp at time zone 'Europe/London', (day + 1)::timestamp at time zone 'Europe/London');
+end
+$fn$;
+
+select sensor.add_measurement_partition(day)
+from (select distinct left(time, 10)::date as day from sensor.measurements_old) days;
+
+insert into sensor.measurements (id, session, location, time, pm_1, pm_25, pm_10, pm_4, temperature, humidity,
+                                 pressure, temperature2, sensor_geom, elevation, dist_to_closest_tree,
+                                 air_measurement, updated)
+select o.id,
+       o.session,
+       s.location,
+       o.time::timestamp at time zone 'Europe/London',
+       o.pm_1,
+       o.pm_25,
+       o.pm_10,
+       o.pm_4,
+       o.temperature,
+       o.humidity,
+       o.pressure,
+       o.temperature2,
+       o.sensor_geom,
+       o.elevation,
+       o.dist_to_closest_tree,
+       o.air_measurement,
+       o.updated
+from sensor.measurements_old o
+         join sensor.sessions s on s.session = o.session;
+
+select setval(pg_get_serial_sequence('sensor.measurements', 'id'),
+              coalesce((select max(id) from sensor.measurements), 0) + 1, false);
+
+drop table sensor.measurements_old;
+
+-- indexes are built after the copy
+create unique index measurements_key
+    on sensor.measurements (session, time, sensor_geom) nulls not distinct;
+
+create index sensor_loc_index
+    on sensor.measurements using gist (sensor_geom);
+
+create index measurements_time_brin
+    on sensor.measurements using brin (time);
+
+create index idx_measurements_location_time
+    on sensor.measurements (location, time);
+
+-- sensor.dist_[d]: measurements with every tree within d metres (one row per measurement and tree, a single row
+-- with empty tree columns if there is none), same columns as the former dist_[d] tables.
+-- Only sessions loaded with a radius of at least d are included.
+create or replace function sensor.create_dist_view(d integer) returns void
+    language plpgsql as
+$fn$
+begin
+    execute format($view$
+        create or replace view sensor.dist_%1$s as
+        select m.id,
+               m.session,
+               m.time,
+               m.location,
+               m.pm_1,
+               m.pm_25,
+               m.pm_10,
+               m.pm_4,
+               m.temperature,
+               m.humidity,
+               m.pressure,
+               m.temperature2,
+               m.sensor_geom,
+               m.elevation,
+               m.dist_to_closest_tree,
+               case when tm.objectid is not null then m.air_measurement end::double precision as air_measurement,
+               tm.tree_number                                   as tree_number_x,
+               m.air_measurement || '_' || tm.tree_number       as air_tree_id,
+               tm.distance                                      as distance_to_tree,
+               t.objectid,
+               t.tree_geom,
+               case when tm.objectid is not null then true end  as tree_within_d20,
+               t.borough,
+               t.gla_tree_group,
+               t.tree_name,
+               t.taxon_name,
+               t.age,
+               t.age_group,
+               t.spread_m,
+               t.height_m,
+               t.diameter_at_breast_height_cm,
+               t.gdb_geomattr_data,
+               null::timestamp                                  as load_date,
+               m.updated
+        from sensor.measurements m
+                 join sensor.sessions s on s.session = m.session
+                 left join sensor.tree_matches tm on tm.measurement_id = m.id and tm.distance <= %1$s
+                 left join sensor.trees t on t.objectid = tm.objectid
+        where s.max_radius >= %1$s
+    $view$, d);
+end
+$fn$;
+
+select sensor.create_dist_view(d)
+from dist_views;
+
+commit;
+
+analyze sensor.measurements;
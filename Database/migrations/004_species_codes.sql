@@ -0,0 +1,118 @@
+-- Stores tree names as codes into the new sensor.species table (sensor.trees.species_id instead of the tree_name
+-- text column) and recreates the sensor.dist_[d] views, which show the name from sensor.species.
+-- Existing names are only trimmed and their quotes and whitespace normalised here - the species mapping of
+-- Data processing/tree_species.py is applied to outputs created with the current scripts (load them again with
+-- python load_data.py --force). Apply 001 - 003 first.
+-- Run with: psql -U postgres -d airquality_db -f 004_species_codes.sql
+
+begin;
+
+-- the views are recreated at the end for the same radii
+create temporary table dist_views on commit drop as
+select substr(viewname, 6)::integer as d
+from pg_views
+where schemaname = 'sensor'
+  and viewname ~ '^dist_[0-9]+$';
+
+do
+$$
+    declare
+        d integer;
+    begin
+        for d in select * from dist_views
+            loop
+                execute format('drop view sensor.dist_%s', d);
+            end loop;
+    end
+$$;
+
+-- canonical tree names (species, see Data processing/tree_species.py) - trees store the small species_id
+create table sensor.species
+(
+    species_id smallint generated always as identity
+        primary key,
+    tree_name  text not null
+        unique
+);
+
+alter table sensor.species
+    owner to postgres;
+
+update sensor.trees
+set tree_name = nullif(btrim(regexp_replace(translate(tree_name, '‘’“”', ''''""'), '\s+', ' ', 'g')), '');
+
+insert into sensor.species (tree_name)
+select distinct tree_name
+from sensor.trees
+where tree_name is not null
+order by tree_name;
+
+alter table sensor.trees
+    add column species_id smallint
+        references sensor.species;
+
+update sensor.trees t
+set species_id = sp.species_id
+from sensor.species sp
+where sp.tree_name = t.tree_name;
+
+alter table sensor.trees
+    drop column tree_name;
+
+-- sensor.dist_[d]: measurements with every tree within d metres (one row per measurement and tree, a single row
+-- with empty tree columns if there is none), same columns as the former dist_[d] tables.
+-- Only sessions loaded with a radius of at least d are included.
+create or replace function sensor.create_dist_view(d integer) returns void
+    language plpgsql as
+$fn$
+begin
+    execute format($view$
+        create or replace view sensor.dist_%1$s as
+        select m.id,
+               m.session,
+               m.time,
+               m.location,
+               m.pm_1,
+               m.pm_25,
+               m.pm_10,
+               m.pm_4,
+               m.temperature,
+               m.humidity,
+               m.pressure,
+               m.temperature2,
+               m.sensor_geom,
+               m.elevation,
+               m.dist_to_closest_tree,
+               case when tm.objectid is not null then m.air_measurement end::double precision as air_measurement,
+               tm.tree_number                                   as tree_number_x,
+               m.air_measurement || '_' || tm.tree_number       as air_tree_id,
+               tm.distance                                      as distance_to_tree,
+               t.objectid,
+               t.tree_geom,
+               case when tm.objectid is not null then true end  as tree_within_d20,
+               t.borough,
+               t.gla_tree_group,
+               sp.tree_name,
+               t.taxon_name,
+               t.age,
+               t.age_group,
+               t.spread_m,
+               t.height_m,
+               t.diameter_at_breast_height_cm,
+               t.gdb_geomattr_data,
+               null::timestamp                                  as load_date,
+               m.updated
+        from sensor.measurements m
+                 join sensor.sessions s on s.session = m.session
+                 left join sensor.tree_matches tm on tm.measurement_id = m.id and tm.distance <= %1$s
+                 left join sensor.trees t on t.objectid = tm.objectid
+                 left join sensor.species sp on sp.species_id = t.species_id
+        where s.max_radius >= %1$s
+    $view$, d);
+end
+$fn$;
+
+select sensor.create_dist_view(d)
+from dist_views;
+
+commit;
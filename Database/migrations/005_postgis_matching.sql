@@ -0,0 +1,96 @@
+-- Adds tree matching in the database: sensor.haversine_m, the tree database row of every tree (sensor.trees.tree_row),
+-- a geography index on sensor.trees and the functions sensor.match_trees (matches of one session up to a radius) and
+-- sensor.add_radius (new radius for all sessions and its dist_[d] view). Load the whole tree database first with
+-- Data processing/load_trees.py (again, if it was loaded before this migration). Apply 001 - 004 first.
+-- Run with: psql -U postgres -d airquality_db -f 005_postgis_matching.sql
+
+begin;
+
+-- row of the tree in the tree database csv (load_trees.py) - trees are numbered in this order in the outputs
+alter table sensor.trees
+    add column if not exists tree_row integer;
+
+-- haversine distance (m) with the earth radius of the python matcher (Data processing/tree_matcher.py), so distances
+-- calculated in the database are the same as in the outputs
+create or replace function sensor.haversine_m(lat1 double precision, lon1 double precision,
+                                              lat2 double precision, lon2 double precision) returns double precision
+    language sql
+    immutable
+    parallel safe as
+$fn$
+select 6378.1 * (2 * asin(sqrt(power(sin((radians(lat1) - radians(lat2)) / 2), 2)
+    + cos(radians(lat2)) * cos(radians(lat1)) * power(sin((radians(lon1) - radians(lon2)) / 2), 2)))) * 1000
+$fn$;
+
+-- trees within a distance (m) of a point are found with st_dwithin on geography using this index
+create index if not exists tree_geog_index
+    on sensor.trees using gist ((tree_geom::geography));
+
+-- adds the tree matches of all measurements of a session up to d metres. Candidates are found with st_dwithin (1%
+-- wider) and kept if their haversine distance is at most d, as in the python matcher, and numbered as in the python
+-- outputs (tree_row). Needs the whole tree database in sensor.trees (Data processing/load_trees.py). Returns the
+-- number of matches added.
+create or replace function sensor.match_trees(p_session text, d integer) returns bigint
+    language plpgsql as
+$fn$
+declare
+    added bigint;
+begin
+    -- sampling area of the session (air_tree.sampling_area)
+    with area as (select min(st_y(sensor_geom)) - 0.001  as min_lat,
+                         max(st_y(sensor_geom)) + 0.001  as max_lat,
+                         min(st_x(sensor_geom)) - 0.0015 as min_lon,
+                         max(st_x(sensor_geom)) + 0.0015 as max_lon
+                  from sensor.measurements
+                  where session = p_session),
+         -- trees of the sampling area numbered from 0 in the order of the tree database csv, as the tree numbers
+         -- (Tree number_x) of the python outputs
+         numbered as (select t.objectid, (row_number() over (order by t.tree_row) - 1)::integer as tree_number
+                      from sensor.trees t,
+                           area a
+                      where t.tree_geom && st_makeenvelope(a.min_lon, a.min_lat, a.max_lon, a.max_lat, 4326)
+                        and st_y(t.tree_geom) between a.min_lat and a.max_lat
+                        and st_x(t.tree_geom) between a.min_lon and a.max_lon)
+    insert
+    into sensor.tree_matches (measurement_id, objectid, distance, tree_number)
+    select m.id, c.objectid, c.distance, n.tree_number
+    from sensor.measurements m
+             cross join lateral (
+        select t.objectid,
+               sensor.haversine_m(st_y(m.sensor_geom), st_x(m.sensor_geom), st_y(t.tree_geom), st_x(t.tree_geom))
+                   as distance
+        from sensor.trees t
+        where st_dwithin(t.tree_geom::geography, m.sensor_geom::geography, d * 1.01)
+        ) c
+             left join numbered n on n.objectid = c.objectid
+    where m.session = p_session
+      and c.distance <= d
+    on conflict (measurement_id, objectid) do nothing;
+    get diagnostics added = row_count;
+
+    update sensor.sessions
+    set max_radius = greatest(max_radius, d)
+    where session = p_session;
+    return added;
+end
+$fn$;
+
+-- matches the sessions loaded with a smaller radius up to d metres and creates the view sensor.dist_[d], e.g.
+-- select sensor.add_radius(25); - returns the number of matches added
+create or replace function sensor.add_radius(d integer) returns bigint
+    language plpgsql as
+$fn$
+declare
+    added bigint := 0;
+    s     text;
+begin
+    for s in select session from sensor.sessions where max_radius < d order by session
+        loop
+            added := added + sensor.match_trees(s, d);
+        end loop;
+    perform sensor.create_dist_view(d);
+    return added;
+end
+$fn$;
+
+commit;
@@ -0,0 +1,32 @@
+-- Adds sensor.tree_segments, the tree / no-tree segment table used by Data analysis/t-test_tree_no_tree.R (built
+-- with Data processing/segments.py). Apply 001 - 005 first.
+-- Run with: psql -U postgres -d airquality_db -f 006_tree_segments.sql
+
+begin;
+
+-- tree segments of the sessions (consecutive measurements within d of a tree) with the averages of the closest
+-- previous and next no-tree segments, one row per segment, tree name and pollutant - built by
+-- Data processing/segments.py for a radius (dist) and area ('street' without the parks or 'all')
+create table if not exists sensor.tree_segments
+(
+    dist             integer not null,
+    area             text    not null,
+    session          text    not null,
+    location         text,
+    segment_id       integer not null,
+    tree_name        text    not null,
+    pollutant        text    not null,
+    n_rows           integer,
+    avg_dbh_tree     double precision,
+    avg_tree         double precision,
+    prev_segment_id  integer,
+    avg_prev_no_tree double precision,
+    next_segment_id  integer,
+    avg_next_no_tree double precision,
+    primary key (dist, area, session, segment_id, tree_name, pollutant)
+);
+
+alter table sensor.tree_segments
+    owner to postgres;
+
+commit;
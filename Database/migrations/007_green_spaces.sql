@@ -0,0 +1,152 @@
+-- Adds sensor.green_spaces (park polygons, seeded with the three park envelopes of the analysis scripts) and
+-- sensor.measurements.in_park, which is set when measurements are loaded and by a trigger when green spaces change.
+-- The sensor.dist_[d] views are recreated with the in_park column. Apply 001 - 006 first.
+-- Run with: psql -U postgres -d airquality_db -f 007_green_spaces.sql
+
+begin;
+
+-- the views are recreated at the end for the same radii
+create temporary table dist_views on commit drop as
+select substr(viewname, 6)::integer as d
+from pg_views
+where schemaname = 'sensor'
+  and viewname ~ '^dist_[0-9]+$';
+
+do
+$$
+    declare
+        d integer;
+    begin
+        for d in select * from dist_views
+            loop
+                execute format('drop view sensor.dist_%s', d);
+            end loop;
+    end
+$$;
+
+alter table sensor.measurements
+    add column in_park boolean not null default false;
+
+-- parks and other green spaces (polygons) - measurements within one are marked in_park when they are loaded (Data
+-- processing/load_data.py). New areas are added as rows; the measurements already loaded are classified again by the
+-- trigger below.
+create table sensor.green_spaces
+(
+    green_space_id integer generated always as identity
+        primary key,
+    name           text not null
+        unique,
+    geom           geometry(MultiPolygon, 4326) not null
+);
+
+alter table sensor.green_spaces
+    owner to postgres;
+
+create index green_space_geom_index
+    on sensor.green_spaces using gist (geom);
+
+insert into sensor.green_spaces (name, geom)
+values ('park 1', st_multi(st_makeenvelope(-0.0156, 51.4627, -0.0131, 51.464, 4326))),
+       ('park 2', st_multi(st_makeenvelope(-0.0388, 51.4766, -0.03424, 51.4783, 4326))),
+       ('park 3', st_multi(st_makeenvelope(-0.0588, 51.4774, -0.0546, 51.4787, 4326)));
+
+-- measurements in parks (e.g. park / street comparisons select them with: and in_park)
+create index measurements_in_park
+    on sensor.measurements (location, time) where in_park;
+
+-- sets in_park of all measurements, only rows that change are written - returns the number of rows changed
+create or replace function sensor.classify_green_spaces() returns bigint
+    language plpgsql as
+$fn$
+declare
+    changed bigint;
+begin
+    update sensor.measurements m
+    set in_park = p.in_park
+    from (select m2.id,
+                 m2.time,
+                 exists (select 1 from sensor.green_spaces g where st_within(m2.sensor_geom, g.geom)) as in_park
+          from sensor.measurements m2) p
+    where m.id = p.id
+      and m.time = p.time
+      and m.in_park is distinct from p.in_park;
+    get diagnostics changed = row_count;
+    return changed;
+end
+$fn$;
+
+create or replace function sensor.green_spaces_changed() returns trigger
+    language plpgsql as
+$fn$
+begin
+    perform sensor.classify_green_spaces();
+    return null;
+end
+$fn$;
+
+create trigger green_spaces_classify
+    after insert or update or delete or truncate
+    on sensor.green_spaces
+    for each statement
+execute function sensor.green_spaces_changed();
+
+select sensor.classify_green_spaces();
+
+-- sensor.dist_[d]: measurements with every tree within d metres (one row per measurement and tree, a single row
+-- with empty tree columns if there is none), same columns as the former dist_[d] tables.
+-- Only sessions loaded with a radius of at least d are included.
+create or replace function sensor.create_dist_view(d integer) returns void
+    language plpgsql as
+$fn$
+begin
+    execute format($view$
+        create or replace view sensor.dist_%1$s as
+        select m.id,
+               m.session,
+               m.time,
+               m.location,
+               m.pm_1,
+               m.pm_25,
+               m.pm_10,
+               m.pm_4,
+               m.temperature,
+               m.humidity,
+               m.pressure,
+               m.temperature2,
+               m.sensor_geom,
+               m.elevation,
+               m.dist_to_closest_tree,
+               case when tm.objectid is not null then m.air_measurement end::double precision as air_measurement,
+               tm.tree_number                                   as tree_number_x,
+               m.air_measurement || '_' || tm.tree_number       as air_tree_id,
+               tm.distance                                      as distance_to_tree,
+               t.objectid,
+               t.tree_geom,
+               case when tm.objectid is not null then true end  as tree_within_d20,
+               t.borough,
+               t.gla_tree_group,
+               sp.tree_name,
+               t.taxon_name,
+               t.age,
+               t.age_group,
+               t.spread_m,
+               t.height_m,
+               t.diameter_at_breast_height_cm,
+               t.gdb_geomattr_data,
+               null::timestamp                                  as load_date,
+               m.updated,
+               m.in_park
+        from sensor.measurements m
+                 join sensor.sessions s on s.session = m.session
+                 left join sensor.tree_matches tm on tm.measurement_id = m.id and tm.distance <= %1$s
+                 left join sensor.trees t on t.objectid = tm.objectid
+                 left join sensor.species sp on sp.species_id = t.species_id
+        where s.max_radius >= %1$s
+    $view$, d);
+end
+$fn$;
+
+select sensor.create_dist_view(d)
+from dist_views;
+
+commit;